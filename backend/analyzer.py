@@ -1,29 +1,71 @@
+import contextlib
+import copy
 import dataclasses
-from typing import Any, Awaitable, Callable, List, Optional, Tuple, cast
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple, cast
 
 import anyio
+import anyio.to_thread
 import asyncssh
 import chess
 import re
 import chess.engine
 import chess.pgn
 import db
-import tortoise.exceptions
-from anyio.streams.memory import MemoryObjectReceiveStream
-from pgn_feed import PgnFeed
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+from bundle_columns import BundleColumns, Totals
+from eval_store import POSITION_TOTALS_FIELDS, EvaluationStore
+from evaluations_cache import EvaluationsCache
+from games_cache import GamesListCache
+from lean_uci import LeanUciProtocol, get_lean_pv
+from pgn_feed import PgnFeedHub
+from positions_cache import PositionsCache
+from pv_cache import PvCache
+from transpositions import TranspositionTable, search_options, transposition_key
+from tortoise.transactions import in_transaction
 from sanic.log import logger
-from ws_notifier import WebsocketNotifier
+from ws_notifier import (
+    WebsocketNotifier,
+    WebsocketResponse,
+    WsEvaluationData,
+    make_evaluations_update,
+    make_game_update,
+)
 from movetime_estimator import MovetimeEstimator
 
 
 @dataclasses.dataclass
-class Totals:
-    nodes: int
-    score_q: int
-    score_white: int
-    score_draw: int
-    score_black: int
-    moves_left: Optional[int] = None
+class PreparedBundle:
+    # Copy of the position with the totals of the bundle applied.
+    position: db.GamePosition
+    evaluation: db.GamePositionEvaluation
+    moves: list[db.GamePositionEvaluationMove]
+    evaluations: list[WsEvaluationData]
+    response: WebsocketResponse
+
+
+# Groups multipv infos into complete bundles.
+class InfoBundleCollector:
+    _multipv: int
+    _info_bundle: list[chess.engine.InfoDict]
+
+    def __init__(self, multipv: int):
+        self._multipv = multipv
+        self._info_bundle = []
+
+    # Returns the bundle when `info` completes it.
+    def add(self, info: chess.engine.InfoDict) -> Optional[list[chess.engine.InfoDict]]:
+        if "multipv" not in info:
+            logger.warning(f"Got info without multipv: {info}")
+            return None
+        if info["multipv"] != len(self._info_bundle) + 1:
+            logger.error(f"Got info for wrong multipv: {info}")
+            self._info_bundle = []
+            return None
+        self._info_bundle.append(info)
+        if len(self._info_bundle) < self._multipv:
+            return None
+        info_bundle, self._info_bundle = self._info_bundle, []
+        return info_bundle
 
 
 def get_totals(info_bundle: list[chess.engine.InfoDict]) -> Totals:
@@ -55,6 +97,13 @@ def get_totals(info_bundle: list[chess.engine.InfoDict]) -> Totals:
     return totals
 
 
+# The PV as a list of UCI moves, both for python-chess and lean (raw text) infos.
+def get_pv_uci(info: chess.engine.InfoDict) -> list[str]:
+    if (pv_uci := get_lean_pv(info)) is not None:
+        return pv_uci.split()
+    return [move.uci() for move in info.get("pv", [])]
+
+
 def get_leaf_board(pgn: chess.pgn.Game) -> chess.Board:
     board = pgn.board()
     for move in pgn.mainline_moves():
@@ -62,24 +111,6 @@ def get_leaf_board(pgn: chess.pgn.Game) -> chess.Board:
     return board
 
 
-def make_pv_san_string(board: chess.Board, pv: List[chess.Move]) -> str:
-    board = board.copy()
-    sans: list[str] = []
-    for move in pv:
-        sans.append(board.san(move))
-        board.push(move)
-    return " ".join(sans)
-
-
-def make_pv_uci_string(board: chess.Board, pv: List[chess.Move]) -> str:
-    board = board.copy()
-    moves = []
-    for move in pv:
-        moves.append(move.uci())
-        board.push(move)
-    return " ".join(moves)
-
-
 class Analyzer:
     _config: dict
     _game: Optional[db.Game]
@@ -87,91 +118,113 @@ class Analyzer:
     _engine: chess.engine.Protocol
     _get_next_task_callback: Callable[[], Awaitable[db.Game]]
     _ws_notifier: WebsocketNotifier
+    _eval_store: EvaluationStore
+    _transpositions: TranspositionTable
+    _pgn_feeds: PgnFeedHub
+    _positions_cache: PositionsCache
+    _evaluations_cache: EvaluationsCache
+    _games_list: GamesListCache
     _uci_lock: anyio.Lock
     _uci_cancelation_lock: anyio.Lock
     _connection: asyncssh.SSHClientConnection
     _movetime_estimator: MovetimeEstimator
+    _pv_cache: PvCache
+    _dropped_bundles: int
+    _ponder_results: dict[str, list[chess.engine.InfoDict]]
+    _ponder_hits: int
+    _ponder_misses: int
+    # Positions of the current game stored in the DB, indexed by ply.
+    _mainline: list[db.GamePosition]
+    # Transposition table keys of the positions of the current game, by id.
+    _transposition_keys: dict[int, int]
+    _search_options: dict[str, str]
 
     def __init__(
         self,
         uci_config: dict,
         next_task_callback: Callable[[], Awaitable[db.Game]],
         ws_notifier: WebsocketNotifier,
+        eval_store: EvaluationStore,
+        transpositions: TranspositionTable,
+        pgn_feeds: PgnFeedHub,
+        positions_cache: PositionsCache,
+        evaluations_cache: EvaluationsCache,
+        games_list: GamesListCache,
     ):
         self._config = uci_config
         self._game = None
         self._get_next_task_callback = next_task_callback
         self._current_position = None
         self._ws_notifier = ws_notifier
+        self._eval_store = eval_store
+        self._transpositions = transpositions
+        self._pgn_feeds = pgn_feeds
+        self._positions_cache = positions_cache
+        self._evaluations_cache = evaluations_cache
+        self._games_list = games_list
         self._uci_lock = anyio.Lock()
         self._uci_cancelation_lock = anyio.Lock()
         self._movetime_estimator = MovetimeEstimator("300+10")
+        self._pv_cache = PvCache()
+        self._dropped_bundles = 0
+        self._ponder_results = {}
+        self._ponder_hits = 0
+        self._ponder_misses = 0
+        self._mainline = []
+        self._transposition_keys = {}
+        self._search_options = search_options(uci_config.get("command", []))
 
-    # returns the last ply number.
+    # Diffs the PGN against the cached mainline, only writes the changed tail.
+    # Returns the last position.
     async def _update_game_db(
         self, pgn: chess.pgn.Game, game: db.Game
     ) -> db.GamePosition:
         board = pgn.board()
+        mainline = self._mainline
+        nodes = list(pgn.mainline())
+
+        # Number of leading plies that are already in the DB.
+        common = 0
+        if mainline and mainline[0].fen == board.fen():
+            common = 1
+            while (
+                common < len(mainline)
+                and common <= len(nodes)
+                and mainline[common].move_uci == nodes[common - 1].move.uci()
+            ):
+                board.push(nodes[common - 1].move)
+                common += 1
+        if common == len(mainline) and common == len(nodes) + 1:
+            return mainline[-1]
+
         white_clock: Optional[int] = None
         black_clock: Optional[int] = None
+        if common > 0:
+            white_clock = mainline[common - 1].white_clock
+            black_clock = mainline[common - 1].black_clock
 
-        added_game_positions: list[db.GamePosition] = []
-
-        async def create_pos(
-            ply: int,
-            move_uci: Optional[str],
-            move_san: Optional[str],
+        def make_pos(
+            ply: int, move_uci: Optional[str], move_san: Optional[str]
         ) -> db.GamePosition:
-            res, created = await db.GamePosition.get_or_create(
+            return db.GamePosition(
                 game=game,
                 ply_number=ply,
-                defaults={
-                    "fen": board.fen(),
-                    "move_uci": move_uci,
-                    "move_san": move_san,
-                    "white_clock": white_clock,
-                    "black_clock": black_clock,
-                    "nodes": 0,
-                    "q_score": 0,
-                    "white_score": 0,
-                    "draw_score": 0,
-                    "black_score": 0,
-                },
+                fen=board.fen(),
+                move_uci=move_uci,
+                move_san=move_san,
+                white_clock=white_clock,
+                black_clock=black_clock,
+                nodes=0,
+                q_score=0,
+                white_score=0,
+                draw_score=0,
+                black_score=0,
             )
-            if created:
-                added_game_positions.append(res)
-            else:
-                if res.move_uci != move_uci or res.fen != board.fen():
-                    logger.error(
-                        f"Move UCI mismatch: {res.move_uci} != {move_uci}, "
-                        f"{res.fen}!={board.fen()} ply={ply}"
-                    )
-                    await res.delete()
-                    res = await db.GamePosition.create(
-                        game=game,
-                        ply_number=ply,
-                        fen=board.fen(),
-                        move_uci=move_uci,
-                        move_san=move_san,
-                        white_clock=white_clock,
-                        black_clock=black_clock,
-                        nodes=0,
-                        q_score=0,
-                        white_score=0,
-                        draw_score=0,
-                        black_score=0,
-                    )
-                    added_game_positions.append(res)
 
-            return res
-
-        last_pos: db.GamePosition = await create_pos(
-            ply=0,
-            move_uci=None,
-            move_san=None,
-        )
-
-        for ply, node in enumerate(pgn.mainline(), start=1):
+        new_positions: list[db.GamePosition] = []
+        if common == 0:
+            new_positions.append(make_pos(0, None, None))
+        for ply, node in enumerate(nodes[max(common - 1, 0) :], start=max(common, 1)):
             clock = node.clock()
             if clock:
                 if board.turn == chess.WHITE:
@@ -180,20 +233,94 @@ class Analyzer:
                     black_clock = int(clock)
             san = board.san(node.move)
             board.push(move=node.move)
-            last_pos = await create_pos(
-                ply=ply,
-                move_uci=node.move.uci(),
-                move_san=san,
+            new_positions.append(make_pos(ply, node.move.uci(), san))
+
+        truncate_from_ply: Optional[int] = None
+        if common < len(mainline):
+            stale = mainline[common:]
+            logger.error(
+                f"Mainline mismatch at ply={common}: replacing {len(stale)} "
+                f"positions with {len(new_positions)}, game_id={game.id}"
             )
+            # The task analyzing the old position is only cancelled once the new
+            # one is known. Until then, its updates for the stale positions are
+            # ignored (see _publish_info_bundle()).
+            self._mainline = mainline[:common]
+            self._eval_store.discard([p.id for p in stale])
+            for p in stale:
+                self._transposition_keys.pop(p.id, None)
+            truncate_from_ply = common
+        async with in_transaction() as conn:
+            # Also the rows after a gap in the stored mainline, which were never
+            # loaded (see _load_mainline()).
+            stale_rows = db.GamePosition.filter(game=game, ply_number__gte=common)
+            await stale_rows.using_db(conn).delete()
+            added_game_positions: list[db.GamePosition] = []
+            if new_positions:
+                await db.GamePosition.bulk_create(new_positions, using_db=conn)
+                # bulk_create doesn't fill in the ids on every backend.
+                added_game_positions = (
+                    await db.GamePosition.filter(game=game, ply_number__gte=common)
+                    .using_db(conn)
+                    .order_by("ply_number")
+                )
+        self._mainline = mainline[:common] + added_game_positions
+        self._evaluations_cache.discard_from(game.id, common)
+
+        await self._seed_from_transpositions(added_game_positions)
+        self._positions_cache.set_game(game.id, self._mainline)
         await self._ws_notifier.send_game_update(
-            game_id=game.id, positions=added_game_positions
+            game_id=game.id,
+            positions=added_game_positions,
+            truncate_from_ply=truncate_from_ply,
         )
-        return last_pos
+        return self._mainline[-1]
+
+    async def _load_mainline(self, game: db.Game) -> None:
+        positions = await db.GamePosition.filter(game=game).order_by("ply_number")
+        self._mainline = []
+        self._transposition_keys = {}
+        for pos in positions:
+            if pos.ply_number != len(self._mainline):
+                logger.warning(f"Gap in the stored mainline of game {game.id}")
+                break
+            # Positions with not yet flushed evaluations have fresher totals.
+            if pending := self._eval_store.get_pending(pos.id):
+                pos = pending.position
+            self._mainline.append(pos)
+        self._positions_cache.set_game(game.id, self._mainline)
+
+    def _transposition_key(self, pos: db.GamePosition) -> int:
+        if (key := self._transposition_keys.get(pos.id)) is None:
+            key = transposition_key(pos.fen, self._search_options)
+            self._transposition_keys[pos.id] = key
+        return key
+
+    # New positions that were already searched with the same engine in any game
+    # start from the best known evaluation.
+    async def _seed_from_transpositions(self, positions: list[db.GamePosition]):
+        if not positions:
+            return
+        keys = [self._transposition_key(pos) for pos in positions]
+        known = await self._transpositions.lookup(keys)
+        for pos, key in zip(positions, keys):
+            if (entry := known.get(key)) is None:
+                continue
+            logger.info(f"Seeding ply {pos.ply_number} with {entry.nodes} nodes")
+            for field, value in entry.position.items():
+                setattr(pos, field, value)
+            evaluation, moves = entry.make_evaluation(pos)
+            self._eval_store.put(pos, evaluation, moves, key)
 
     def get_game(self) -> Optional[db.Game]:
         return self._game
 
     async def run(self):
+        protocol_cls: type[chess.engine.UciProtocol] = (
+            LeanUciProtocol
+            if self._config.get("lean_info", False)
+            else chess.engine.UciProtocol
+        )
         async with self._uci_lock:
             if "ssh" in self._config:
                 self._connection = await asyncssh.connect(
@@ -205,13 +332,13 @@ class Analyzer:
                     await self._connection.create_subprocess(
                         protocol_factory=cast(
                             asyncssh.subprocess.SubprocessFactory,
-                            chess.engine.UciProtocol,
+                            protocol_cls,
                         ),
                         command=" ".join(self._config["command"]),
                     ),
                 )
             else:
-                _, self._engine = await chess.engine.popen_uci(
+                _, self._engine = await protocol_cls.popen(
                     command=self._config["command"]
                 )
             await self._engine.initialize()
@@ -224,25 +351,25 @@ class Analyzer:
         self._movetime_estimator = MovetimeEstimator(
             game.tournament.time_control or "300+10"
         )
+        await self._load_mainline(game)
+        self._games_list.invalidate()
         await self._ws_notifier.send_game_entry_update(game, is_being_analyzed=True)
-        pgn_send_queue, pgn_recv_queue = anyio.create_memory_object_stream[
-            chess.pgn.Game
-        ]()
         filters: List[tuple[str, str]] = [
             (f.key, f.value) for f in await db.GameFilter.filter(game=game)
         ]
-        url = (
-            "https://lichess.org/api/stream/broadcast/round/"
-            f"{game.lichess_round_id}.pgn"
-        )
         try:
-            async with anyio.create_task_group() as game_tg:
-                logger.info(f"Starting tasks for pgn feed game_id={game.id}, {url}")
-                game_tg.start_soon(PgnFeed.run, pgn_send_queue, url, filters)
-                game_tg.start_soon(self._uci_worker, pgn_recv_queue, game)
+            logger.info(
+                f"Subscribing to round {game.lichess_round_id} for game_id={game.id}"
+            )
+            async with self._pgn_feeds.subscribe(
+                game.lichess_round_id, filters
+            ) as pgn_recv_queue:
+                await self._uci_worker(pgn_recv_queue, game)
         except Exception as e:
             logger.warning(f"Leaving the _run_single_game with exception: {e}")
             raise e
+        finally:
+            self._positions_cache.release_game(game.id)
         logger.info(f"Leaving the _run_single_game normally for game {game.id}")
 
     async def _uci_worker(
@@ -292,12 +419,15 @@ class Analyzer:
                 await db.Game.filter(id=game.id).update(is_finished=True)
                 assert self._game is not None
                 self._game.is_finished = True
+                self._games_list.invalidate()
                 await self._ws_notifier.send_game_entry_update(
                     game, is_being_analyzed=False
                 )
                 self._game = None
 
-    def uci_options(self, game: db.Game, pos: db.GamePosition) -> dict[str, str]:
+    def uci_options(
+        self, game: db.Game, pos: db.GamePosition, verbose: bool = True
+    ) -> dict[str, str]:
         options: dict[str, str] = {}
         if game.player1_rating is not None and game.player2_rating is not None:
             wmove = (pos.ply_number + 1) // 2 + 1
@@ -320,58 +450,194 @@ class Analyzer:
             options["ContemptMode"] = "white_side_analysis"
             options["WDLDrawRateReference"] = "0.64"
             options["WDLEvalObjectivity"] = "0.0"
-            logger.info(
-                f"WtimeElo: {wmtime}, BtimeElo: {bmtime}, Welo: {game.player1_rating}"
-                f", Belo: {game.player2_rating}, options={options}"
-            )
+            if verbose:
+                logger.info(
+                    f"WtimeElo: {wmtime}, BtimeElo: {bmtime}, "
+                    f"Welo: {game.player1_rating}, Belo: {game.player2_rating}, "
+                    f"options={options}"
+                )
         return options
 
     async def _uci_worker_think(
         self, board: chess.Board, pos: db.GamePosition, game: db.Game
     ):
+        skip_nodes: Optional[int] = self._config.get("transposition_skip_nodes")
+        if skip_nodes is not None and pos.nodes >= skip_nodes:
+            logger.info(
+                f"Position {board.fen()} already has {pos.nodes} nodes, not thinking."
+            )
+            await self._ws_notifier.send_game_update(game.id, positions=[pos])
+            return
         try:
             async with self._uci_lock:
                 logger.info(f"Starting thinking: {board.fen()}, ply {pos.ply_number}")
-                await self._uci_cancelation_lock.acquire()
                 options: dict[str, str] = self.uci_options(game, pos)
-                with await self._engine.analysis(
-                    board=board,
-                    multipv=self._config["max_multipv"],
-                    options=options,
-                ) as analysis:
-                    self._uci_cancelation_lock.release()
+                await self._publish_ponder_result(board, pos)
+                async with self._start_analysis(board, options) as analysis:
                     logger.info(
                         f"Started thinking: {board.fen()}, ply {pos.ply_number}"
                     )
                     assert game is not None
                     await self._ws_notifier.send_game_update(game.id, positions=[pos])
-                    multipv = min(
-                        self._config["max_multipv"], board.legal_moves.count()
+                    # Don't replace a seeded evaluation with a shallower one.
+                    predicted = await self._analyze_bundles(
+                        analysis,
+                        board,
+                        pos,
+                        ponder_after_nodes=self._config.get("ponder_after_nodes"),
+                        min_nodes=pos.nodes,
                     )
-                    info_bundle: list[chess.engine.InfoDict] = []
-                    async for info in analysis:
-                        if "multipv" not in info:
-                            logger.warning(f"Got info without multipv: {info}")
-                            continue
-                        if info["multipv"] != len(info_bundle) + 1:
-                            logger.error(f"Got info for wrong multipv: {info}")
-                            info_bundle = []
-                            continue
-                        info_bundle.append(info)
-                        if len(info_bundle) == multipv:
-                            await self._process_info_bundle(
-                                info_bundle=info_bundle,
-                                board=board,
-                                pos=pos,
-                            )
-                            info_bundle = []
+                if predicted:
+                    for move in predicted:
+                        await self._ponder(board, move, options)
+                    logger.info(f"Resuming thinking: {board.fen()}")
+                    async with self._start_analysis(board, options) as analysis:
+                        await self._analyze_bundles(
+                            analysis, board, pos, min_nodes=pos.nodes
+                        )
         except AssertionError as e:
             logger.error(f"Assertion error: {e}")
         finally:
-            try:
-                self._uci_cancelation_lock.release()
-            except RuntimeError:
-                pass
+            # Make sure the final evaluation of the position is not lost.
+            with anyio.CancelScope(shield=True):
+                await self._eval_store.try_flush()
+
+    @contextlib.asynccontextmanager
+    async def _start_analysis(
+        self,
+        board: chess.Board,
+        options: dict[str, str],
+        limit: Optional[chess.engine.Limit] = None,
+    ) -> AsyncIterator[chess.engine.AnalysisResult]:
+        # The task must not be cancelled while the engine is starting the search.
+        async with self._uci_cancelation_lock:
+            analysis = await self._engine.analysis(
+                board=board,
+                multipv=self._config["max_multipv"],
+                limit=limit,
+                options=options,
+            )
+        with analysis:
+            yield analysis
+
+    # Analyzes until the search is stopped. With `ponder_after_nodes`, stops once
+    # the position has that many nodes and returns the predicted replies. Bundles
+    # with fewer than `min_nodes` nodes are not published.
+    async def _analyze_bundles(
+        self,
+        analysis: chess.engine.AnalysisResult,
+        board: chess.Board,
+        pos: db.GamePosition,
+        ponder_after_nodes: Optional[int] = None,
+        min_nodes: int = 0,
+    ) -> list[chess.Move]:
+        collector = InfoBundleCollector(
+            min(self._config["max_multipv"], board.legal_moves.count())
+        )
+        predicted: list[chess.Move] = []
+        # With "offload_bundles", bundles are prepared in a worker thread. If it
+        # falls behind, the oldest queued bundles are dropped in favour of the
+        # newer ones.
+        offload = self._config.get("offload_bundles", False)
+        send_bundle, recv_bundle = anyio.create_memory_object_stream[
+            list[chess.engine.InfoDict]
+        ](max(1, self._config.get("offload_queue_size", 1)))
+        async with anyio.create_task_group() as tg:
+            if offload:
+                tg.start_soon(self._offloaded_bundle_worker, recv_bundle, board, pos)
+            with send_bundle:
+                async for info in analysis:
+                    info_bundle = collector.add(info)
+                    if info_bundle is None:
+                        continue
+                    nodes = sum(info.get("nodes", 0) for info in info_bundle)
+                    if nodes < min_nodes:
+                        continue
+                    if offload:
+                        self._enqueue_bundle(send_bundle, recv_bundle, info_bundle)
+                    else:
+                        await self._process_info_bundle(
+                            info_bundle=info_bundle,
+                            board=board,
+                            pos=pos,
+                        )
+                    if ponder_after_nodes is not None and nodes >= ponder_after_nodes:
+                        predicted = [
+                            chess.Move.from_uci(get_pv_uci(info)[0])
+                            for info in info_bundle[
+                                : self._config.get("ponder_moves", 1)
+                            ]
+                        ]
+                        break
+        return predicted
+
+    # Speculatively analyzes the position after `move`, keeping the latest bundle
+    # to publish instantly if the move is actually played.
+    async def _ponder(
+        self, board: chess.Board, move: chess.Move, options: dict[str, str]
+    ):
+        ponder_board = board.copy()
+        ponder_board.push(move)
+        if ponder_board.is_game_over():
+            return
+        logger.info(f"Pondering: {ponder_board.fen()}")
+        collector = InfoBundleCollector(
+            min(self._config["max_multipv"], ponder_board.legal_moves.count())
+        )
+        # Without a limit, pondering would hold the engine until the next move.
+        limit = chess.engine.Limit(nodes=self._config.get("ponder_nodes", 5_000_000))
+        async with self._start_analysis(ponder_board, options, limit) as analysis:
+            async for info in analysis:
+                if (info_bundle := collector.add(info)) is not None:
+                    self._ponder_results[ponder_board.fen()] = info_bundle
+
+    async def _publish_ponder_result(self, board: chess.Board, pos: db.GamePosition):
+        if not self._ponder_results:
+            return
+        info_bundle = self._ponder_results.get(board.fen())
+        self._ponder_results = {}
+        if info_bundle is None:
+            self._ponder_misses += 1
+        else:
+            self._ponder_hits += 1
+        logger.info(
+            f"Ponder {'miss' if info_bundle is None else 'hit'}, "
+            f"hit rate {self._ponder_hits}/{self._ponder_hits + self._ponder_misses}"
+        )
+        if info_bundle is not None and (
+            sum(info.get("nodes", 0) for info in info_bundle) >= pos.nodes
+        ):
+            await self._process_info_bundle(info_bundle, board, pos)
+
+    def get_ponder_stats(self) -> tuple[int, int]:
+        return self._ponder_hits, self._ponder_misses
+
+    def _enqueue_bundle(
+        self,
+        send_bundle: MemoryObjectSendStream[list[chess.engine.InfoDict]],
+        recv_bundle: MemoryObjectReceiveStream[list[chess.engine.InfoDict]],
+        info_bundle: list[chess.engine.InfoDict],
+    ) -> None:
+        try:
+            send_bundle.send_nowait(info_bundle)
+        except anyio.WouldBlock:
+            recv_bundle.receive_nowait()
+            self._dropped_bundles += 1
+            logger.debug(f"Bundle worker is behind, dropped={self._dropped_bundles}")
+            send_bundle.send_nowait(info_bundle)
+
+    async def _offloaded_bundle_worker(
+        self,
+        recv_bundle: MemoryObjectReceiveStream[list[chess.engine.InfoDict]],
+        board: chess.Board,
+        pos: db.GamePosition,
+    ):
+        with recv_bundle:
+            async for info_bundle in recv_bundle:
+                prepared = await anyio.to_thread.run_sync(
+                    self._prepare_info_bundle, info_bundle, board, pos
+                )
+                await self._publish_info_bundle(prepared, pos)
 
     async def _process_info_bundle(
         self,
@@ -379,10 +645,26 @@ class Analyzer:
         board: chess.Board,
         pos: db.GamePosition,
     ):
-        totals: Totals = get_totals(info_bundle)
-        logger.debug(f"Total nodes: {totals.nodes}")
+        await self._publish_info_bundle(
+            self._prepare_info_bundle(info_bundle, board, pos), pos
+        )
+
+    # CPU-bound part of bundle processing. It doesn't modify `pos` and can run in
+    # a worker thread.
+    def _prepare_info_bundle(
+        self,
+        info_bundle: list[chess.engine.InfoDict],
+        board: chess.Board,
+        pos: db.GamePosition,
+    ) -> PreparedBundle:
+        columns = BundleColumns.from_info_bundle(info_bundle)
+        totals: Totals = columns.totals()
+        logger.debug(
+            f"Total nodes: {totals.nodes}, "
+            f"PV cache hit rate: {self._pv_cache.hit_rate():.2f}"
+        )
         # logger.debug(info_bundle[0])
-        evaluation: db.GamePositionEvaluation = await db.GamePositionEvaluation.create(
+        evaluation = db.GamePositionEvaluation(
             position=pos,
             nodes=totals.nodes,
             time=int(info_bundle[0].get("time", 0) * 1000),
@@ -390,60 +672,86 @@ class Analyzer:
             seldepth=info_bundle[0].get("seldepth", 0),
         )
 
-        def make_eval_move(info: chess.engine.InfoDict):
-            pv: List[chess.Move] = info.get("pv", [])
+        shown = columns.head(self._config.get("show_pv", 2))
+
+        def make_eval_move(idx: int, info: chess.engine.InfoDict):
+            pv = get_pv_uci(info)
             assert len(pv) > 0
-            move: chess.Move = pv[0]
-            score: chess.engine.Score = info.get(
-                "score", chess.engine.PovScore(chess.engine.Cp(0), chess.WHITE)
-            ).white()
-            wdl: chess.engine.Wdl = info.get(
-                "wdl", chess.engine.PovWdl(chess.engine.Wdl(0, 1000, 0), chess.WHITE)
-            ).white()
+            score: Optional[chess.engine.PovScore] = info.get("score")
+            mate = score.white().mate() if score is not None else None
+            pv_san, pv_uci = self._pv_cache.convert_uci(board, pv)
+            # The evaluation is linked when the store flushes it to the DB.
             return db.GamePositionEvaluationMove(
-                evaluation=evaluation,
-                nodes=info.get("nodes", 0),
-                move_uci=move.uci(),
-                move_san=board.san(move),
-                q_score=score.score(mate_score=20000),
-                pv_san=make_pv_san_string(board, pv),
-                pv_uci=make_pv_uci_string(board, pv),
-                mate_score=score.mate() if score.is_mate() else None,
-                white_score=wdl.wins,
-                draw_score=wdl.draws,
-                black_score=wdl.losses,
+                nodes=int(shown.nodes[idx]),
+                move_uci=pv[0],
+                move_san=pv_san.partition(" ")[0],
+                q_score=int(shown.score_q[idx]),
+                pv_san=pv_san,
+                pv_uci=pv_uci,
+                mate_score=mate,
+                white_score=int(shown.score_white[idx]),
+                draw_score=int(shown.score_draw[idx]),
+                black_score=int(shown.score_black[idx]),
                 moves_left=info.get("movesleft", None),
             )
 
         moves: List[db.GamePositionEvaluationMove] = [
-            make_eval_move(info)
-            for info in info_bundle[: self._config.get("show_pv", 2)]
+            make_eval_move(idx, info)
+            for idx, info in enumerate(info_bundle[: len(shown)])
         ]
-        try:
-            await db.GamePositionEvaluationMove.bulk_create(moves)
-        except tortoise.exceptions.IntegrityError as e:
-            logger.error(f"Database insertion error: {e}")
-            return
-        pos.nodes = totals.nodes
-        pos.q_score = totals.score_q
-        pos.white_score = totals.score_white
-        pos.draw_score = totals.score_draw
-        pos.black_score = totals.score_black
-        pos.moves_left = totals.score_black
+        new_pos = copy.copy(pos)
+        new_pos.nodes = totals.nodes
+        new_pos.q_score = totals.score_q
+        new_pos.white_score = totals.score_white
+        new_pos.draw_score = totals.score_draw
+        new_pos.black_score = totals.score_black
+        new_pos.moves_left = totals.score_black
         fmove = info_bundle[0]
         if "time" in fmove:
-            pos.time = int(fmove.get("time", 0) * 1000)
+            new_pos.time = int(fmove.get("time", 0) * 1000)
         if "depth" in fmove:
-            pos.depth = fmove.get("depth", 0)
+            new_pos.depth = fmove.get("depth", 0)
         if "seldepth" in fmove:
-            pos.seldepth = fmove.get("seldepth", 0)
-        await pos.save()
+            new_pos.seldepth = fmove.get("seldepth", 0)
         game = self._game
         assert game is not None
-        await self._ws_notifier.send_game_update(
-            game_id=game.id,
-            positions=[pos],
-            ply=pos.ply_number,
-            evaluations=[evaluation],
-            moves=[moves],
+        evaluations = make_evaluations_update(
+            game_id=game.id, ply=pos.ply_number, evaluations=[evaluation], moves=[moves]
+        )
+        response = make_game_update(game_id=game.id, positions=[new_pos])
+        response.update(evaluations=evaluations)
+        return PreparedBundle(
+            position=new_pos,
+            evaluation=evaluation,
+            moves=moves,
+            evaluations=evaluations,
+            response=response,
+        )
+
+    # Whether `pos` is still in the mainline, e.g. not taken back.
+    def _is_in_mainline(self, pos: db.GamePosition) -> bool:
+        return (
+            pos.ply_number < len(self._mainline)
+            and self._mainline[pos.ply_number].id == pos.id
+        )
+
+    async def _publish_info_bundle(
+        self, prepared: PreparedBundle, pos: db.GamePosition
+    ):
+        if not self._is_in_mainline(pos):
+            return
+        for field in POSITION_TOTALS_FIELDS:
+            setattr(pos, field, getattr(prepared.position, field))
+        self._eval_store.put(
+            pos,
+            prepared.evaluation,
+            prepared.moves,
+            self._transposition_key(pos),
+        )
+        self._positions_cache.update_position(pos.game_id, pos)
+        self._evaluations_cache.put(pos.game_id, pos.ply_number, prepared.evaluations)
+        await self._ws_notifier.notify_observers(
+            prepared.response,
+            game_id=pos.game_id,
+            coalesce_key=(pos.game_id, pos.ply_number),
         )
@@ -1,32 +1,93 @@
 import json
+import re
+from typing import Optional
 
-import db
-from sanic import Blueprint, Request, Websocket
-from sanic.helpers import json_dumps
+from sanic import Blueprint, HTTPResponse, Request, Websocket
+from sanic.exceptions import NotFound
 from sanic.log import logger
-from ws_notifier import (WebsocketNotifier, WebsocketRequest,
-                         WebsocketResponse, make_games_data)
-from tortoise.expressions import Q
+from ws_frame import EncodedFrame
+from ws_notifier import WebsocketNotifier, WebsocketRequest
+from eval_delta import DELTA_PROTOCOL_VERSION
+
+# Version of the websocket protocol from which clients load the game list,
+# positions and evaluations with the HTTP endpoints below, and the websocket
+# only carries the updates.
+HTTP_SNAPSHOTS_PROTOCOL_VERSION = 3
+
+# One entity tag of an If-None-Match list, weak or strong.
+ETAG_RE = re.compile(r'\s*(?:W/)?("[^"]*")\s*(?:,|$)')
 
 api = Blueprint("api", url_prefix="/api")
 
 
+# If-None-Match uses the weak comparison, so W/"x" matches "x" (RFC 9110).
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(m.group(1) == etag for m in ETAG_RE.finditer(if_none_match))
+
+
+# The ply range of an evaluations request, as sent by the client.
+def parse_ply_range(request: WebsocketRequest) -> tuple[int, Optional[int]]:
+    from_ply = request.get("fromPly", 0)
+    to_ply = request.get("toPly")
+    for ply in (from_ply, to_ply):
+        if ply is not None and (type(ply) is not int or ply < 0):
+            raise ValueError(f"Invalid ply: {ply!r}")
+    if to_ply is not None and to_ply < from_ply:
+        raise ValueError(f"Invalid ply range: {from_ply}..{to_ply}")
+    return from_ply, to_ply
+
+
+def snapshot_response(req: Request, frame: EncodedFrame,
+                      is_final: bool) -> HTTPResponse:
+    if is_final:
+        cache_control = f"public, max-age={req.app.config.SNAPSHOT_MAX_AGE_SEC}"
+    else:
+        cache_control = "no-cache"
+    headers = {"ETag": frame.etag, "Cache-Control": cache_control}
+    if etag_matches(req.headers.get("If-None-Match", ""), frame.etag):
+        return HTTPResponse(status=304, headers=headers)
+    return HTTPResponse(frame.text, headers=headers,
+                        content_type="application/json")
+
+
+@api.get("/games")
+async def games(req: Request):
+    snapshot = await req.app.ctx.app.get_games_snapshot()
+    return snapshot_response(req, snapshot.frame, is_final=False)
+
+
+@api.get("/games/<game_id:int>/positions")
+async def positions(req: Request, game_id: int):
+    is_final = await req.app.ctx.app.is_game_final(game_id)
+    if is_final is None:
+        raise NotFound(f"No game {game_id}")
+    frame = await req.app.ctx.app.get_positions_frame(game_id)
+    return snapshot_response(req, frame, is_final=is_final)
+
+
+@api.get("/games/<game_id:int>/positions/<ply:int>/evaluation")
+async def evaluation(req: Request, game_id: int, ply: int):
+    is_final = await req.app.ctx.app.is_game_final(game_id)
+    if is_final is None:
+        raise NotFound(f"No game {game_id}")
+    frame = await req.app.ctx.app.get_evaluation_frame(game_id, ply)
+    if frame is None:
+        raise NotFound(f"No ply {ply} in game {game_id}")
+    return snapshot_response(req, frame, is_final=is_final)
+
+
 @api.websocket("/ws")
 async def ws(req: Request, ws: Websocket):
-    games = await db.Game.all()
-    analyzed_games = set(g.id for g in req.app.ctx.app.get_games_being_analyzed())
-    games = await db.Game.filter(
-        Q(tournament__is_hidden=False) | Q(is_finished=False),
-        is_hidden=False,
-    ).order_by("id").prefetch_related("tournament")
-
-    resp = WebsocketResponse()
     ws_notifier: WebsocketNotifier = req.app.ctx.app.get_ws_notifier()
+    version = req.args.get("v", "1")
+    version_num = int(version) if version.isdigit() else 1
+    use_deltas = version_num >= DELTA_PROTOCOL_VERSION
+    send_snapshots = version_num < HTTP_SNAPSHOTS_PROTOCOL_VERSION
+    handshake = await req.app.ctx.app.get_handshake(with_games=send_snapshots)
     try:
-        ws_notifier.register(ws)
-        resp["status"] = req.app.ctx.app.get_status()
-        resp["games"] = make_games_data(games=games, analyzed_games=analyzed_games)
-        await ws.send(json_dumps(resp))
+        ws_notifier.register(ws, use_deltas=use_deltas, handshake=handshake)
         while True:
             data = await ws.recv()
             if not data:
@@ -36,10 +97,28 @@ async def ws(req: Request, ws: Websocket):
             except json.decoder.JSONDecodeError:
                 logger.error(f"Invalid JSON, closing connection: {data}")
                 break
+            if (resync := request.get("resyncEvaluation")) is not None:
+                try:
+                    ws_notifier.resync_evaluation(
+                        ws, int(resync["gameId"]), int(resync["ply"]))
+                except (KeyError, TypeError, ValueError):
+                    logger.error(f"Invalid resync request: {data}")
             if "gameId" in request:
                 await req.app.ctx.app.set_game_and_ply(
-                    ws, request["gameId"], request.get("ply")
+                    ws, request["gameId"], request.get("ply"),
+                    send_snapshots=send_snapshots,
+                    last_seq=request.get("lastSeq"),
                 )
+                if request.get("allPlies"):
+                    await req.app.ctx.app.dump_evals(ws, request["gameId"], 0)
+                elif "fromPly" in request or "toPly" in request:
+                    try:
+                        from_ply, to_ply = parse_ply_range(request)
+                    except ValueError:
+                        logger.error(f"Invalid ply range request: {data}")
+                        continue
+                    await req.app.ctx.app.dump_evals(
+                        ws, request["gameId"], from_ply, to_ply)
     finally:
         await ws.close()
         ws_notifier.unregister(ws)
@@ -2,18 +2,36 @@ import anyio
 import db
 import sanic.config
 from analyzer import Analyzer
-from game_selector import get_best_game, get_game_candidates, make_game
-from rich import print
+from db_reads import (
+    fetch_games_data,
+    fetch_latest_evaluation,
+    fetch_latest_evaluations,
+    fetch_position_id,
+    fetch_positions,
+)
+from eval_store import EvaluationStore
+from evaluations_cache import EvaluationsCache
+from games_cache import GamesListCache, GamesListSnapshot
+from transpositions import TranspositionTable
+from pgn_feed import PgnFeedHub
+from positions_cache import PositionsCache
+from lichess import LichessClient, set_default_client
+from game_scheduler import GameScheduler
 from sanic import Sanic
 from sanic import Websocket
-from typing import Optional
+from typing import Optional, cast
+from sanic.helpers import json_dumps
 from sanic.log import logger
+from ws_frame import EncodedFrame
 from ws_notifier import (
     WebsocketNotifier,
-    make_positions_update,
     WebsocketResponse,
+    WsEvaluationData,
+    WsGameData,
     WsGlobalData,
+    WsPositionData,
     make_evaluations_update,
+    make_positions_update,
 )
 import hashlib
 
@@ -27,78 +45,246 @@ class App:
     app: Sanic
     config: sanic.config.Config
     _analysises: list[Analyzer]
-    _game_assignment_lock: anyio.Lock
+    _scheduler: GameScheduler
     _ws_notifier: WebsocketNotifier
+    _eval_store: EvaluationStore
+    _transpositions: TranspositionTable
+    _pgn_feeds: PgnFeedHub
+    _positions_cache: PositionsCache
+    _evaluations_cache: EvaluationsCache
+    _games_list: GamesListCache
+    _lichess: LichessClient
     _js_hash: str
+    # Finishing is final, so the finished games are remembered.
+    _finished_game_ids: set[int]
 
     def __init__(self, app: Sanic):
         self.app = app
         self.config = app.config
-        self._ws_notifier = WebsocketNotifier()
+        self._ws_notifier = WebsocketNotifier(
+            queue_size=self.config.WS_SEND_QUEUE_SIZE,
+            overflow_policy=self.config.WS_OVERFLOW_POLICY,
+            max_lag_sec=self.config.WS_MAX_LAG_SEC,
+            max_updates_per_sec=self.config.WS_MAX_UPDATES_PER_SEC,
+            replay_ring_size=self.config.WS_REPLAY_RING_SIZE,
+            max_queue_size=self.config.WS_MAX_QUEUE_SIZE,
+            replay_max_games=self.config.WS_REPLAY_MAX_GAMES,
+        )
+        self._transpositions = TranspositionTable(
+            max_size=self.config.TRANSPOSITION_CACHE_SIZE
+        )
+        self._eval_store = EvaluationStore(
+            flush_interval_sec=self.config.EVAL_FLUSH_INTERVAL_SEC,
+            flush_nodes_step=self.config.EVAL_FLUSH_NODES_STEP,
+            transpositions=self._transpositions,
+        )
+        self._pgn_feeds = PgnFeedHub()
+        self._positions_cache = PositionsCache(
+            max_cached_games=self.config.POSITIONS_CACHE_SIZE
+        )
+        self._evaluations_cache = EvaluationsCache(
+            max_size=self.config.EVALUATIONS_CACHE_SIZE
+        )
+        self._games_list = GamesListCache(
+            max_age_sec=self.config.GAMES_LIST_MAX_AGE_SEC
+        )
+        self._scheduler = GameScheduler(
+            get_active_games=self.get_games_being_analyzed,
+            on_game_created=lambda game: self._games_list.invalidate(),
+            poll_interval_sec=self.config.GAME_POLL_INTERVAL_SEC,
+            fast_poll_interval_sec=self.config.GAME_POLL_FAST_INTERVAL_SEC,
+            fast_poll_window_sec=self.config.GAME_POLL_FAST_WINDOW_SEC,
+        )
+        self._lichess = LichessClient(
+            requests_per_sec=self.config.LICHESS_REQUESTS_PER_SEC,
+            burst=self.config.LICHESS_REQUESTS_BURST,
+        )
+        set_default_client(self._lichess)
         self._analysises = [
             Analyzer(
                 uci_config=cfg,
-                next_task_callback=self._get_next_game,
+                next_task_callback=self._scheduler.next_game,
                 ws_notifier=self._ws_notifier,
+                eval_store=self._eval_store,
+                transpositions=self._transpositions,
+                pgn_feeds=self._pgn_feeds,
+                positions_cache=self._positions_cache,
+                evaluations_cache=self._evaluations_cache,
+                games_list=self._games_list,
             )
             for cfg in self.config.UCI_ANALYZERS
         ]
-        self._game_assignment_lock = anyio.Lock()
         self._js_hash = _get_js_hash()
+        self._finished_game_ids = set()
 
     def get_ws_notifier(self) -> WebsocketNotifier:
         return self._ws_notifier
 
-    async def dump_moves(self, ws, game_id: int):
-        positions: list[db.GamePosition] = (
-            await db.GamePosition.filter(game=game_id).order_by("ply_number").all()
-        )
-        response = WebsocketResponse(
-            positions=make_positions_update(game_id=game_id, positions=positions)
+    async def get_games_snapshot(self) -> GamesListSnapshot:
+        return await self._games_list.get_snapshot(self._load_games_data)
+
+    # The first frame of a connection, with the cached game list.
+    async def get_handshake(self, with_games: bool) -> EncodedFrame:
+        response = WebsocketResponse(status=self.get_status())
+        if with_games:
+            response.update(games=(await self.get_games_snapshot()).games)
+        return EncodedFrame(json_dumps(response))
+
+    async def _load_games_data(self) -> list[WsGameData]:
+        analyzed_games = set(g.id for g in self.get_games_being_analyzed())
+        return await fetch_games_data(analyzed_games)
+
+    # Whether the game is finished and no longer analyzed, i.e. none of its data
+    # will change. None if there is no such game.
+    async def is_game_final(self, game_id: int) -> Optional[bool]:
+        if any(g.id == game_id for g in self.get_games_being_analyzed()):
+            return False
+        if game_id in self._finished_game_ids:
+            return True
+        is_finished = cast(
+            list[bool],
+            await db.Game.filter(id=game_id).values_list("is_finished", flat=True),
         )
-        await self._ws_notifier.send_response(ws, response)
+        if not is_finished:
+            return None
+        if is_finished[0]:
+            self._finished_game_ids.add(game_id)
+        return is_finished[0]
 
-    async def dump_eval(self, ws, game_id: int, ply: int):
-        pos: db.GamePosition | None = await db.GamePosition.get_or_none(
-            game=game_id, ply_number=ply
+    async def get_positions_frame(self, game_id: int) -> EncodedFrame:
+        return await self._positions_cache.get_frame(
+            game_id, lambda: self._load_positions(game_id)
         )
-        if pos is None:
-            return
-        evaluations: list[db.GamePositionEvaluation] = (
-            await db.GamePositionEvaluation.filter(position=pos).order_by("-id")[:1]
+
+    async def get_evaluation_frame(
+        self, game_id: int, ply: int
+    ) -> Optional[EncodedFrame]:
+        return await self._evaluations_cache.get_frame(
+            game_id, ply, lambda: self._load_evaluation(game_id, ply)
         )
-        evaluation = evaluations[0] if evaluations else None
-        moveses_flat: list[db.GamePositionEvaluationMove] = (
+
+    async def dump_moves(self, ws, game_id: int):
+        self._ws_notifier.send_encoded(ws, await self.get_positions_frame(game_id))
+
+    async def _load_positions(self, game_id: int) -> list[WsPositionData]:
+        # Positions with not yet flushed evaluations have fresher totals in memory.
+        return [
             (
-                await db.GamePositionEvaluationMove.filter(
-                    evaluation=evaluation
-                ).order_by("-nodes")
+                make_positions_update(game_id=game_id, positions=[pending.position])[0]
+                if (pending := self._eval_store.get_pending(pos_id))
+                else pos
+            )
+            for pos_id, pos in await fetch_positions(game_id)
+        ]
+
+    async def dump_eval(self, ws, game_id: int, ply: int):
+        if (frame := await self.get_evaluation_frame(game_id, ply)) is not None:
+            self._ws_notifier.send_encoded(ws, frame)
+
+    async def _load_evaluation(
+        self, game_id: int, ply: int
+    ) -> Optional[WebsocketResponse]:
+        pos_id = await fetch_position_id(game_id, ply)
+        if pos_id is None:
+            return None
+        if pending := self._eval_store.get_pending(pos_id):
+            return WebsocketResponse(
+                evaluations=make_evaluations_update(
+                    game_id=game_id,
+                    ply=ply,
+                    evaluations=[pending.evaluation],
+                    moves=[sorted(pending.moves, key=lambda m: -m.nodes)],
+                )
             )
-            if evaluation
-            else []
+        return WebsocketResponse(
+            evaluations=await fetch_latest_evaluation(game_id, ply, pos_id)
         )
-        moveses: list[list[db.GamePositionEvaluationMove]] = [[] for _ in evaluations]
-        eval_id_to_idx = {e.id: idx for idx, e in enumerate(evaluations)}
-        for move in moveses_flat:
-            if move.evaluation_id in eval_id_to_idx:
-                moveses[eval_id_to_idx[move.evaluation_id]].append(move)
-
-        response = WebsocketResponse(
-            evaluations=make_evaluations_update(
-                game_id=game_id,
-                ply=ply,
-                evaluations=evaluations,
-                moves=moveses,
+
+    async def dump_evals(
+        self, ws, game_id: int, from_ply: int, to_ply: Optional[int] = None
+    ):
+        last_ply = cast(
+            Optional[int],
+            await db.GamePosition.filter(game=game_id)
+            .order_by("-ply_number")
+            .first()
+            .values_list("ply_number", flat=True),
+        )
+        if last_ply is None:
+            return
+        if to_ply is None or to_ply > last_ply:
+            to_ply = last_ply
+        # The whole range is sent, in frames of a bounded number of plies.
+        page_size = self.config.WS_EVALS_FRAME_PLIES
+        for page_from in range(from_ply, to_ply + 1, page_size):
+            page_to = min(page_from + page_size - 1, to_ply)
+            evaluations = await self._load_latest_evaluations(
+                game_id, page_from, page_to
             )
+            if evaluations:
+                self._ws_notifier.send_encoded(
+                    ws,
+                    EncodedFrame(
+                        json_dumps(WebsocketResponse(evaluations=evaluations))
+                    ),
+                )
+
+    # The latest evaluation of every position in the ply range, with a fixed
+    # number of queries however long the range is.
+    async def _load_latest_evaluations(
+        self, game_id: int, from_ply: int, to_ply: Optional[int]
+    ) -> list[WsEvaluationData]:
+        positions = db.GamePosition.filter(game=game_id, ply_number__gte=from_ply)
+        if to_ply is not None:
+            positions = positions.filter(ply_number__lte=to_ply)
+        plies: dict[int, int] = dict(
+            await positions.order_by("ply_number").values_list("id", "ply_number")
         )
-        await self._ws_notifier.send_response(ws, response)
+        # Fresher ones are in memory: the broadcast ones, then the not yet
+        # flushed ones. The rest is read from the DB.
+        result: dict[int, list[WsEvaluationData]] = {}
+        to_load: dict[int, int] = {}
+        for pos_id, ply in plies.items():
+            if (cached := self._evaluations_cache.peek(game_id, ply)) is not None:
+                result[ply] = cached
+            elif pending := self._eval_store.get_pending(pos_id):
+                result[ply] = make_evaluations_update(
+                    game_id=game_id,
+                    ply=ply,
+                    evaluations=[pending.evaluation],
+                    moves=[sorted(pending.moves, key=lambda m: -m.nodes)],
+                )
+            else:
+                to_load[pos_id] = ply
+        loaded = await fetch_latest_evaluations(game_id, to_load, from_ply, to_ply)
+        for ply, evaluation in loaded.items():
+            result[ply] = [evaluation]
+        return [e for ply in sorted(result) for e in result[ply]]
 
+    # Clients that load the snapshots over HTTP only need the updates.
+    # Reconnecting clients only get the updates they missed, or the snapshots
+    # again when they are too far behind.
     async def set_game_and_ply(
-        self, ws: Websocket, game_id: int, ply: Optional[int] = None
+        self,
+        ws: Websocket,
+        game_id: int,
+        ply: Optional[int] = None,
+        send_snapshots: bool = True,
+        last_seq: Optional[int] = None,
     ):
         game_changed = self._ws_notifier.set_game_and_ply(ws, game_id, ply)
-        if game_changed:
-            await self.dump_moves(ws, game_id)
+        if not game_changed:
+            if send_snapshots and ply is not None:
+                await self.dump_eval(ws, game_id, ply)
+            return
+        if last_seq is not None:
+            if self._ws_notifier.replay_missed(ws, game_id, last_seq):
+                return
+            send_snapshots = True
+        self._ws_notifier.send_game_seq(ws, game_id)
+        if not send_snapshots:
+            return
+        await self.dump_moves(ws, game_id)
         if ply is not None:
             await self.dump_eval(ws, game_id, ply)
 
@@ -115,34 +301,33 @@ class App:
         while True:
             await anyio.sleep(delay=33)
             self._js_hash = _get_js_hash()
+            logger.info(f"Websocket queues: {self._ws_notifier.get_queue_stats()}")
+            logger.info(f"Positions cache: {self._positions_cache.get_stats()}")
+            eval_stats = self._evaluations_cache.get_stats()
+            logger.info(
+                f"Evaluations cache: {eval_stats}, "
+                f"hit rate {eval_stats.hit_rate():.2f}"
+            )
+            for idx, analyzer in enumerate(self._analysises):
+                hits, misses = analyzer.get_ponder_stats()
+                if hits + misses:
+                    logger.info(f"Analyzer {idx} ponder hits: {hits}/{hits + misses}")
             await self._ws_notifier.notify_observers(
                 WebsocketResponse(status=self.get_status())
             )
 
-    async def _get_next_game(self) -> db.Game:
-        async with self._game_assignment_lock:
-            while True:
-                # Check whether there are any active games that are not covered.
-                games = await db.Game.filter(is_finished=False)
-                active_games = [a.id for a in self.get_games_being_analyzed()]
-                for game in games:
-                    if game.id not in active_games:
-                        logger.info(f"Found ongoing game {game.game_name}")
-                        return game
-                candidates = await get_game_candidates()
-                if candidates:
-                    best_candidate = get_best_game(candidates)
-                    print(f"Will follow game: {best_candidate.game['name']}")
-                    return await make_game(best_candidate)
-                logger.debug("No games found, waiting for a while.")
-                await anyio.sleep(10)
-
     async def run(self):
         async with anyio.create_task_group() as tg:
             tg.start_soon(self.send_status_periodically)
+            tg.start_soon(self._eval_store.run)
+            await tg.start(self._ws_notifier.run)
+            await tg.start(self._pgn_feeds.run)
+            tg.start_soon(self._scheduler.run)
             for a in self._analysises:
                 tg.start_soon(a.run)
 
     async def shutdown(self, app: Sanic):
         logger.info("Shutting down app.")
+        await self._eval_store.flush()
+        await self._lichess.close()
         # await asyncio.gather(*[a.disconnect() for a in self.analysises])
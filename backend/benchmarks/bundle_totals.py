@@ -0,0 +1,56 @@
+# Time to compute the totals of a full multipv bundle, with get_totals() and
+# with BundleColumns.
+#
+#   cd backend && python benchmarks/bundle_totals.py
+import os
+import random
+import sys
+import timeit
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess  # noqa: E402
+import chess.engine  # noqa: E402
+from analyzer import get_totals  # noqa: E402
+from bundle_columns import BundleColumns  # noqa: E402
+
+
+def make_info(rng: random.Random, multipv: int) -> chess.engine.InfoDict:
+    info: chess.engine.InfoDict = {
+        "multipv": multipv,
+        "nodes": rng.randint(0, 10_000_000),
+        "wdl": chess.engine.PovWdl(
+            chess.engine.Wdl(*rng.choice([(300, 500, 200), (0, 1000, 0)])),
+            chess.BLACK,
+        ),
+    }
+    if rng.random() < 0.05:
+        score: chess.engine.Score = chess.engine.Mate(rng.randint(-20, 20))
+    else:
+        score = chess.engine.Cp(rng.randint(-1000, 1000))
+    info["score"] = chess.engine.PovScore(score, chess.BLACK)
+    return info
+
+
+def main() -> None:
+    rng = random.Random(42)
+    bundle = [make_info(rng, i) for i in range(1, 231)]
+    columns = BundleColumns.from_info_bundle(bundle)
+    benches: list[tuple[str, Callable[[], Any]]] = [
+        ("get_totals", lambda: get_totals(bundle)),
+        (
+            "BundleColumns (incl. conversion)",
+            lambda: BundleColumns.from_info_bundle(bundle).totals(),
+        ),
+        ("BundleColumns.totals", columns.totals),
+    ]
+    number = 2000
+    print(f"Bundle of {len(bundle)} infos:")
+    for name, fn in benches:
+        secs = timeit.timeit(fn, number=number)
+        print(f"{name:>34}: {secs / number * 1e6:8.1f} us per bundle")
+
+
+if __name__ == "__main__":
+    main()
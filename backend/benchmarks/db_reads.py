@@ -0,0 +1,192 @@
+# Snapshot reads with the hydrated models against the db_reads queries, on a
+# seeded game. Pass a scratch DB URL to run it on Postgres, e.g.
+#
+#   cd backend && python benchmarks/db_reads.py asyncpg://user@localhost/scratch
+#
+# Tables are created and filled, so it must not be a DB in use.
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import anyio  # noqa: E402
+import chess  # noqa: E402
+import db  # noqa: E402
+from db_reads import (  # noqa: E402
+    fetch_games_data,
+    fetch_latest_evaluation,
+    fetch_latest_evaluations,
+    fetch_position_id,
+    fetch_positions,
+)
+from tortoise import Tortoise  # noqa: E402
+from tortoise.expressions import Q  # noqa: E402
+from ws_notifier import (  # noqa: E402
+    WsEvaluationData,
+    WsGameData,
+    WsPositionData,
+    make_evaluations_update,
+    make_games_data,
+    make_positions_update,
+)
+
+NUM_PLIES = 160
+NUM_VARIATIONS = 30
+
+
+async def seed() -> int:
+    tournament = await db.Tournament.create(name="Bench", lichess_id="bench")
+    game = await db.Game.create(
+        tournament=tournament,
+        game_name="A - B",
+        lichess_round_id="round",
+        lichess_id="game",
+        round_name="Round 1",
+        player1_name="A",
+        player1_rating=2700,
+        player2_name="B",
+        status="*",
+    )
+    board = chess.Board()
+    for ply in range(NUM_PLIES):
+        move = next(iter(board.legal_moves)) if ply else None
+        san = board.san(move) if move else None
+        if move:
+            board.push(move)
+        pos = await db.GamePosition.create(
+            game=game,
+            ply_number=ply,
+            fen=board.fen(),
+            move_uci=move.uci() if move else None,
+            move_san=san,
+            nodes=ply * 100,
+            q_score=ply - 80,
+            white_score=300,
+            draw_score=500,
+            black_score=200,
+            moves_left=50,
+        )
+        for i in range(2):
+            evaluation = await db.GamePositionEvaluation.create(
+                position=pos,
+                nodes=1000 * (i + 1),
+                time=100 * ply,
+                depth=10 + i,
+                seldepth=20 + i,
+            )
+            await db.GamePositionEvaluationMove.bulk_create(
+                [
+                    db.GamePositionEvaluationMove(
+                        evaluation=evaluation,
+                        nodes=1000 - v * 7,
+                        q_score=v,
+                        pv_san="Nf3 Nf6 c4 g6 Nc3 Bg7 e4 d6 d4 O-O Be2 e5",
+                        pv_uci=f"g1f3 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 {v}",
+                        white_score=300,
+                        draw_score=500,
+                        black_score=200,
+                    )
+                    for v in range(NUM_VARIATIONS)
+                ]
+            )
+    return game.id
+
+
+# The reads as they were done with the hydrated models.
+async def orm_games() -> list[WsGameData]:
+    games = (
+        await db.Game.filter(
+            Q(tournament__is_hidden=False) | Q(is_finished=False), is_hidden=False
+        )
+        .order_by("id")
+        .prefetch_related("tournament")
+    )
+    return make_games_data(games=games, analyzed_games={1})
+
+
+async def orm_positions(game_id: int) -> list[WsPositionData]:
+    positions = await db.GamePosition.filter(game=game_id).order_by("ply_number")
+    return make_positions_update(game_id=game_id, positions=positions)
+
+
+async def orm_evaluation(game_id: int, ply: int) -> list[WsEvaluationData]:
+    pos = await db.GamePosition.get(game=game_id, ply_number=ply)
+    evaluations = await db.GamePositionEvaluation.filter(position=pos).order_by("-id")
+    moves = [
+        await db.GamePositionEvaluationMove.filter(evaluation=e).order_by("-nodes")
+        for e in evaluations[:1]
+    ]
+    return make_evaluations_update(
+        game_id=game_id, ply=ply, evaluations=evaluations[:1], moves=moves
+    )
+
+
+async def orm_all_evaluations(game_id: int) -> None:
+    for ply in range(NUM_PLIES):
+        await orm_evaluation(game_id, ply)
+
+
+async def fast_evaluation(game_id: int, ply: int) -> list[WsEvaluationData]:
+    position_id = await fetch_position_id(game_id, ply)
+    assert position_id is not None
+    return await fetch_latest_evaluation(game_id, ply, position_id)
+
+
+async def fast_all_evaluations(game_id: int) -> None:
+    plies = dict(
+        await db.GamePosition.filter(game=game_id).values_list("id", "ply_number")
+    )
+    await fetch_latest_evaluations(game_id, plies, 0, None)
+
+
+async def bench(
+    name: str,
+    orm: Callable[[], Awaitable[Any]],
+    fast: Callable[[], Awaitable[Any]],
+    repeat: int,
+) -> None:
+    timings = []
+    for f in (orm, fast):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await f()
+        timings.append((time.perf_counter() - start) / repeat)
+    print(
+        f"{name:<32}: ORM {timings[0] * 1000:7.2f}ms, "
+        f"db_reads {timings[1] * 1000:7.2f}ms "
+        f"({timings[0] / timings[1]:.1f}x)"
+    )
+
+
+async def main() -> None:
+    db_url = sys.argv[1] if len(sys.argv) > 1 else "sqlite://:memory:"
+    await Tortoise.init(db_url=db_url, modules={"lc0live": ["db"]})
+    await Tortoise.generate_schemas()
+    game_id = await seed()
+    print(f"On {db_url}, {NUM_PLIES} plies of {NUM_VARIATIONS} variations:")
+    await bench("game list", orm_games, lambda: fetch_games_data({1}), 50)
+    await bench(
+        "positions",
+        lambda: orm_positions(game_id),
+        lambda: fetch_positions(game_id),
+        50,
+    )
+    await bench(
+        "evaluation of one ply",
+        lambda: orm_evaluation(game_id, 100),
+        lambda: fast_evaluation(game_id, 100),
+        50,
+    )
+    await bench(
+        "evaluations of all plies",
+        lambda: orm_all_evaluations(game_id),
+        lambda: fast_all_evaluations(game_id),
+        3,
+    )
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    anyio.run(main)
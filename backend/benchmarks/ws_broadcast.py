@@ -0,0 +1,127 @@
+# CPU time of one broadcast to 1k, 10k and 50k websocket subscribers, through
+# the notifier's writers and send_frame(), the same path as in production.
+#
+#   cd backend && python benchmarks/ws_broadcast.py
+import os
+import sys
+import time
+from typing import Any, cast
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import anyio  # noqa: E402
+from sanic.helpers import json_dumps  # noqa: E402
+from websockets.protocol import State  # noqa: E402
+from websockets.server import ServerProtocol  # noqa: E402
+from ws_frame import EncodedFrame, send_frame  # noqa: E402
+from ws_notifier import (  # noqa: E402
+    WebsocketNotifier,
+    WebsocketResponse,
+    WsEvaluationData,
+    WsVariationData,
+)
+
+
+# Counts the bytes written by all the connections.
+class FakeTransport:
+    written: int = 0
+
+
+# Sends like sanic does: the text is framed by the connection's protocol state
+# machine and written to the transport.
+class FakeWebsocket:
+    def __init__(self, transport: FakeTransport):
+        self.proto = ServerProtocol(state=State.OPEN)
+        self.transport = transport
+
+    async def send(self, text: str) -> None:
+        self.proto.send_text(text.encode())
+        for data in self.proto.data_to_send():
+            self.transport.written += len(data)
+
+
+RESPONSE = WebsocketResponse(
+    evaluations=[
+        WsEvaluationData(
+            gameId=1,
+            ply=30,
+            evalId=None,
+            nodes=123456789,
+            time=60000,
+            depth=20,
+            seldepth=45,
+            movesLeft=50,
+            variations=[
+                WsVariationData(
+                    nodes=1000000 - i,
+                    pvSan="Nf3 Nf6 c4 g6 Nc3 Bg7 e4 d6 d4 O-O Be2 e5",
+                    pvUci="g1f3 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6",
+                    scoreQ=12,
+                    scoreW=300,
+                    scoreD=500,
+                    scoreB=200,
+                )
+                for i in range(20)
+            ],
+        )
+    ]
+)
+
+
+def frame_len() -> int:
+    proto = ServerProtocol(state=State.OPEN)
+    proto.send_text(json_dumps(RESPONSE).encode())
+    return sum(len(data) for data in proto.data_to_send())
+
+
+# One broadcast through the notifier, until every subscriber's writer has sent
+# the frame.
+async def bench_broadcast(num_subscribers: int) -> float:
+    transport = FakeTransport()
+    websockets = [cast(Any, FakeWebsocket(transport)) for _ in range(num_subscribers)]
+    notifier = WebsocketNotifier(queue_size=64)
+    expected = frame_len() * num_subscribers
+    async with anyio.create_task_group() as tg:
+        await tg.start(notifier.run)
+        for ws in websockets:
+            notifier.register(ws)
+            notifier.set_game_and_ply(ws, 1)
+        await anyio.sleep(0)
+        start = time.process_time()
+        await notifier.notify_observers(RESPONSE, game_id=1)
+        while transport.written < expected:
+            await anyio.sleep(0)
+        elapsed = time.process_time() - start
+        tg.cancel_scope.cancel()
+    return elapsed
+
+
+# Writing to every connection directly, with the frame shared or serialized
+# again for each connection (as per client responses used to be).
+async def bench_writes(num_subscribers: int, shared: bool) -> float:
+    transport = FakeTransport()
+    websockets = [cast(Any, FakeWebsocket(transport)) for _ in range(num_subscribers)]
+    start = time.process_time()
+    frame = EncodedFrame(json_dumps(RESPONSE))
+    for ws in websockets:
+        await send_frame(ws, frame if shared else EncodedFrame(json_dumps(RESPONSE)))
+    return time.process_time() - start
+
+
+async def main() -> None:
+    print(f"Frame of {frame_len()} bytes, CPU time per broadcast:")
+    for num_subscribers in (1000, 10000, 50000):
+        broadcast = await bench_broadcast(num_subscribers)
+        per_connection = await bench_writes(num_subscribers, shared=False)
+        shared = await bench_writes(num_subscribers, shared=True)
+        print(
+            f"{num_subscribers:>6} subscribers: "
+            f"notifier {broadcast * 1000:7.1f}ms "
+            f"({broadcast / num_subscribers * 1e6:4.1f}us per subscriber), "
+            f"writes serialized per connection {per_connection * 1000:7.1f}ms, "
+            f"shared {shared * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    anyio.run(main)
@@ -0,0 +1,99 @@
+import dataclasses
+from typing import Optional
+
+import chess
+import chess.engine
+import numpy as np
+
+MATE_SCORE = 20000
+
+
+@dataclasses.dataclass
+class Totals:
+    nodes: int
+    score_q: int
+    score_white: int
+    score_draw: int
+    score_black: int
+    moves_left: Optional[int] = None
+
+
+# Columnar view of a multipv info bundle, all scores from white's point of view.
+@dataclasses.dataclass
+class BundleColumns:
+    nodes: np.ndarray
+    score_q: np.ndarray
+    score_white: np.ndarray
+    score_draw: np.ndarray
+    score_black: np.ndarray
+    moves_left: Optional[int] = None
+
+    @classmethod
+    def from_info_bundle(
+        cls, info_bundle: list[chess.engine.InfoDict]
+    ) -> "BundleColumns":
+        nodes: list[int] = []
+        scores: list[int] = []
+        wdls: list[tuple[int, int, int]] = []
+        score_flip: list[bool] = []
+        wdl_flip: list[bool] = []
+        # Scores are collected as reported (side to move POV) and flipped to
+        # white's POV in bulk afterwards.
+        for info in info_bundle:
+            nodes.append(info.get("nodes", 0))
+            if (score := info.get("score")) is not None:
+                scores.append(score.relative.score(mate_score=MATE_SCORE))
+                score_flip.append(score.turn == chess.BLACK)
+            else:
+                scores.append(0)
+                score_flip.append(False)
+            if (pov_wdl := info.get("wdl")) is not None:
+                rel = pov_wdl.relative
+                wdls.append((rel.wins, rel.draws, rel.losses))
+                wdl_flip.append(pov_wdl.turn == chess.BLACK)
+            else:
+                wdls.append((0, 1000, 0))
+                wdl_flip.append(False)
+        score_q = np.array(scores, dtype=np.int64)
+        score_q[score_flip] *= -1
+        wdl = np.array(wdls, dtype=np.int64)
+        wdl[wdl_flip] = wdl[wdl_flip][:, ::-1]
+        return cls(
+            nodes=np.array(nodes, dtype=np.int64),
+            score_q=score_q,
+            score_white=wdl[:, 0],
+            score_draw=wdl[:, 1],
+            score_black=wdl[:, 2],
+            moves_left=info_bundle[0].get("movesleft"),
+        )
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def head(self, n: int) -> "BundleColumns":
+        return BundleColumns(
+            nodes=self.nodes[:n],
+            score_q=self.score_q[:n],
+            score_white=self.score_white[:n],
+            score_draw=self.score_draw[:n],
+            score_black=self.score_black[:n],
+            moves_left=self.moves_left,
+        )
+
+    def totals(self) -> Totals:
+        nodes = int(self.nodes.sum())
+        # Products are summed exactly in int64 and only then divided as Python
+        # ints, so the rounding is identical to the per-line implementation.
+        weighted = self.nodes @ np.stack(
+            [self.score_q, self.score_white, self.score_black], axis=1
+        )
+        score_q, score_white, score_black = (round(int(x) / nodes) for x in weighted)
+        return Totals(
+            nodes=nodes,
+            score_q=score_q,
+            score_white=score_white,
+            score_draw=1000 - score_white - score_black,
+            score_black=score_black,
+            moves_left=self.moves_left,
+        )
+
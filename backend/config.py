@@ -37,6 +37,69 @@ UCI_ANALYZERS = [
         ],
         "max_multipv": 230,
         "show_pv": 20,
+        # Parse engine output with LeanUciProtocol (scores only, PVs as text).
+        "lean_info": True,
+        # Prepare bundles (totals, SAN PVs, update payload) in a worker thread,
+        # keeping at most offload_queue_size bundles queued.
+        "offload_bundles": False,
+        "offload_queue_size": 1,
+        # Don't analyze positions already searched this deep in any game with
+        # the same options.
+        # "transposition_skip_nodes": 50_000_000,
+        # Once the position has ponder_after_nodes nodes, analyze the
+        # ponder_moves most likely replies for ponder_nodes nodes each.
+        # "ponder_after_nodes": 20_000_000,
+        "ponder_moves": 1,
+        "ponder_nodes": 5_000_000,
     }
 ]
+# Evaluations are written to the DB in batches, at least every
+# EVAL_FLUSH_INTERVAL_SEC seconds, or sooner when a position gains
+# EVAL_FLUSH_NODES_STEP nodes.
+EVAL_FLUSH_INTERVAL_SEC = 5.0
+EVAL_FLUSH_NODES_STEP = 1_000_000
+# Number of recent positions kept in memory by the transposition table.
+TRANSPOSITION_CACHE_SIZE = 10000
+# Rate limit (token bucket) for the Lichess API requests.
+LICHESS_REQUESTS_PER_SEC = 5.0
+LICHESS_REQUESTS_BURST = 5
+# Idle analyzers look for new games every GAME_POLL_INTERVAL_SEC seconds, and
+# every GAME_POLL_FAST_INTERVAL_SEC seconds within GAME_POLL_FAST_WINDOW_SEC
+# seconds around the scheduled start of a round.
+GAME_POLL_INTERVAL_SEC = 10.0
+GAME_POLL_FAST_INTERVAL_SEC = 2.0
+GAME_POLL_FAST_WINDOW_SEC = 120.0
+# Outgoing websocket frames are queued per connection. When a queue has
+# WS_SEND_QUEUE_SIZE frames, WS_OVERFLOW_POLICY decides what happens:
+# "coalesce" drops superseded evaluation updates, "drop" drops the oldest queued
+# update of the same evaluation, "disconnect" closes connections that stay full
+# for WS_MAX_LAG_SEC. Other updates (e.g. new moves) are never dropped, so with
+# any policy connections are closed once they have WS_MAX_QUEUE_SIZE frames.
+WS_SEND_QUEUE_SIZE = 64
+WS_OVERFLOW_POLICY = "coalesce"
+WS_MAX_LAG_SEC = 10.0
+WS_MAX_QUEUE_SIZE = 1024
+# Evaluation updates of a position are sent at most this many times per second,
+# only the latest pending one is kept. None sends every update.
+WS_MAX_UPDATES_PER_SEC = 4.0
+# Number of the latest updates kept per game, so that reconnecting clients only
+# get the ones they missed. Clients further behind get the full game again.
+WS_REPLAY_RING_SIZE = 256
+# Number of games whose replay rings are kept, the least recently updated ones
+# are dropped first.
+WS_REPLAY_MAX_GAMES = 64
+# Largest number of plies whose evaluations are loaded and sent at once, longer
+# ranges are sent in several frames.
+WS_EVALS_FRAME_PLIES = 1024
+# Number of games not being analyzed whose positions are kept in memory.
+POSITIONS_CACHE_SIZE = 200
+# Number of (game, ply) evaluations kept in memory for the clients selecting a
+# position.
+EVALUATIONS_CACHE_SIZE = 10000
+# The game list is loaded from the DB once per change. Changes made outside of
+# the server, e.g. hiding games with the CLI, show up after this many seconds.
+GAMES_LIST_MAX_AGE_SEC = 60.0
+# Seconds the HTTP snapshots of finished games may be cached by browsers and
+# proxies. Snapshots of other games are revalidated on every request.
+SNAPSHOT_MAX_AGE_SEC = 86400
 OAS = False
@@ -46,6 +46,7 @@ class GamePosition(Model):
     game = fields.ForeignKeyField(
         model_name="lc0live.Game", related_name="positions", index=True
     )
+    game_id: int
     # Zero for startpos, 2×move-1 after white move, 2×move after black move.
     ply_number = fields.IntField(index=True)
     fen = fields.TextField()
@@ -74,6 +75,7 @@ class GamePositionEvaluation(Model):
     position = fields.ForeignKeyField(
         model_name="lc0live.GamePosition", related_name="evaluations", index=True
     )
+    position_id: int
     nodes = fields.IntField()
     time = fields.IntField()
     depth = fields.IntField()
@@ -98,6 +100,22 @@ class GamePositionEvaluationMove(Model):
     moves_left = fields.IntField(null=True)
 
 
+class PositionIndex(Model):
+    id = fields.IntField(primary_key=True)
+    # Polyglot Zobrist hash of the position, as a signed 64-bit integer.
+    zobrist = fields.BigIntField(unique=True)
+    # The deepest evaluation of the position among all games.
+    position = fields.ForeignKeyField(
+        model_name="lc0live.GamePosition", related_name="index_entries"
+    )
+    position_id: int
+    evaluation = fields.ForeignKeyField(
+        model_name="lc0live.GamePositionEvaluation", related_name="index_entries"
+    )
+    evaluation_id: int
+    nodes = fields.IntField()
+
+
 async def init():
     await Tortoise.init(
         db_url=DB_PATH,
@@ -0,0 +1,286 @@
+from typing import Any, Optional, cast
+
+import db
+from tortoise.expressions import Q
+from ws_notifier import (
+    WsEvaluationData,
+    WsGameData,
+    WsPlayerData,
+    WsPositionData,
+    WsVariationData,
+)
+
+# Read-only queries for the snapshots sent to the clients. They fetch the needed
+# columns as tuples and serialize them directly, the same as make_*_update() do
+# with the hydrated models, which is most of the time spent for long games.
+
+GAME_COLUMNS = (
+    "id",
+    "game_name",
+    "round_name",
+    "tournament__name",
+    "is_finished",
+    "player1_name",
+    "player1_rating",
+    "player1_fide_id",
+    "player1_fed",
+    "player2_name",
+    "player2_rating",
+    "player2_fide_id",
+    "player2_fed",
+    "lichess_round_id",
+    "lichess_id",
+)
+POSITION_COLUMNS = (
+    "id",
+    "ply_number",
+    "move_uci",
+    "move_san",
+    "fen",
+    "white_clock",
+    "black_clock",
+    "q_score",
+    "white_score",
+    "draw_score",
+    "black_score",
+    "moves_left",
+    "nodes",
+    "time",
+    "depth",
+    "seldepth",
+)
+EVALUATION_COLUMNS = ("id", "nodes", "time", "depth", "seldepth", "moves_left")
+MOVE_COLUMNS = (
+    "evaluation_id",
+    "nodes",
+    "pv_san",
+    "pv_uci",
+    "q_score",
+    "white_score",
+    "draw_score",
+    "black_score",
+    "mate_score",
+)
+
+
+def make_game_data(row: tuple, is_being_analyzed: bool) -> WsGameData:
+    (
+        game_id,
+        game_name,
+        round_name,
+        tournament_name,
+        is_finished,
+        player1_name,
+        player1_rating,
+        player1_fide_id,
+        player1_fed,
+        player2_name,
+        player2_rating,
+        player2_fide_id,
+        player2_fed,
+        lichess_round_id,
+        lichess_id,
+    ) = row
+    return WsGameData(
+        gameId=game_id,
+        name=f"{game_name} ({round_name}) --- {tournament_name}",
+        isFinished=is_finished,
+        isBeingAnalyzed=is_being_analyzed,
+        player1=WsPlayerData(
+            name=player1_name,
+            rating=player1_rating,
+            fideId=player1_fide_id,
+            fed=player1_fed,
+        ),
+        player2=WsPlayerData(
+            name=player2_name,
+            rating=player2_rating,
+            fideId=player2_fide_id,
+            fed=player2_fed,
+        ),
+        feedUrl="https://lichess.org/broadcast/-/-/" f"{lichess_round_id}/{lichess_id}",
+    )
+
+
+# The row starts with the id of the position, which is not part of the data.
+def make_position_data(game_id: int, row: tuple) -> WsPositionData:
+    (
+        _,
+        ply,
+        move_uci,
+        move_san,
+        fen,
+        white_clock,
+        black_clock,
+        q_score,
+        white_score,
+        draw_score,
+        black_score,
+        moves_left,
+        nodes,
+        time,
+        depth,
+        seldepth,
+    ) = row
+    return WsPositionData(
+        gameId=game_id,
+        ply=ply,
+        moveUci=move_uci,
+        moveSan=move_san,
+        fen=fen,
+        whiteClock=white_clock,
+        blackClock=black_clock,
+        scoreQ=q_score,
+        scoreW=white_score,
+        scoreD=draw_score,
+        scoreB=black_score,
+        movesLeft=moves_left,
+        nodes=nodes,
+        time=time,
+        depth=depth,
+        seldepth=seldepth,
+    )
+
+
+# Same as make_evaluations_update() for a single evaluation, whose variations
+# are sent in full. The move rows start with their evaluation id.
+def make_evaluation_data(
+    game_id: int, ply: int, row: Any, move_rows: list[tuple]
+) -> WsEvaluationData:
+    eval_id, nodes, time, depth, seldepth, moves_left = row
+    return WsEvaluationData(
+        gameId=game_id,
+        ply=ply,
+        evalId=eval_id,
+        nodes=nodes,
+        time=time,
+        depth=depth,
+        seldepth=seldepth,
+        movesLeft=moves_left,
+        variations=[
+            WsVariationData(
+                nodes=move_nodes,
+                pvSan=pv_san,
+                pvUci=pv_uci,
+                scoreQ=q_score,
+                scoreW=white_score,
+                scoreD=draw_score,
+                scoreB=black_score,
+                mateScore=mate_score,
+            )
+            for (
+                _,
+                move_nodes,
+                pv_san,
+                pv_uci,
+                q_score,
+                white_score,
+                draw_score,
+                black_score,
+                mate_score,
+            ) in move_rows
+        ],
+    )
+
+
+async def fetch_games_data(analyzed_games: set[int]) -> list[WsGameData]:
+    rows = (
+        await db.Game.filter(
+            Q(tournament__is_hidden=False) | Q(is_finished=False),
+            is_hidden=False,
+        )
+        .order_by("id")
+        .values_list(*GAME_COLUMNS)
+    )
+    return [make_game_data(row, row[0] in analyzed_games) for row in rows]
+
+
+# Returns (position id, position data) for every position of the game.
+async def fetch_positions(game_id: int) -> list[tuple[int, WsPositionData]]:
+    rows = (
+        await db.GamePosition.filter(game=game_id)
+        .order_by("ply_number")
+        .values_list(*POSITION_COLUMNS)
+    )
+    return [(row[0], make_position_data(game_id, row)) for row in rows]
+
+
+async def fetch_position_id(game_id: int, ply: int) -> Optional[int]:
+    ids = cast(
+        list[int],
+        await db.GamePosition.filter(game=game_id, ply_number=ply).values_list(
+            "id", flat=True
+        ),
+    )
+    return ids[0] if ids else None
+
+
+async def _fetch_moves(eval_ids: list[int]) -> dict[int, list[tuple]]:
+    moves: dict[int, list[tuple]] = {eval_id: [] for eval_id in eval_ids}
+    if eval_ids:
+        for row in (
+            await db.GamePositionEvaluationMove.filter(evaluation_id__in=eval_ids)
+            .order_by("-nodes")
+            .values_list(*MOVE_COLUMNS)
+        ):
+            moves[row[0]].append(row)
+    return moves
+
+
+# The latest evaluation of the position, an empty list if there is none.
+async def fetch_latest_evaluation(
+    game_id: int, ply: int, position_id: int
+) -> list[WsEvaluationData]:
+    rows = (
+        await db.GamePositionEvaluation.filter(position_id=position_id)
+        .order_by("-id")
+        .limit(1)
+        .values_list(*EVALUATION_COLUMNS)
+    )
+    if not rows:
+        return []
+    moves = await _fetch_moves([rows[0][0]])
+    return [make_evaluation_data(game_id, ply, rows[0], moves[rows[0][0]])]
+
+
+# The latest evaluation of each of the positions, given as {position id: ply},
+# in one query for the evaluations and one for their moves. Positions must be
+# of the game and within the ply range.
+async def fetch_latest_evaluations(
+    game_id: int,
+    plies: dict[int, int],
+    from_ply: int,
+    to_ply: Optional[int],
+) -> dict[int, WsEvaluationData]:
+    if not plies:
+        return {}
+    conn = db.GamePositionEvaluation._meta.db
+    # Placeholders depend on the backend, e.g. ? for sqlite and $1 for asyncpg.
+    executor = conn.executor_class(model=db.GamePositionEvaluation, db=conn)
+    params: list[Any] = [game_id, from_ply]
+    ply_filter = f"AND p.ply_number >= {executor.parameter(1).get_sql()}"
+    if to_ply is not None:
+        params.append(to_ply)
+        ply_filter += f" AND p.ply_number <= {executor.parameter(2).get_sql()}"
+    _, rows = await conn.execute_query(
+        f"""
+        SELECT position_id, {", ".join(EVALUATION_COLUMNS)} FROM (
+            SELECT e.*, ROW_NUMBER() OVER (
+                PARTITION BY e.position_id ORDER BY e.id DESC
+            ) AS rn
+            FROM {db.GamePositionEvaluation._meta.db_table} e
+            JOIN {db.GamePosition._meta.db_table} p ON p.id = e.position_id
+            WHERE p.game_id = {executor.parameter(0).get_sql()} {ply_filter}
+        ) AS latest
+        WHERE latest.rn = 1
+        """,
+        params,
+    )
+    rows = [tuple(row) for row in rows if row[0] in plies]
+    moves = await _fetch_moves([row[1] for row in rows])
+    return {
+        plies[row[0]]: make_evaluation_data(
+            game_id, plies[row[0]], row[1:], moves[row[1]]
+        )
+        for row in rows
+    }
@@ -0,0 +1,110 @@
+from typing import TYPE_CHECKING, Any, cast
+
+if TYPE_CHECKING:
+    from ws_notifier import (
+        WsEvaluationData,
+        WsEvaluationDelta,
+        WsVariationData,
+        WsVariationDelta,
+    )
+
+# Version of the websocket protocol in which evaluations are sent as deltas.
+DELTA_PROTOCOL_VERSION = 2
+
+EVALUATION_FIELDS = ["evalId", "nodes", "time", "depth", "seldepth", "movesLeft"]
+VARIATION_FIELDS = ["nodes", "scoreQ", "scoreW", "scoreD", "scoreB", "mateScore"]
+PV_FIELDS = ["pvSan", "pvUci"]
+
+
+def _common_prefix_len(a: list[str], b: list[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def make_variation_delta(
+    idx: int, prev: "WsVariationData", cur: "WsVariationData"
+) -> "WsVariationDelta":
+    delta: dict[str, Any] = {"i": idx}
+    for field in VARIATION_FIELDS:
+        if field in cur and (field not in prev or prev[field] != cur[field]):
+            delta[field] = cur[field]
+    for field in PV_FIELDS:
+        if field not in cur or prev.get(field) == cur[field]:
+            continue
+        prev_moves = prev.get(field, "").split()
+        cur_moves = cur[field].split()
+        keep = _common_prefix_len(prev_moves, cur_moves)
+        delta[field + "Prefix"] = keep
+        delta[field] = " ".join(cur_moves[keep:])
+    return cast("WsVariationDelta", delta)
+
+
+def make_evaluation_delta(
+    prev: "WsEvaluationData", cur: "WsEvaluationData"
+) -> "WsEvaluationDelta":
+    base_rev, rev = prev.get("rev"), cur.get("rev")
+    assert base_rev is not None and rev is not None
+    delta: dict[str, Any] = {
+        "gameId": cur["gameId"],
+        "ply": cur["ply"],
+        "baseRev": base_rev,
+        "rev": rev,
+        "numVariations": len(cur["variations"]),
+    }
+    for field in EVALUATION_FIELDS:
+        if prev.get(field) != cur.get(field):
+            delta[field] = cur.get(field)
+    # Variations are matched by their first move, as they move up and down the
+    # list when their node counts change.
+    prev_idx = {
+        v.get("pvUci", "").partition(" ")[0]: j
+        for j, v in enumerate(prev["variations"])
+    }
+    variations = []
+    for idx, variation in enumerate(cur["variations"]):
+        j = prev_idx.get(variation.get("pvUci", "").partition(" ")[0], -1)
+        if j == -1:
+            variations.append({"i": idx, "j": -1, **variation})
+            continue
+        variation_delta = make_variation_delta(idx, prev["variations"][j], variation)
+        if j != idx:
+            variation_delta["j"] = j
+        if len(variation_delta) > 1:
+            variations.append(variation_delta)
+    delta["variations"] = variations
+    return cast("WsEvaluationDelta", delta)
+
+
+# Same as the client side reconstruction in frontend/eval_delta.ts.
+def apply_evaluation_delta(
+    prev: "WsEvaluationData", delta: "WsEvaluationDelta"
+) -> "WsEvaluationData":
+    assert prev.get("rev") == delta["baseRev"]
+    res: dict[str, Any] = dict(prev)
+    for field in EVALUATION_FIELDS:
+        if field in delta:
+            res[field] = delta[field]
+    res["rev"] = delta["rev"]
+    variations: list[dict[str, Any]] = [
+        dict(v) for v in prev["variations"][: delta["numVariations"]]
+    ]
+    variations += [{} for _ in range(delta["numVariations"] - len(variations))]
+    for variation_delta in delta["variations"]:
+        j = variation_delta.get("j", variation_delta["i"])
+        variation: dict[str, Any] = dict(prev["variations"][j]) if j != -1 else {}
+        fields: dict[str, Any] = dict(variation_delta)
+        for field, value in fields.items():
+            if field in ("i", "j") or field.endswith("Prefix"):
+                continue
+            if field in PV_FIELDS and field + "Prefix" in fields:
+                keep = fields[field + "Prefix"]
+                value = " ".join(variation[field].split()[:keep] + value.split())
+            variation[field] = value
+        variations[variation_delta["i"]] = variation
+    res["variations"] = variations
+    return cast("WsEvaluationData", res)
+
@@ -0,0 +1,190 @@
+import dataclasses
+from typing import Optional
+
+import anyio
+import db
+import tortoise.exceptions
+from sanic.log import logger
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from transpositions import TranspositionTable
+
+POSITION_TOTALS_FIELDS = [
+    "nodes",
+    "q_score",
+    "white_score",
+    "draw_score",
+    "black_score",
+    "moves_left",
+    "time",
+    "depth",
+    "seldepth",
+]
+
+
+# Entries that still fail to be written after this many flushes are dropped.
+MAX_FLUSH_ATTEMPTS = 3
+
+
+@dataclasses.dataclass
+class PendingEvaluation:
+    position: db.GamePosition
+    evaluation: db.GamePositionEvaluation
+    moves: list[db.GamePositionEvaluationMove]
+    # The key to record the evaluation in the transposition table with, if any.
+    transposition_key: Optional[int] = None
+    # Number of failed flushes of the entry.
+    attempts: int = 0
+
+    # The same entry, to be inserted again after its write was rolled back.
+    def retry(self) -> "PendingEvaluation":
+        return PendingEvaluation(
+            position=self.position,
+            evaluation=self.evaluation.clone(),
+            moves=[move.clone() for move in self.moves],
+            transposition_key=self.transposition_key,
+            attempts=self.attempts + 1,
+        )
+
+
+# Keeps the latest evaluation of every position in memory and writes them to the
+# DB in batches, either every `flush_interval_sec` seconds or as soon as some
+# position gained `flush_nodes_step` nodes since its last flush.
+class EvaluationStore:
+    _pending: dict[int, PendingEvaluation]
+    _flushing: dict[int, PendingEvaluation]
+    _flushed_nodes: dict[int, int]
+    _flush_interval_sec: float
+    _flush_nodes_step: int
+    _flush_requested: anyio.Event
+    _flush_lock: anyio.Lock
+    _transpositions: Optional[TranspositionTable]
+
+    def __init__(
+        self,
+        flush_interval_sec: float,
+        flush_nodes_step: int,
+        transpositions: Optional[TranspositionTable] = None,
+    ):
+        self._pending = {}
+        self._flushing = {}
+        self._flushed_nodes = {}
+        self._flush_interval_sec = flush_interval_sec
+        self._flush_nodes_step = flush_nodes_step
+        self._flush_requested = anyio.Event()
+        self._flush_lock = anyio.Lock()
+        self._transpositions = transpositions
+
+    def put(
+        self,
+        position: db.GamePosition,
+        evaluation: db.GamePositionEvaluation,
+        moves: list[db.GamePositionEvaluationMove],
+        transposition_key: Optional[int] = None,
+    ) -> None:
+        self._pending[position.id] = PendingEvaluation(
+            position=position,
+            evaluation=evaluation,
+            moves=moves,
+            transposition_key=transposition_key,
+        )
+        flushed_nodes = self._flushed_nodes.get(position.id, 0)
+        if evaluation.nodes - flushed_nodes >= self._flush_nodes_step:
+            self._flush_requested.set()
+
+    def get_pending(self, position_id: int) -> Optional[PendingEvaluation]:
+        return self._pending.get(position_id) or self._flushing.get(position_id)
+
+    def discard(self, position_ids: list[int]) -> None:
+        for position_id in position_ids:
+            self._pending.pop(position_id, None)
+            self._flushing.pop(position_id, None)
+            self._flushed_nodes.pop(position_id, None)
+
+    async def _write(self, entry: PendingEvaluation, conn: BaseDBAsyncClient) -> None:
+        await entry.evaluation.save(using_db=conn)
+        for move in entry.moves:
+            move.evaluation = entry.evaluation
+        await db.GamePositionEvaluationMove.bulk_create(entry.moves, using_db=conn)
+        await entry.position.save(using_db=conn, update_fields=POSITION_TOTALS_FIELDS)
+        if self._transpositions is not None and entry.transposition_key is not None:
+            await self._transpositions.record(
+                entry.transposition_key,
+                entry.position,
+                entry.evaluation,
+                entry.moves,
+                conn,
+            )
+
+    # Puts an entry whose write was rolled back back into the queue, unless a
+    # newer evaluation of the position came meanwhile or it was discarded.
+    def _requeue(self, position_id: int, entry: PendingEvaluation) -> None:
+        if self._flushing.get(position_id) is not entry:
+            return
+        if entry.attempts + 1 >= MAX_FLUSH_ATTEMPTS:
+            logger.error(f"Dropping the evaluation of position {position_id}.")
+            return
+        self._pending.setdefault(position_id, entry.retry())
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return
+            written: list[tuple[int, PendingEvaluation]] = []
+            failed: list[tuple[int, PendingEvaluation]] = []
+            try:
+                async with in_transaction() as conn:
+                    for position_id, entry in list(self._flushing.items()):
+                        if self._flushing.get(position_id) is not entry:
+                            continue  # Discarded meanwhile.
+                        # Every position has its own savepoint, so that one
+                        # failing write doesn't roll back the others.
+                        await conn.execute_query("SAVEPOINT flush_entry")
+                        try:
+                            await self._write(entry, conn)
+                        except tortoise.exceptions.IntegrityError as e:
+                            logger.error(
+                                f"Database insertion error for position "
+                                f"{position_id}: {e}"
+                            )
+                            await conn.execute_query(
+                                "ROLLBACK TO SAVEPOINT flush_entry"
+                            )
+                            failed.append((position_id, entry))
+                        else:
+                            await conn.execute_query("RELEASE SAVEPOINT flush_entry")
+                            written.append((position_id, entry))
+            except BaseException:
+                # Nothing was written.
+                for position_id, entry in self._flushing.items():
+                    self._requeue(position_id, entry)
+                raise
+            finally:
+                if self._pending:
+                    self._flush_requested.set()
+            logger.debug(f"Flushed {len(written)} evaluations.")
+            for position_id, entry in failed:
+                self._requeue(position_id, entry)
+            for position_id, entry in written:
+                if self._flushing.get(position_id) is entry:
+                    self._flushed_nodes[position_id] = entry.evaluation.nodes
+            self._flushing = {}
+
+    # Same as flush(), but errors are only logged.
+    async def try_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush evaluations: {e}")
+
+    async def run(self) -> None:
+        try:
+            while True:
+                with anyio.move_on_after(self._flush_interval_sec):
+                    await self._flush_requested.wait()
+                self._flush_requested = anyio.Event()
+                await self.try_flush()
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.try_flush()
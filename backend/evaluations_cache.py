@@ -0,0 +1,119 @@
+import collections
+import dataclasses
+from typing import Awaitable, Callable, Optional
+
+import anyio
+from sanic.helpers import json_dumps
+from ws_frame import EncodedFrame
+from ws_notifier import WebsocketResponse, WsEvaluationData
+
+
+@dataclasses.dataclass
+class _Entry:
+    evaluations: list[WsEvaluationData]
+    # The encoded `evaluations` response, made on the first request after a
+    # change.
+    frame: Optional[EncodedFrame] = None
+
+    def get_frame(self) -> EncodedFrame:
+        if self.frame is None:
+            self.frame = EncodedFrame(
+                json_dumps(WebsocketResponse(evaluations=self.evaluations))
+            )
+        return self.frame
+
+
+@dataclasses.dataclass
+class _Load:
+    done: anyio.Event
+    frame: Optional[EncodedFrame] = None
+    # Set when the position changed while it was being loaded.
+    stale: bool = False
+
+
+@dataclasses.dataclass
+class EvaluationsCacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Misses that waited for the load of another request.
+    coalesced: int = 0
+    size: int = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# The latest `evaluations` response per (game, ply), as sent to the clients
+# that select a position. Analyzers put every new evaluation, other positions
+# are loaded from the DB on demand, once for all the clients asking for them.
+class EvaluationsCache:
+    _entries: collections.OrderedDict[tuple[int, int], _Entry]
+    _max_size: int
+    _loading: dict[tuple[int, int], _Load]
+    _stats: EvaluationsCacheStats
+
+    def __init__(self, max_size: int = 10000):
+        self._entries = collections.OrderedDict()
+        self._max_size = max_size
+        self._loading = {}
+        self._stats = EvaluationsCacheStats()
+
+    def _add(self, key: tuple[int, int], entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def put(self, game_id: int, ply: int, evaluations: list[WsEvaluationData]) -> None:
+        self._add((game_id, ply), _Entry(evaluations=evaluations))
+
+    # The cached evaluations of the position, if any, without loading them.
+    def peek(self, game_id: int, ply: int) -> Optional[list[WsEvaluationData]]:
+        entry = self._entries.get((game_id, ply))
+        return entry.evaluations if entry is not None else None
+
+    # Forgets the plies from `ply` on, e.g. when the mainline is rewritten.
+    def discard_from(self, game_id: int, ply: int) -> None:
+        for key in [k for k in self._entries if k[0] == game_id and k[1] >= ply]:
+            del self._entries[key]
+        for key, load in self._loading.items():
+            if key[0] == game_id and key[1] >= ply:
+                load.stale = True
+
+    # Returns the cached response, or the one made by `load`. None if there is
+    # no such position.
+    async def get_frame(
+        self,
+        game_id: int,
+        ply: int,
+        load: Callable[[], Awaitable[Optional[WebsocketResponse]]],
+    ) -> Optional[EncodedFrame]:
+        key = (game_id, ply)
+        if (entry := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return entry.get_frame()
+        self._stats.misses += 1
+        if (in_flight := self._loading.get(key)) is not None:
+            self._stats.coalesced += 1
+            await in_flight.done.wait()
+            return in_flight.frame
+        in_flight = self._loading[key] = _Load(done=anyio.Event())
+        try:
+            response = await load()
+            # An evaluation put meanwhile is fresher than the loaded one.
+            if (entry := self._entries.get(key)) is not None:
+                in_flight.frame = entry.get_frame()
+            elif response is not None:
+                entry = _Entry(evaluations=response.get("evaluations", []))
+                if not in_flight.stale:
+                    self._add(key, entry)
+                in_flight.frame = entry.get_frame()
+            return in_flight.frame
+        finally:
+            del self._loading[key]
+            in_flight.done.set()
+
+    def get_stats(self) -> EvaluationsCacheStats:
+        return dataclasses.replace(self._stats, size=len(self._entries))
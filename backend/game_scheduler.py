@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import time
+from typing import Callable
+
+import anyio
+import db
+from game_selector import (
+    get_best_game,
+    get_game_candidates,
+    get_upcoming_round_start,
+    make_game,
+)
+from sanic.log import logger
+
+# Games which were already being followed go before newly discovered ones.
+PRIORITY_ONGOING = 0
+PRIORITY_NEW = 1
+
+
+# Hands out games to idle analyzers. Games ready to be analyzed are kept in a
+# priority queue, which a single poller task fills from the DB and from Lichess
+# whenever some analyzer is waiting for a game.
+class GameScheduler:
+    _get_active_games: Callable[[], list[db.Game]]
+    _on_game_created: Callable[[db.Game], None]
+    _poll_interval_sec: float
+    _fast_poll_interval_sec: float
+    _fast_poll_window_sec: float
+    _ready: list[tuple[int, int, db.Game]]
+    _counter: itertools.count
+    _num_waiting: int
+    _ready_changed: anyio.Event
+    _poll_requested: anyio.Event
+
+    def __init__(
+        self,
+        get_active_games: Callable[[], list[db.Game]],
+        on_game_created: Callable[[db.Game], None],
+        poll_interval_sec: float,
+        fast_poll_interval_sec: float,
+        fast_poll_window_sec: float,
+    ):
+        self._get_active_games = get_active_games
+        self._on_game_created = on_game_created
+        self._poll_interval_sec = poll_interval_sec
+        self._fast_poll_interval_sec = fast_poll_interval_sec
+        self._fast_poll_window_sec = fast_poll_window_sec
+        self._ready = []
+        self._counter = itertools.count()
+        self._num_waiting = 0
+        self._ready_changed = anyio.Event()
+        self._poll_requested = anyio.Event()
+
+    def _push(self, game: db.Game, priority: int) -> None:
+        heapq.heappush(self._ready, (priority, next(self._counter), game))
+        self._ready_changed.set()
+        self._ready_changed = anyio.Event()
+
+    # Called by an analyzer when it's idle, e.g. after its game has finished.
+    async def next_game(self) -> db.Game:
+        self._num_waiting += 1
+        try:
+            while True:
+                active_ids = {g.id for g in self._get_active_games()}
+                while self._ready:
+                    _, _, game = heapq.heappop(self._ready)
+                    if game.id not in active_ids:
+                        return game
+                ready_changed = self._ready_changed
+                self._poll_requested.set()
+                await ready_changed.wait()
+        finally:
+            self._num_waiting -= 1
+
+    async def _poll(self) -> None:
+        active_ids = {g.id for g in self._get_active_games()}
+        queued_ids = {g.id for _, _, g in self._ready}
+        for game in await db.Game.filter(is_finished=False):
+            if game.id not in active_ids and game.id not in queued_ids:
+                logger.info(f"Found ongoing game {game.game_name}")
+                self._push(game, PRIORITY_ONGOING)
+        if len(self._ready) >= self._num_waiting:
+            return
+        candidates = await get_game_candidates()
+        while candidates and len(self._ready) < self._num_waiting:
+            best_candidate = get_best_game(candidates)
+            candidates.remove(best_candidate)
+            logger.info(f"Will follow game: {best_candidate.game['name']}")
+            game = await make_game(best_candidate)
+            self._on_game_created(game)
+            self._push(game, PRIORITY_NEW)
+
+    # Polls more often around the scheduled start of a round, so that the first
+    # moves are picked up quickly.
+    async def _get_poll_interval(self) -> float:
+        starts_at = await get_upcoming_round_start(grace_sec=self._fast_poll_window_sec)
+        if starts_at is None:
+            return self._poll_interval_sec
+        until_start = starts_at - time.time()
+        if until_start <= self._fast_poll_window_sec:
+            return self._fast_poll_interval_sec
+        return min(self._poll_interval_sec, until_start - self._fast_poll_window_sec)
+
+    async def run(self) -> None:
+        while True:
+            if not self._num_waiting:
+                await self._poll_requested.wait()
+            self._poll_requested = anyio.Event()
+            interval = self._poll_interval_sec
+            try:
+                await self._poll()
+                if self._num_waiting > len(self._ready):
+                    interval = await self._get_poll_interval()
+                    logger.debug(f"No games found, next poll in {interval:.1f}s")
+            except Exception as e:
+                logger.error(f"Error while looking for games: {e}")
+            with anyio.move_on_after(interval):
+                await self._poll_requested.wait()
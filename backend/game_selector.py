@@ -1,5 +1,6 @@
 import asyncio
 import dataclasses
+import time
 from typing import Any, Optional, cast
 
 import chess.pgn
@@ -17,23 +18,24 @@ class GameInfo:
 
 
 async def get_game_candidates() -> list[GameInfo]:
-    existing_game_ids: set[str] = set(
-        cast(list[str], await db.Game.all().values_list("lichess_id", flat=True))
-    )
-    # Gather ongoing games from unfinished tournaments.
+    started = time.monotonic()
+    # Gather ongoing games from unfinished tournaments, the Lichess client
+    # enforces the rate limit.
     ongoing_tournaments = await db.Tournament.filter(is_finished=False)
-    tournaments = []
-    for i, t in enumerate(ongoing_tournaments):
-        if i != 0:
-            await asyncio.sleep(0.2)
-        tournaments.append(await lichess.get_tournament(t.lichess_id))
+    db_done = time.monotonic()
+    tournaments = await asyncio.gather(
+        *[lichess.get_tournament(t.lichess_id) for t in ongoing_tournaments]
+    )
+    tournaments_done = time.monotonic()
 
     # Check for finished tournaments.
+    finished_ids: list[int] = []
     for db_t, tournament in zip(ongoing_tournaments, tournaments):
         if all(r.get("finished", False) for r in tournament["rounds"]):
             logger.info(f"Tournament {db_t.id} [{db_t.name}] " "is now finished.")
-            db_t.is_finished = True
-            await db_t.save()
+            finished_ids.append(db_t.id)
+    if finished_ids:
+        await db.Tournament.filter(id__in=finished_ids).update(is_finished=True)
     # Check for cadidate games.
     candidate_round_ids: list[str] = []
     candidate_round_tour_ids: list[int] = []
@@ -46,6 +48,20 @@ async def get_game_candidates() -> list[GameInfo]:
     candidate_rounds = await asyncio.gather(
         *[lichess.get_boards(rid) for rid in candidate_round_ids]
     )
+    boards_done = time.monotonic()
+    candidate_game_ids = [g["id"] for r in candidate_rounds for g in r["games"]]
+    existing_game_ids: set[str] = (
+        set(
+            cast(
+                list[str],
+                await db.Game.filter(lichess_id__in=candidate_game_ids).values_list(
+                    "lichess_id", flat=True
+                ),
+            )
+        )
+        if candidate_game_ids
+        else set()
+    )
     candidates: list[GameInfo] = []
     for r, tid in zip(candidate_rounds, candidate_round_tour_ids):
         for g in r["games"]:
@@ -55,9 +71,38 @@ async def get_game_candidates() -> list[GameInfo]:
             if g.get("status") != "*":
                 continue
             candidates.append(GameInfo(g, r["round"], r["tour"], tid))
+    done = time.monotonic()
+    logger.debug(
+        f"Candidate poll took {done - started:.2f}s: "
+        f"db {db_done - started:.2f}s, "
+        f"{len(tournaments)} tournaments {tournaments_done - db_done:.2f}s, "
+        f"{len(candidate_rounds)} rounds {boards_done - tournaments_done:.2f}s, "
+        f"{len(candidates)} candidates {done - boards_done:.2f}s"
+    )
     return candidates
 
 
+# Earliest start time (unix seconds) of the rounds of the unfinished tournaments
+# which have not started yet, or have been scheduled to start within the last
+# `grace_sec` seconds but have no moves yet.
+async def get_upcoming_round_start(grace_sec: float) -> Optional[float]:
+    ongoing_tournaments = await db.Tournament.filter(is_finished=False)
+    tournaments = await asyncio.gather(
+        *[lichess.get_tournament(t.lichess_id) for t in ongoing_tournaments]
+    )
+    now = time.time()
+    starts = [
+        r["startsAt"] / 1000
+        for t in tournaments
+        for r in t["rounds"]
+        if "startsAt" in r
+        and not r.get("ongoing", False)
+        and not r.get("finished", False)
+        and r["startsAt"] / 1000 > now - grace_sec
+    ]
+    return min(starts, default=None)
+
+
 def get_best_game(game_infos: list[GameInfo]) -> GameInfo:
     logger.info(f"Selecting best game from {len(game_infos)} games")
     games_with_fen = [x for x in game_infos if "fen" in x.game]
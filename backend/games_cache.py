@@ -0,0 +1,76 @@
+import dataclasses
+import time
+from typing import Awaitable, Callable, Optional
+
+import anyio
+from sanic.helpers import json_dumps
+from ws_frame import EncodedFrame
+from ws_notifier import WebsocketResponse, WsGameData
+
+
+@dataclasses.dataclass(eq=False)
+class GamesListSnapshot:
+    # Incremented whenever the list may have changed.
+    version: int
+    games: list[WsGameData]
+    loaded_at: float
+    _frame: Optional[EncodedFrame] = dataclasses.field(default=None, repr=False)
+
+    # The encoded `games` response, for the HTTP endpoint.
+    @property
+    def frame(self) -> EncodedFrame:
+        if self._frame is None:
+            self._frame = EncodedFrame(json_dumps(WebsocketResponse(games=self.games)))
+        return self._frame
+
+
+# The list of the games shown to the clients. It's loaded once per change, on
+# the first request after make_game(), or after an analyzer starts or finishes a
+# game. Changes made by other processes (e.g. hiding a game with the CLI) are
+# picked up after `max_age_sec`.
+class GamesListCache:
+    _version: int
+    _snapshot: Optional[GamesListSnapshot]
+    _max_age_sec: float
+    _lock: anyio.Lock
+
+    def __init__(self, max_age_sec: float = 60.0):
+        self._version = 0
+        self._snapshot = None
+        self._max_age_sec = max_age_sec
+        self._lock = anyio.Lock()
+
+    def invalidate(self) -> None:
+        self._version += 1
+
+    def _get_fresh(self) -> Optional[GamesListSnapshot]:
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or snapshot.version != self._version
+            or time.monotonic() - snapshot.loaded_at > self._max_age_sec
+        ):
+            return None
+        return snapshot
+
+    # Returns the current snapshot, or loads it with `load`. Requests coming
+    # while it's being loaded wait for that load.
+    async def get_snapshot(
+        self, load: Callable[[], Awaitable[list[WsGameData]]]
+    ) -> GamesListSnapshot:
+        if (snapshot := self._get_fresh()) is not None:
+            return snapshot
+        async with self._lock:
+            if (snapshot := self._get_fresh()) is not None:
+                return snapshot
+            version = self._version
+            games = await load()
+            snapshot = GamesListSnapshot(
+                version=version,
+                games=games,
+                loaded_at=time.monotonic(),
+            )
+            # Invalidated while loading, the next request loads it again.
+            if version == self._version:
+                self._snapshot = snapshot
+            return snapshot
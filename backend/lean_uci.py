@@ -0,0 +1,115 @@
+import inspect
+import re
+from typing import Any, Callable, Optional, cast
+
+import chess
+import chess.engine
+from sanic.log import logger
+
+UCI_MOVE_REGEX = re.compile(r"^(?:[a-h][1-8][a-h][1-8][pnbrqk]?|0000)$")
+INT_PARAMETERS = {
+    "depth",
+    "seldepth",
+    "nodes",
+    "multipv",
+    "movesleft",
+    "hashfull",
+    "nps",
+    "tbhits",
+}
+
+
+# An InfoDict which keeps the PV as the raw UCI text, next to the InfoDict keys.
+class LeanInfo(dict[str, Any]):
+    pv_uci: Optional[str] = None
+
+
+# The raw PV of an info parsed by parse_lean_info(), None for other infos.
+def get_lean_pv(info: object) -> Optional[str]:
+    return info.pv_uci if isinstance(info, LeanInfo) else None
+
+
+# Parses the fields of an UCI "info" line that the analyzer uses. The PV is not
+# converted to moves, it's kept as the raw text (see get_lean_pv()) for PvCache
+# to convert only for the lines that are shown.
+def parse_lean_info(arg: str, root_board: chess.Board) -> chess.engine.InfoDict:
+    info = LeanInfo()
+    tokens = arg.split()
+    idx = 0
+    try:
+        while idx < len(tokens):
+            parameter = tokens[idx]
+            idx += 1
+            if parameter in INT_PARAMETERS:
+                info[parameter] = int(tokens[idx])
+                idx += 1
+            elif parameter == "time":
+                info["time"] = int(tokens[idx]) / 1000.0
+                idx += 1
+            elif parameter == "score":
+                kind, value = tokens[idx], int(tokens[idx + 1])
+                idx += 2
+                if idx < len(tokens) and tokens[idx] in ("lowerbound", "upperbound"):
+                    info[tokens[idx]] = True
+                    idx += 1
+                score: chess.engine.Score = (
+                    chess.engine.Cp(value) if kind == "cp" else chess.engine.Mate(value)
+                )
+                info["score"] = chess.engine.PovScore(score, root_board.turn)
+            elif parameter == "wdl":
+                wdl = chess.engine.Wdl(*map(int, tokens[idx : idx + 3]))
+                idx += 3
+                info["wdl"] = chess.engine.PovWdl(wdl, root_board.turn)
+            elif parameter == "pv":
+                start = idx
+                while idx < len(tokens) and UCI_MOVE_REGEX.match(tokens[idx]):
+                    idx += 1
+                info.pv_uci = " ".join(tokens[start:idx])
+            elif parameter == "string":
+                info["string"] = " ".join(tokens[idx:])
+                break
+    except (ValueError, IndexError):
+        logger.error(f"Exception parsing info: {arg}")
+    return cast(chess.engine.InfoDict, info)
+
+
+# Whether `command` is the analysis command of python-chess, with the
+# `_info(arg)` handler of the info lines that LeanUciProtocol replaces.
+def _is_patchable_analysis(command: object) -> bool:
+    if type(command).__name__ != "UciAnalysisCommand":
+        return False
+    handler = getattr(type(command), "_info", None)
+    if not callable(handler):
+        return False
+    try:
+        params = list(inspect.signature(handler).parameters)
+    except (TypeError, ValueError):
+        return False
+    return params == ["self", "arg"]
+
+
+# UCI protocol which parses analysis output with parse_lean_info() instead of the
+# full python-chess parser, which builds moves for the PV of every multipv line.
+# It relies on python-chess internals, hence the pinned version in
+# requirements.txt; if they don't look as expected, the stock parser is used.
+class LeanUciProtocol(chess.engine.UciProtocol):
+    _warned_unpatchable = False
+
+    async def communicate(self, command_factory: Callable[[Any], Any]) -> Any:
+        def factory(engine: "LeanUciProtocol") -> Any:
+            command = command_factory(engine)
+            if _is_patchable_analysis(command):
+                command._info = lambda arg: command.analysis.post(
+                    parse_lean_info(arg, engine.board)
+                )
+            elif (
+                type(command).__name__ == "UciAnalysisCommand"
+                and not LeanUciProtocol._warned_unpatchable
+            ):
+                LeanUciProtocol._warned_unpatchable = True
+                logger.warning(
+                    "Unexpected python-chess analysis command, using its parser."
+                )
+            return command
+
+        return await super().communicate(factory)
@@ -1,48 +1,210 @@
+import collections
+import dataclasses
 import io
 import json
+import time
+from typing import Optional
 
 import aiohttp
+import anyio
 import chess.pgn
 import ndjson
+from sanic.log import logger
 
+LICHESS_BASE_URL = "https://lichess.org"
+# Seconds a response is served from the cache before being revalidated.
+ENDPOINT_TTLS_SEC = {
+    "tournaments": 60.0,
+    "tournament": 5.0,
+    "boards": 5.0,
+    "round_pgns": 0.0,
+}
 
-async def get_tournaments() -> list[dict]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get("https://lichess.org/api/broadcast") as response:
-            response.raise_for_status()
-            text = await response.text()
-            return ndjson.loads(text)
 
+@dataclasses.dataclass
+class _CacheEntry:
+    text: str
+    fetched_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
 
-async def get_tournament(tournament_id: str) -> dict:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://lichess.org/api/broadcast/{tournament_id}"
+
+@dataclasses.dataclass
+class _InFlight:
+    done: anyio.Event
+    text: Optional[str] = None
+    error: Optional[BaseException] = None
+
+
+class TokenBucket:
+    _rate: float
+    _capacity: float
+    _tokens: float
+    _updated_at: float
+    _lock: anyio.Lock
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = anyio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated_at) * self._rate
+            )
+            self._updated_at = now
+            if self._tokens < 1:
+                await anyio.sleep((1 - self._tokens) / self._rate)
+                self._updated_at = time.monotonic()
+                self._tokens = 1
+            self._tokens -= 1
+
+
+# Lichess API client sharing one connection pool. Responses are cached per
+# endpoint and revalidated with ETag/Last-Modified, identical concurrent
+# requests are sent only once, and all requests go through a rate limiter.
+class LichessClient:
+    _base_url: str
+    _session: Optional[aiohttp.ClientSession]
+    _limiter: TokenBucket
+    _cache: collections.OrderedDict[str, _CacheEntry]
+    _max_cache_entries: int
+    _in_flight: dict[str, _InFlight]
+
+    def __init__(
+        self,
+        base_url: str = LICHESS_BASE_URL,
+        requests_per_sec: float = 5.0,
+        burst: int = 5,
+        max_cache_entries: int = 1000,
+    ):
+        self._base_url = base_url.rstrip("/")
+        self._session = None
+        self._limiter = TokenBucket(rate=requests_per_sec, capacity=burst)
+        self._cache = collections.OrderedDict()
+        self._max_cache_entries = max_cache_entries
+        self._in_flight = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _fetch(self, path: str) -> str:
+        headers: dict[str, str] = {}
+        cached = self._cache.get(path)
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        await self._limiter.acquire()
+        async with self._get_session().get(
+            self._base_url + path, headers=headers
         ) as response:
+            if response.status == 304 and cached is not None:
+                logger.debug(f"Not modified: {path}")
+                cached.fetched_at = time.monotonic()
+                self._cache.move_to_end(path)
+                return cached.text
             response.raise_for_status()
             text = await response.text()
-            return json.loads(text)
+            self._cache[path] = _CacheEntry(
+                text=text,
+                fetched_at=time.monotonic(),
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+            self._cache.move_to_end(path)
+            if len(self._cache) > self._max_cache_entries:
+                self._cache.popitem(last=False)
+            return text
+
+    async def _get_text(self, path: str, endpoint: str) -> str:
+        cached = self._cache.get(path)
+        if (
+            cached is not None
+            and time.monotonic() - cached.fetched_at < ENDPOINT_TTLS_SEC[endpoint]
+        ):
+            return cached.text
+        if (in_flight := self._in_flight.get(path)) is not None:
+            await in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            if in_flight.text is None:
+                # The original request was cancelled.
+                return await self._get_text(path, endpoint)
+            return in_flight.text
+        in_flight = _InFlight(done=anyio.Event())
+        self._in_flight[path] = in_flight
+        try:
+            in_flight.text = await self._fetch(path)
+            return in_flight.text
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            del self._in_flight[path]
+            in_flight.done.set()
+
+    async def get_tournaments(self) -> list[dict]:
+        return ndjson.loads(await self._get_text("/api/broadcast", "tournaments"))
+
+    async def get_tournament(self, tournament_id: str) -> dict:
+        return json.loads(
+            await self._get_text(f"/api/broadcast/{tournament_id}", "tournament")
+        )
+
+    async def get_boards(self, round_id: str) -> dict:
+        return json.loads(
+            await self._get_text(f"/api/broadcast/-/-/{round_id}", "boards")
+        )
+
+    async def fetch_round_pgns(self, round_id: str) -> list[chess.pgn.Game]:
+        text = io.StringIO(
+            await self._get_text(f"/api/broadcast/round/{round_id}.pgn", "round_pgns")
+        )
+        res = []
+        while pgn := chess.pgn.read_game(text):
+            res.append(pgn)
+        return res
+
+
+_default_client: Optional[LichessClient] = None
+
+
+def get_default_client() -> LichessClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = LichessClient()
+    return _default_client
+
+
+def set_default_client(client: LichessClient) -> None:
+    global _default_client
+    _default_client = client
+
+
+async def get_tournaments() -> list[dict]:
+    return await get_default_client().get_tournaments()
+
+
+async def get_tournament(tournament_id: str) -> dict:
+    return await get_default_client().get_tournament(tournament_id)
 
 
 async def get_boards(round_id: str) -> dict:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://lichess.org/api/broadcast/-/-/{round_id}"
-        ) as response:
-            response.raise_for_status()
-            text = await response.text()
-            res = json.loads(text)
-            return res
+    return await get_default_client().get_boards(round_id)
 
 
 async def fetch_round_pgns(round_id: str) -> list[chess.pgn.Game]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://lichess.org/api/broadcast/round/{round_id}.pgn"
-        ) as response:
-            response.raise_for_status()
-            text = io.StringIO(await response.text())
-            res = []
-            while pgn := chess.pgn.read_game(text):
-                res.append(pgn)
-            return res
+    return await get_default_client().fetch_round_pgns(round_id)
@@ -1,73 +1,203 @@
+import contextlib
+import dataclasses
 from io import StringIO
-from typing import Tuple
+from typing import AsyncIterator, Optional, Tuple
 
 import aiohttp
 import chess.pgn
-from anyio.streams.memory import MemoryObjectSendStream
+from anyio.abc import TaskGroup
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from sanic.log import logger
 import anyio
 import aiohttp.client_exceptions
 
+GAME_SEPARATOR = b"\n\n\n"
+ROUND_URL = "https://lichess.org/api/stream/broadcast/round/{round_id}.pgn"
+# Header tags identifying a game within a round.
+GAME_KEY_TAGS = ("Round", "White", "Black")
+# Every update carries the full PGN, so a subscriber that lags behind may skip
+# intermediate ones: the oldest buffered update is dropped for the new one.
+SUBSCRIBER_BUFFER_SIZE = 8
+RECONNECT_MIN_DELAY_SEC = 1.0
+RECONNECT_MAX_DELAY_SEC = 60.0
 
-class PgnFeed:
-    queue: MemoryObjectSendStream[chess.pgn.Game]
+
+def read_block_headers(buf: str) -> chess.pgn.Headers:
+    # Only the header block is parsed, with the same defaults as read_game().
+    header_block = buf.strip().partition("\n\n")[0]
+    headers = chess.pgn.Headers()
+    headers.update(chess.pgn.read_headers(StringIO(header_block)) or {})
+    return headers
+
+
+@dataclasses.dataclass(eq=False)
+class _Subscriber:
     filters: list[Tuple[str, str]]
+    queue: MemoryObjectSendStream[chess.pgn.Game]
+    # The receiving end of `queue`, to drop the oldest update when it's full.
+    buffered: MemoryObjectReceiveStream[chess.pgn.Game]
+
+    def matches(self, headers: chess.pgn.Headers) -> bool:
+        return all(headers.get(k) == v for k, v in self.filters)
+
+    # Returns whether an older update was dropped to make room.
+    def send_latest(self, game: chess.pgn.Game) -> bool:
+        try:
+            self.queue.send_nowait(game)
+            return False
+        except anyio.WouldBlock:
+            self.buffered.receive_nowait()
+            self.queue.send_nowait(game)
+            return True
+
+
+# One upstream connection to the PGN stream of a broadcast round, shared by all
+# analyzers following games of that round.
+class PgnFeed:
+    _url: str
+    _subscribers: list[_Subscriber]
+    # The latest PGN block of every game seen, for subscribers that join late.
+    _latest: dict[tuple[Optional[str], ...], tuple[chess.pgn.Headers, str]]
+    _cancel_scope: anyio.CancelScope
+
+    def __init__(self, url: str):
+        self._url = url
+        self._subscribers = []
+        self._latest = {}
+        self._cancel_scope = anyio.CancelScope()
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
 
-    def __init__(self, queue: MemoryObjectSendStream[chess.pgn.Game]):
-        self.queue = queue
-        self.filters = []
-
-    @classmethod
-    async def run(
-        cls,
-        queue: MemoryObjectSendStream[chess.pgn.Game],
-        pgn_url: str,
-        filters: list[Tuple[str, str]],
-    ):
-        self = cls(queue)
-        self.filters = filters
-        await self._worker(pgn_url)
-
-    async def _maybe_send_game(self, buf: str) -> bool:
+    async def add_subscriber(self, subscriber: _Subscriber) -> None:
+        self._subscribers.append(subscriber)
+        for headers, buf in self._latest.values():
+            if subscriber.matches(headers):
+                self._send_game(
+                    [subscriber], headers, chess.pgn.read_game(StringIO(buf.strip()))
+                )
+
+    def remove_subscriber(self, subscriber: _Subscriber) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        subscriber.queue.close()
+        if not self._subscribers:
+            logger.info(f"Last subscriber left, closing {self._url}")
+            self._cancel_scope.cancel()
+
+    # Never waits for a subscriber, a slow one would hold up the whole round.
+    def _send_game(
+        self,
+        subscribers: list[_Subscriber],
+        headers: chess.pgn.Headers,
+        game: Optional[chess.pgn.Game],
+    ) -> None:
+        assert game is not None
+        finished = headers.get("Result") != "*"
+        for subscriber in subscribers:
+            try:
+                if subscriber.send_latest(game):
+                    logger.warning(
+                        f"Subscriber lags behind, skipped an update of "
+                        f"{headers['Event']}"
+                    )
+                if finished:
+                    # The buffered updates are still received after the close.
+                    logger.info(f"Game {headers['Event']} finished, closing queue.")
+                    self.remove_subscriber(subscriber)
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                self.remove_subscriber(subscriber)
+
+    async def _process_block(self, buf: str) -> None:
+        headers = read_block_headers(buf)
+        self._latest[tuple(headers.get(tag) for tag in GAME_KEY_TAGS)] = (headers, buf)
+        subscribers = [s for s in self._subscribers if s.matches(headers)]
+        if not subscribers:
+            return
+        # Parsed once for all the subscribers of the game.
         game = chess.pgn.read_game(StringIO(buf.strip()))
         assert game is not None
-        if all(game.headers.get(k) == v for k, v in self.filters):
-            logger.debug(
-                f"Got new PGN for {game.headers['Event']}: "
-                f"{len(list(game.mainline_moves()))} ply"
-            )
-            await self.queue.send(game)
-            if game.headers.get("Result") != "*":
-                logger.info(f"Game {game.headers['Event']} finished, closing queue.")
-                await self.queue.aclose()
-                return True
-        return False
-
-    async def _fetch_url(self, session: aiohttp.ClientSession, pgn_url: str) -> bool:
-        async with session.get(pgn_url) as response:
-            buffer = ""
+        logger.debug(
+            f"Got new PGN for {game.headers['Event']}: "
+            f"{len(list(game.mainline_moves()))} ply"
+        )
+        self._send_game(subscribers, headers, game)
+
+    async def _fetch_url(self, session: aiohttp.ClientSession) -> bool:
+        got_data = False
+        async with session.get(self._url) as response:
+            buffer = bytearray()
             async for data, _ in response.content.iter_chunks():
-                buffer += data.decode("utf-8")
-                while True:
-                    pre, set, post = buffer.partition("\n\n\n")
-                    if not set:
-                        break
-                    if await self._maybe_send_game(pre):
-                        return True
-                    buffer = post
-        return False
-
-    async def _worker(self, pgn_url: str):
-        with self.queue:
+                got_data = True
+                # The separator may straddle the previous chunk boundary.
+                start = max(len(buffer) - len(GAME_SEPARATOR) + 1, 0)
+                buffer += data
+                while (end := buffer.find(GAME_SEPARATOR, start)) != -1:
+                    block = buffer[:end].decode("utf-8")
+                    del buffer[: end + len(GAME_SEPARATOR)]
+                    start = 0
+                    await self._process_block(block)
+        return got_data
+
+    async def run(self) -> None:
+        delay = RECONNECT_MIN_DELAY_SEC
+        with self._cancel_scope:
             while True:
                 try:
                     timeout = aiohttp.ClientTimeout(total=0, sock_read=0)
                     async with aiohttp.ClientSession(timeout=timeout) as session:
-                        if await self._fetch_url(session, pgn_url):
-                            break
-                except aiohttp.client_exceptions.ClientPayloadError as e:
-                    logger.error(f"ClientPayloadError: {e}")
+                        if await self._fetch_url(session):
+                            delay = RECONNECT_MIN_DELAY_SEC
+                except aiohttp.client_exceptions.ClientError as e:
+                    logger.error(f"{type(e).__name__}: {e}")
                 logger.warning(
-                    f"Pgn connection to {pgn_url} closed unexpectedly, retrying."
+                    f"Pgn connection to {self._url} closed unexpectedly, "
+                    f"retrying in {delay}s."
                 )
-                await anyio.sleep(1)
+                await anyio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY_SEC)
+
+
+# Process-wide registry of round feeds, started on the first subscription to a
+# round and stopped when its last subscriber leaves.
+class PgnFeedHub:
+    _feeds: dict[str, PgnFeed]
+    _task_group: Optional[TaskGroup]
+
+    def __init__(self):
+        self._feeds = {}
+        self._task_group = None
+
+    async def run(self, *, task_status=anyio.TASK_STATUS_IGNORED) -> None:
+        async with anyio.create_task_group() as tg:
+            self._task_group = tg
+            task_status.started()
+            await anyio.sleep_forever()
+
+    async def _run_feed(self, round_id: str, feed: PgnFeed) -> None:
+        try:
+            await feed.run()
+        finally:
+            if self._feeds.get(round_id) is feed:
+                del self._feeds[round_id]
+
+    @contextlib.asynccontextmanager
+    async def subscribe(
+        self, round_id: str, filters: list[Tuple[str, str]]
+    ) -> AsyncIterator[MemoryObjectReceiveStream[chess.pgn.Game]]:
+        assert self._task_group is not None, "PgnFeedHub is not running"
+        send_queue, recv_queue = anyio.create_memory_object_stream[chess.pgn.Game](
+            SUBSCRIBER_BUFFER_SIZE
+        )
+        subscriber = _Subscriber(filters=filters, queue=send_queue, buffered=recv_queue)
+        feed = self._feeds.get(round_id)
+        if feed is None or not feed.has_subscribers():
+            feed = PgnFeed(ROUND_URL.format(round_id=round_id))
+            self._feeds[round_id] = feed
+            logger.info(f"Starting pgn feed for round {round_id}")
+            self._task_group.start_soon(self._run_feed, round_id, feed)
+        await feed.add_subscriber(subscriber)
+        try:
+            yield recv_queue
+        finally:
+            feed.remove_subscriber(subscriber)
@@ -0,0 +1,117 @@
+import collections
+import dataclasses
+from typing import Awaitable, Callable, Optional
+
+import anyio
+import db
+from sanic.helpers import json_dumps
+from ws_frame import EncodedFrame
+from ws_notifier import WebsocketResponse, WsPositionData, make_positions_update
+
+
+@dataclasses.dataclass
+class _GamePositions:
+    positions: list[WsPositionData]
+    # The encoded `positions` response, made on the first request after a change.
+    frame: Optional[EncodedFrame] = None
+
+    def get_frame(self) -> EncodedFrame:
+        if self.frame is None:
+            self.frame = EncodedFrame(
+                json_dumps(WebsocketResponse(positions=self.positions))
+            )
+        return self.frame
+
+
+@dataclasses.dataclass
+class PositionsCacheStats:
+    hits: int = 0
+    misses: int = 0
+    live_games: int = 0
+    cached_games: int = 0
+
+
+# The `positions` responses of whole games, ready to be sent to the clients
+# that select a game. Games being analyzed are kept up to date by their
+# analyzer, other games are loaded from the DB on demand and evicted by LRU.
+class PositionsCache:
+    _live: dict[int, _GamePositions]
+    _cached: collections.OrderedDict[int, _GamePositions]
+    _max_cached_games: int
+    _loading: dict[int, anyio.Event]
+    _stats: PositionsCacheStats
+
+    def __init__(self, max_cached_games: int = 200):
+        self._live = {}
+        self._cached = collections.OrderedDict()
+        self._max_cached_games = max_cached_games
+        self._loading = {}
+        self._stats = PositionsCacheStats()
+
+    # Called by the analyzer whenever the mainline of its game changes.
+    def set_game(self, game_id: int, positions: list[db.GamePosition]) -> None:
+        self._cached.pop(game_id, None)
+        self._live[game_id] = _GamePositions(
+            positions=make_positions_update(game_id=game_id, positions=positions)
+        )
+
+    # Called by the analyzer when the totals of a position change.
+    def update_position(self, game_id: int, pos: db.GamePosition) -> None:
+        entry = self._live.get(game_id)
+        if entry is None or pos.ply_number >= len(entry.positions):
+            return
+        entry.positions[pos.ply_number] = make_positions_update(
+            game_id=game_id, positions=[pos]
+        )[0]
+        entry.frame = None
+
+    # Called by the analyzer when it stops following the game, which from now
+    # on is evicted like any other.
+    def release_game(self, game_id: int) -> None:
+        if (entry := self._live.pop(game_id, None)) is not None:
+            self._add_cached(game_id, entry)
+
+    def _add_cached(self, game_id: int, entry: _GamePositions) -> None:
+        self._cached[game_id] = entry
+        self._cached.move_to_end(game_id)
+        if len(self._cached) > self._max_cached_games:
+            self._cached.popitem(last=False)
+
+    def _get(self, game_id: int) -> Optional[_GamePositions]:
+        if (entry := self._live.get(game_id)) is not None:
+            return entry
+        if (entry := self._cached.get(game_id)) is not None:
+            self._cached.move_to_end(game_id)
+        return entry
+
+    # Returns the cached response, or loads the positions with `load`. Clients
+    # asking for the same game while it's being loaded wait for that load.
+    async def get_frame(
+        self,
+        game_id: int,
+        load: Callable[[], Awaitable[list[WsPositionData]]],
+    ) -> EncodedFrame:
+        if (entry := self._get(game_id)) is not None:
+            self._stats.hits += 1
+            return entry.get_frame()
+        self._stats.misses += 1
+        while (loading := self._loading.get(game_id)) is not None:
+            await loading.wait()
+            if (entry := self._get(game_id)) is not None:
+                return entry.get_frame()
+        self._loading[game_id] = anyio.Event()
+        try:
+            positions = await load()
+            # The analyzer may have started following the game meanwhile, then
+            # its positions are fresher.
+            if (entry := self._get(game_id)) is None:
+                entry = _GamePositions(positions=positions)
+                self._add_cached(game_id, entry)
+            return entry.get_frame()
+        finally:
+            self._loading.pop(game_id).set()
+
+    def get_stats(self) -> PositionsCacheStats:
+        return dataclasses.replace(
+            self._stats, live_games=len(self._live), cached_games=len(self._cached)
+        )
@@ -0,0 +1,78 @@
+import collections
+from typing import Optional
+
+import chess
+
+
+class PvTrieNode:
+    __slots__ = ("san", "board", "children")
+    san: str
+    board: chess.Board
+    children: dict[str, "PvTrieNode"]
+
+    def __init__(self, san: str, board: chess.Board):
+        self.san = san
+        self.board = board
+        self.children = {}
+
+
+# Memoizes SAN conversion of PVs. Every root position has a trie of the move
+# prefixes seen so far, so when a PV only grows or changes its tail, only the new
+# moves are converted.
+class PvCache:
+    _positions: collections.OrderedDict[str, PvTrieNode]
+    _num_nodes: dict[str, int]
+    _max_positions: int
+    _max_nodes_per_position: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_positions: int = 16, max_nodes_per_position: int = 10000):
+        self._positions = collections.OrderedDict()
+        self._num_nodes = {}
+        self._max_positions = max_positions
+        self._max_nodes_per_position = max_nodes_per_position
+        self.hits = 0
+        self.misses = 0
+
+    def _get_root(self, fen: str, board: chess.Board) -> PvTrieNode:
+        root: Optional[PvTrieNode] = self._positions.get(fen)
+        if root is None or self._num_nodes[fen] > self._max_nodes_per_position:
+            root = PvTrieNode(san="", board=board.copy(stack=False))
+            self._positions[fen] = root
+            self._num_nodes[fen] = 0
+            if len(self._positions) > self._max_positions:
+                evicted, _ = self._positions.popitem(last=False)
+                del self._num_nodes[evicted]
+        else:
+            self._positions.move_to_end(fen)
+        return root
+
+    # Returns the PV as a pair of (SAN, UCI) strings.
+    def convert(self, board: chess.Board, pv: list[chess.Move]) -> tuple[str, str]:
+        return self.convert_uci(board, [move.uci() for move in pv])
+
+    def convert_uci(self, board: chess.Board, pv: list[str]) -> tuple[str, str]:
+        fen = board.fen()
+        node = self._get_root(fen, board)
+        sans: list[str] = []
+        for uci in pv:
+            child = node.children.get(uci)
+            if child is None:
+                self.misses += 1
+                child_board = node.board.copy(stack=False)
+                move = child_board.parse_uci(uci)
+                child = PvTrieNode(
+                    san=child_board.san_and_push(move), board=child_board
+                )
+                node.children[uci] = child
+                self._num_nodes[fen] += 1
+            else:
+                self.hits += 1
+            sans.append(child.san)
+            node = child
+        return " ".join(sans), " ".join(pv)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,62 @@
+import os
+import sys
+from typing import Any, AsyncIterator, cast
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from analyzer import Analyzer  # noqa: E402
+from eval_store import EvaluationStore  # noqa: E402
+from evaluations_cache import EvaluationsCache  # noqa: E402
+from games_cache import GamesListCache  # noqa: E402
+from positions_cache import PositionsCache  # noqa: E402
+from tortoise import Tortoise  # noqa: E402
+from transpositions import TranspositionTable  # noqa: E402
+from ws_notifier import WebsocketNotifier  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def database() -> AsyncIterator[None]:
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"lc0live": ["db"]})
+    await Tortoise.generate_schemas()
+    yield
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+async def game(database: None) -> db.Game:
+    tournament = await db.Tournament.create(name="Test", lichess_id="test")
+    return await db.Game.create(
+        tournament=tournament,
+        game_name="A - B",
+        lichess_round_id="round",
+        lichess_id="game",
+        round_name="Round 1",
+        player1_name="A",
+        player2_name="B",
+        status="*",
+    )
+
+
+# An analyzer without an engine, for the game bookkeeping.
+@pytest.fixture
+def analyzer(database: None) -> Analyzer:
+    table = TranspositionTable(max_size=10)
+    return Analyzer(
+        {"command": ["lc0", "--weights=t1.pb.gz", "--backend=cuda-fp16"]},
+        cast(Any, None),
+        WebsocketNotifier(),
+        EvaluationStore(60, 10**9, table),
+        table,
+        cast(Any, None),
+        PositionsCache(),
+        EvaluationsCache(),
+        GamesListCache(),
+    )
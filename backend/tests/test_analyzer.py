@@ -0,0 +1,29 @@
+import io
+
+import chess
+import chess.pgn
+import db
+import pytest
+from analyzer import Analyzer
+
+pytestmark = pytest.mark.anyio
+
+
+def read_pgn(moves: str) -> chess.pgn.Game:
+    pgn = chess.pgn.read_game(io.StringIO(f"{moves} *"))
+    assert pgn is not None
+    return pgn
+
+
+async def test_rows_after_a_gap_are_replaced(game: db.Game, analyzer: Analyzer) -> None:
+    await analyzer._load_mainline(game)
+    await analyzer._update_game_db(read_pgn("1. e4 e5 2. Nf3 Nc6"), game)
+    await db.GamePosition.filter(game=game, ply_number=2).delete()
+
+    await analyzer._load_mainline(game)
+    assert len(analyzer._mainline) == 2
+    last = await analyzer._update_game_db(read_pgn("1. e4 e5 2. Nf3 Nc6 3. Bb5"), game)
+    assert last.move_san == "Bb5"
+    plies = await db.GamePosition.filter(game=game).order_by("ply_number")
+    assert [p.ply_number for p in plies] == [0, 1, 2, 3, 4, 5]
+    assert [p.id for p in plies] == [p.id for p in analyzer._mainline]
@@ -0,0 +1,37 @@
+import pytest
+from api import etag_matches, parse_ply_range
+
+ETAG = '"0123abcd"'
+
+
+def test_etag_matches_strong_and_weak_tags():
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches(f"W/{ETAG}", ETAG)
+    assert etag_matches(f' "other" , W/{ETAG}', ETAG)
+    assert etag_matches('"a,b", ' + ETAG, ETAG)
+
+
+def test_etag_matches_wildcard():
+    assert etag_matches("*", ETAG)
+    assert etag_matches(" * ", ETAG)
+
+
+def test_etag_does_not_match():
+    assert not etag_matches("", ETAG)
+    assert not etag_matches('"other"', ETAG)
+    assert not etag_matches("0123abcd", ETAG)
+    assert not etag_matches(f'"a,{ETAG[1:]}', ETAG)
+
+
+def test_parse_ply_range():
+    assert parse_ply_range({"gameId": 1, "fromPly": 3}) == (3, None)
+    assert parse_ply_range({"gameId": 1, "toPly": 7}) == (0, 7)
+    assert parse_ply_range({"gameId": 1, "fromPly": 3, "toPly": 3}) == (3, 3)
+
+
+@pytest.mark.parametrize(
+    "from_ply,to_ply", [(-1, None), (5, 4), ("1", None), (0, 2.5), (True, None)]
+)
+def test_parse_ply_range_rejects_invalid_plies(from_ply, to_ply):
+    with pytest.raises(ValueError):
+        parse_ply_range({"gameId": 1, "fromPly": from_ply, "toPly": to_ply})
@@ -0,0 +1,67 @@
+import json
+from typing import Any, Iterator, cast
+
+import app as app_module
+import config
+import db
+import pytest
+from app import App
+from sanic import Sanic
+from ws_notifier import WebsocketSubscription
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def live_app(database: None, monkeypatch: pytest.MonkeyPatch) -> Iterator[App]:
+    monkeypatch.setattr(app_module, "_get_js_hash", lambda: "hash")
+    Sanic.test_mode = True
+    sanic_app = Sanic("lc0live_test")
+    sanic_app.config.update_config(config)
+    sanic_app.config.UCI_ANALYZERS = []
+    yield App(sanic_app)
+    Sanic._app_registry.pop("lc0live_test", None)
+
+
+def queued(sub: WebsocketSubscription) -> list[Any]:
+    return [json.loads(f.frame.text) for f in sub.queue]
+
+
+async def test_all_plies_are_sent_in_frames(live_app: App, game: db.Game) -> None:
+    live_app.config.WS_EVALS_FRAME_PLIES = 2
+    for ply in range(5):
+        pos = await db.GamePosition.create(
+            game=game,
+            ply_number=ply,
+            fen="8/8/8/8/8/8/8/8 w - - 0 1",
+            nodes=0,
+            q_score=0,
+            white_score=0,
+            draw_score=0,
+            black_score=0,
+        )
+        await db.GamePositionEvaluation.create(
+            position=pos, nodes=ply, time=0, depth=0, seldepth=0
+        )
+    notifier = live_app.get_ws_notifier()
+    ws = cast(Any, object())
+    sub = notifier._subscriptions[ws] = WebsocketSubscription(ws=ws)
+
+    await live_app.dump_evals(ws, game.id, 0)
+    frames = queued(sub)
+    assert [[e["ply"] for e in f["evaluations"]] for f in frames] == [
+        [0, 1],
+        [2, 3],
+        [4],
+    ]
+    sub.queue.clear()
+    await live_app.dump_evals(ws, game.id, 1, 2)
+    assert [[e["ply"] for e in f["evaluations"]] for f in queued(sub)] == [[1, 2]]
+
+
+async def test_handshake(live_app: App, game: db.Game) -> None:
+    handshake = json.loads((await live_app.get_handshake(with_games=True)).text)
+    assert handshake["status"]["jsHash"] == "hash"
+    assert [g["gameId"] for g in handshake["games"]] == [game.id]
+    handshake = json.loads((await live_app.get_handshake(with_games=False)).text)
+    assert "games" not in handshake
@@ -0,0 +1,32 @@
+import dataclasses
+import random
+
+import chess.engine
+from analyzer import get_totals
+from bundle_columns import BundleColumns
+
+
+def make_info(rng: random.Random, multipv: int) -> chess.engine.InfoDict:
+    info: chess.engine.InfoDict = {
+        "multipv": multipv,
+        "nodes": rng.randint(0, 10_000_000),
+        "wdl": chess.engine.PovWdl(
+            chess.engine.Wdl(*rng.choice([(300, 500, 200), (0, 1000, 0)])),
+            chess.BLACK,
+        ),
+    }
+    if rng.random() < 0.05:
+        score: chess.engine.Score = chess.engine.Mate(rng.randint(-20, 20))
+    else:
+        score = chess.engine.Cp(rng.randint(-1000, 1000))
+    info["score"] = chess.engine.PovScore(score, chess.BLACK)
+    return info
+
+
+def test_totals_match_get_totals() -> None:
+    rng = random.Random(42)
+    for size in [2, 231] + [rng.randint(2, 231) for _ in range(300)]:
+        bundle = [make_info(rng, i) for i in range(1, size)]
+        expected = dataclasses.astuple(get_totals(bundle))
+        actual = dataclasses.astuple(BundleColumns.from_info_bundle(bundle).totals())
+        assert actual == expected
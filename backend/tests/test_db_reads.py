@@ -0,0 +1,147 @@
+import chess
+import db
+import pytest
+from db_reads import (
+    fetch_games_data,
+    fetch_latest_evaluation,
+    fetch_latest_evaluations,
+    fetch_position_id,
+    fetch_positions,
+)
+from sanic.helpers import json_dumps
+from tortoise.expressions import Q
+from ws_notifier import (
+    WsEvaluationData,
+    make_evaluations_update,
+    make_games_data,
+    make_positions_update,
+)
+
+pytestmark = pytest.mark.anyio
+
+NUM_PLIES = 40
+NUM_VARIATIONS = 5
+
+
+@pytest.fixture
+async def game_id(database: None) -> int:
+    tournament = await db.Tournament.create(name="Test", lichess_id="test")
+    game = await db.Game.create(
+        tournament=tournament,
+        game_name="A - B",
+        lichess_round_id="round",
+        lichess_id="game",
+        round_name="Round 1",
+        player1_name="A",
+        player1_rating=2700,
+        player2_name="B",
+        player2_fide_id=1503014,
+        player2_fed="NOR",
+        status="*",
+    )
+    board = chess.Board()
+    for ply in range(NUM_PLIES):
+        move = next(iter(board.legal_moves)) if ply else None
+        san = board.san(move) if move else None
+        if move:
+            board.push(move)
+        pos = await db.GamePosition.create(
+            game=game,
+            ply_number=ply,
+            fen=board.fen(),
+            move_uci=move.uci() if move else None,
+            move_san=san,
+            white_clock=ply * 1000 if ply % 2 else None,
+            nodes=ply * 100,
+            q_score=ply - 20,
+            white_score=300,
+            draw_score=500,
+            black_score=200,
+            moves_left=50,
+        )
+        if ply % 10 == 9:
+            continue  # Some positions are not evaluated.
+        for i in range(2):
+            evaluation = await db.GamePositionEvaluation.create(
+                position=pos,
+                nodes=1000 * (i + 1),
+                time=100 * ply,
+                depth=10 + i,
+                seldepth=20 + i,
+                moves_left=None if i else 40,
+            )
+            await db.GamePositionEvaluationMove.bulk_create(
+                [
+                    db.GamePositionEvaluationMove(
+                        evaluation=evaluation,
+                        nodes=1000 - v * 7,
+                        q_score=v,
+                        pv_san="Nf3 Nf6 c4 g6 Nc3 Bg7",
+                        pv_uci=f"g1f3 g8f6 c2c4 g7g6 {v}",
+                        mate_score=v if v % 5 == 0 else None,
+                        white_score=300,
+                        draw_score=500,
+                        black_score=200,
+                    )
+                    for v in range(NUM_VARIATIONS)
+                ]
+            )
+    return game.id
+
+
+# The reads as they are done with the hydrated models.
+async def orm_evaluation(game_id: int, ply: int) -> list[WsEvaluationData]:
+    pos = await db.GamePosition.get(game=game_id, ply_number=ply)
+    evaluations = await db.GamePositionEvaluation.filter(position=pos).order_by("-id")
+    moves = [
+        await db.GamePositionEvaluationMove.filter(evaluation=e).order_by("-nodes")
+        for e in evaluations[:1]
+    ]
+    return make_evaluations_update(
+        game_id=game_id, ply=ply, evaluations=evaluations[:1], moves=moves
+    )
+
+
+async def test_games_match_the_models(game_id: int) -> None:
+    games = (
+        await db.Game.filter(
+            Q(tournament__is_hidden=False) | Q(is_finished=False),
+            is_hidden=False,
+        )
+        .order_by("id")
+        .prefetch_related("tournament")
+    )
+    expected = make_games_data(games=games, analyzed_games={game_id})
+    assert json_dumps(await fetch_games_data({game_id})) == json_dumps(expected)
+
+
+async def test_positions_match_the_models(game_id: int) -> None:
+    positions = await db.GamePosition.filter(game=game_id).order_by("ply_number")
+    expected = make_positions_update(game_id=game_id, positions=positions)
+    fetched = [pos for _, pos in await fetch_positions(game_id)]
+    assert json_dumps(fetched) == json_dumps(expected)
+
+
+async def test_evaluations_match_the_models(game_id: int) -> None:
+    plies: dict[int, int] = {}
+    expected: list[WsEvaluationData] = []
+    for ply in range(NUM_PLIES):
+        position_id = await fetch_position_id(game_id, ply)
+        assert position_id is not None
+        plies[position_id] = ply
+        orm = await orm_evaluation(game_id, ply)
+        fetched = await fetch_latest_evaluation(game_id, ply, position_id)
+        assert json_dumps(fetched) == json_dumps(orm), ply
+        expected += orm
+    loaded = await fetch_latest_evaluations(game_id, plies, 0, None)
+    assert json_dumps([loaded[ply] for ply in sorted(loaded)]) == json_dumps(expected)
+
+
+async def test_latest_evaluations_of_a_ply_range(game_id: int) -> None:
+    plies = dict(
+        await db.GamePosition.filter(game=game_id).values_list("id", "ply_number")
+    )
+    loaded = await fetch_latest_evaluations(game_id, plies, 5, 12)
+    assert sorted(loaded) == [5, 6, 7, 8, 10, 11, 12]
+    assert all(e.get("nodes") == 2000 for e in loaded.values())
+    assert await fetch_position_id(game_id, NUM_PLIES) is None
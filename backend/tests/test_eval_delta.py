@@ -0,0 +1,214 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+from typing import Any, cast
+
+import chess
+import chess.engine
+import db
+import pytest
+from analyzer import Analyzer
+from eval_delta import apply_evaluation_delta, make_evaluation_delta
+from sanic.helpers import json_dumps
+from ws_notifier import WebsocketResponse, WsEvaluationData
+
+pytestmark = pytest.mark.anyio
+
+FRONTEND_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "frontend")
+
+BOARD = chess.Board(
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+)
+
+
+# Simulates the analysis of one position: nodes grow, scores drift, and PVs
+# mostly keep their beginning and change their tail.
+class Analysis:
+    def __init__(self, rng: random.Random, num_variations: int):
+        self.rng = rng
+        self.pvs = [
+            self.extend_pv([m], 15) for m in list(BOARD.legal_moves)[:num_variations]
+        ]
+        self.nodes = [rng.randint(1, 1000) for _ in self.pvs]
+        self.scores = [rng.randint(-100, 100) for _ in self.pvs]
+
+    def extend_pv(self, moves: list[chess.Move], length: int) -> list[chess.Move]:
+        board = BOARD.copy()
+        for move in moves:
+            board.push(move)
+        moves = list(moves)
+        while len(moves) < length and not board.is_game_over():
+            moves.append(self.rng.choice(list(board.legal_moves)))
+            board.push(moves[-1])
+        return moves
+
+    def step(self) -> None:
+        for idx in range(len(self.pvs)):
+            if self.rng.random() < 0.5:
+                self.nodes[idx] += self.rng.randint(0, 5000)
+                self.scores[idx] += self.rng.randint(-3, 3)
+            if self.rng.random() < 0.05:
+                keep = self.rng.randint(1, 14)
+                self.pvs[idx] = self.extend_pv(self.pvs[idx][:keep], 15)
+
+    # The multipv infos of the engine, best first.
+    def info_bundle(self, rev: int) -> list[chess.engine.InfoDict]:
+        infos = sorted(zip(self.pvs, self.nodes, self.scores), key=lambda i: -i[1])
+        return [
+            {
+                "multipv": idx + 1,
+                "nodes": nodes,
+                "pv": pv,
+                "score": chess.engine.PovScore(chess.engine.Cp(q), chess.WHITE),
+                "wdl": chess.engine.PovWdl(
+                    chess.engine.Wdl(300, 500, 200), chess.WHITE
+                ),
+                "time": rev * 0.25,
+                "depth": 10 + rev // 10,
+                "seldepth": 30 + rev // 5,
+            }
+            for idx, (pv, nodes, q) in enumerate(infos)
+        ]
+
+    def evaluation(self, rev: int) -> WsEvaluationData:
+        variations: list[dict[str, Any]] = []
+        for pv, nodes, q in zip(self.pvs, self.nodes, self.scores):
+            board = BOARD.copy()
+            san = []
+            for move in pv:
+                san.append(board.san(move))
+                board.push(move)
+            variations.append(
+                {
+                    "nodes": nodes,
+                    "pvSan": " ".join(san),
+                    "pvUci": " ".join(m.uci() for m in pv),
+                    "scoreQ": q,
+                    "scoreW": 300,
+                    "scoreD": 500,
+                    "scoreB": 200,
+                    "mateScore": None,
+                }
+            )
+        variations.sort(key=lambda v: -v["nodes"])
+        return cast(
+            WsEvaluationData,
+            {
+                "gameId": 1,
+                "ply": 7,
+                "evalId": None,
+                "nodes": sum(self.nodes),
+                "time": rev * 250,
+                "depth": 10 + rev // 10,
+                "seldepth": 30 + rev // 5,
+                "movesLeft": 60,
+                "variations": variations,
+                "rev": rev,
+            },
+        )
+
+
+# The evaluations of 200 updates of one position, as the analyzer broadcasts
+# them.
+async def analyzed_evaluations(
+    analyzer: Analyzer, game: db.Game
+) -> list[WsEvaluationData]:
+    analyzer._config["show_pv"] = 20
+    analyzer._game = game
+    pos = await db.GamePosition.create(
+        game=game,
+        ply_number=7,
+        fen=BOARD.fen(),
+        nodes=0,
+        q_score=0,
+        white_score=0,
+        draw_score=0,
+        black_score=0,
+    )
+    analysis = Analysis(random.Random(42), num_variations=20)
+    res: list[WsEvaluationData] = []
+    for rev in range(1, 201):
+        analysis.step()
+        prepared = analyzer._prepare_info_bundle(analysis.info_bundle(rev), BOARD, pos)
+        evaluation = prepared.evaluations[0]
+        evaluation["rev"] = rev
+        res.append(evaluation)
+    return res
+
+
+async def test_round_trip_saves_bytes(game: db.Game, analyzer: Analyzer) -> None:
+    evaluations = await analyzed_evaluations(analyzer, game)
+    full_bytes = delta_bytes = 0
+    for prev, cur in zip(evaluations, evaluations[1:]):
+        delta = make_evaluation_delta(prev, cur)
+        assert delta["baseRev"] == prev.get("rev") and delta["rev"] == cur.get("rev")
+        assert apply_evaluation_delta(prev, delta) == cur
+        full_bytes += len(json_dumps(WebsocketResponse(evaluations=[cur])))
+        delta_bytes += len(json_dumps(WebsocketResponse(evaluationDeltas=[delta])))
+    print(
+        f"Full frames {full_bytes} bytes, delta frames {delta_bytes} bytes "
+        f"({1 - delta_bytes / full_bytes:.0%} saved)"
+    )
+    assert delta_bytes < full_bytes / 2
+
+
+def test_variations_added_and_removed() -> None:
+    analysis = Analysis(random.Random(1), num_variations=10)
+    prev = analysis.evaluation(1)
+    cur = analysis.evaluation(2)
+    cur["variations"] = cur["variations"][3:] + [{"pvUci": "a2a3", "nodes": 1}]
+    assert apply_evaluation_delta(prev, make_evaluation_delta(prev, cur)) == cur
+    cur2 = analysis.evaluation(3)
+    cur2["variations"] = cur2["variations"][:2]
+    assert apply_evaluation_delta(cur, make_evaluation_delta(cur, cur2)) == cur2
+
+
+# Runs applyEvaluationDelta() of the frontend on (prev, delta) pairs.
+def apply_in_frontend(tmp_path: Any, cases: list[tuple[Any, Any]]) -> list[Any]:
+    bundle = tmp_path / "eval_delta.js"
+    subprocess.run(
+        [
+            "esbuild",
+            os.path.join(FRONTEND_DIR, "eval_delta.ts"),
+            "--bundle",
+            "--platform=node",
+            "--format=cjs",
+            f"--outfile={bundle}",
+        ],
+        check=True,
+    )
+    script = (
+        f"const {{applyEvaluationDelta}} = require({json.dumps(str(bundle))});"
+        "const cases = JSON.parse(require('fs').readFileSync(0, 'utf8'));"
+        "const res = cases.map(([p, d]) => applyEvaluationDelta(p, d));"
+        "console.log(JSON.stringify(res));"
+    )
+    res = subprocess.run(
+        ["node", "-e", script],
+        input=json_dumps(cases),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(res.stdout)
+
+
+@pytest.mark.skipif(
+    shutil.which("esbuild") is None or shutil.which("node") is None,
+    reason="needs esbuild and node",
+)
+async def test_frontend_applies_deltas_the_same(
+    game: db.Game, analyzer: Analyzer, tmp_path: Any
+) -> None:
+    evaluations = await analyzed_evaluations(analyzer, game)
+    pairs = list(zip(evaluations, evaluations[1:]))
+    analysis = Analysis(random.Random(1), num_variations=10)
+    cur = analysis.evaluation(2)
+    cur["variations"] = cur["variations"][3:] + [{"pvUci": "a2a3", "nodes": 1}]
+    pairs.append((analysis.evaluation(1), cur))
+    pairs.append((cur, {**cur, "rev": 3, "variations": cur["variations"][:2]}))
+    cases = [(prev, make_evaluation_delta(prev, cur)) for prev, cur in pairs]
+    expected = [apply_evaluation_delta(prev, delta) for prev, delta in cases]
+    assert apply_in_frontend(tmp_path, cases) == json.loads(json_dumps(expected))
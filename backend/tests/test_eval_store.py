@@ -0,0 +1,113 @@
+import chess
+import db
+import pytest
+from eval_store import MAX_FLUSH_ATTEMPTS, EvaluationStore, PendingEvaluation
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+pytestmark = pytest.mark.anyio
+
+
+async def make_position(game: db.Game, ply: int) -> db.GamePosition:
+    return await db.GamePosition.create(
+        game=game,
+        ply_number=ply,
+        fen=chess.STARTING_FEN,
+        nodes=0,
+        q_score=0,
+        white_score=0,
+        draw_score=1000,
+        black_score=0,
+    )
+
+
+def put(store: EvaluationStore, pos: db.GamePosition, nodes: int) -> None:
+    evaluation = db.GamePositionEvaluation(
+        position=pos, nodes=nodes, time=1, depth=1, seldepth=1
+    )
+    move = db.GamePositionEvaluationMove(
+        nodes=nodes,
+        q_score=0,
+        pv_san="e4",
+        pv_uci="e2e4",
+        white_score=0,
+        draw_score=1000,
+        black_score=0,
+    )
+    pos.nodes = nodes
+    store.put(pos, evaluation, [move])
+
+
+async def test_flush_writes_evaluations(game: db.Game) -> None:
+    store = EvaluationStore(flush_interval_sec=60, flush_nodes_step=10**9)
+    pos = await make_position(game, 0)
+    put(store, pos, 100)
+    await store.flush()
+    assert store.get_pending(pos.id) is None
+    assert await db.GamePositionEvaluation.filter(position=pos).count() == 1
+    assert await db.GamePositionEvaluationMove.all().count() == 1
+    assert (await db.GamePosition.get(id=pos.id)).nodes == 100
+
+
+async def test_failed_write_keeps_the_others(game: db.Game) -> None:
+    store = EvaluationStore(flush_interval_sec=60, flush_nodes_step=10**9)
+    good = await make_position(game, 0)
+    bad = await make_position(game, 1)
+    put(store, good, 100)
+    put(store, bad, 200)
+    await db.GamePosition.filter(id=bad.id).delete()
+
+    await store.flush()
+    assert await db.GamePositionEvaluation.filter(position=good).count() == 1
+    assert await db.GamePositionEvaluationMove.all().count() == 1
+    # The failed one is queued again, and given up on eventually.
+    pending = store.get_pending(bad.id)
+    assert pending is not None and pending.attempts == 1
+    for _ in range(MAX_FLUSH_ATTEMPTS):
+        await store.flush()
+    assert store.get_pending(bad.id) is None
+    assert await db.GamePositionEvaluation.all().count() == 1
+
+
+async def test_failed_write_is_retried(game: db.Game) -> None:
+    store = EvaluationStore(flush_interval_sec=60, flush_nodes_step=10**9)
+    pos = await make_position(game, 0)
+    put(store, pos, 100)
+    pending = store.get_pending(pos.id)
+    assert pending is not None
+    # Breaks only the first attempt.
+    pending.evaluation.depth = None  # type: ignore
+    await store.flush()
+    retried = store.get_pending(pos.id)
+    assert retried is not None and retried.attempts == 1
+    retried.evaluation.depth = 1
+    await store.flush()
+    assert store.get_pending(pos.id) is None
+    assert await db.GamePositionEvaluation.filter(position=pos).count() == 1
+    assert await db.GamePositionEvaluationMove.all().count() == 1
+
+
+async def test_discarded_evaluations_are_not_requeued(
+    game: db.Game, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = EvaluationStore(flush_interval_sec=60, flush_nodes_step=10**9)
+    pos = await make_position(game, 0)
+    put(store, pos, 100)
+    # The write fails, and the position is discarded while it's being written.
+    await db.GamePosition.filter(id=pos.id).delete()
+    write = store._write
+
+    async def discarding_write(
+        entry: PendingEvaluation, conn: BaseDBAsyncClient
+    ) -> None:
+        store.discard([pos.id])
+        await write(entry, conn)
+
+    monkeypatch.setattr(store, "_write", discarding_write)
+    await store.flush()
+    assert store.get_pending(pos.id) is None
+
+    monkeypatch.setattr(store, "_write", write)
+    await store.flush()
+    assert store.get_pending(pos.id) is None
+    assert await db.GamePositionEvaluation.all().count() == 0
+    assert await db.GamePositionEvaluationMove.all().count() == 0
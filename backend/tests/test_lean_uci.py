@@ -0,0 +1,119 @@
+import os
+import random
+import sys
+from typing import Any, Callable, cast
+
+import chess
+import chess.engine
+import pytest
+from lean_uci import (
+    LeanUciProtocol,
+    _is_patchable_analysis,
+    get_lean_pv,
+    parse_lean_info,
+)
+
+BOARD = chess.Board(
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+)
+
+
+def make_line(rng: random.Random, multipv: int, first_move: chess.Move) -> str:
+    board = BOARD.copy()
+    board.push(first_move)
+    pv = [first_move]
+    while len(pv) < 20 and not board.is_game_over():
+        pv.append(rng.choice(list(board.legal_moves)))
+        board.push(pv[-1])
+    return (
+        f"depth 12 seldepth 30 time 12345 nodes {rng.randint(0, 10**6)} "
+        f"score cp {rng.randint(-300, 300)} wdl 300 500 200 movesleft 40 "
+        f"hashfull 10 nps 5000 tbhits 0 multipv {multipv} "
+        f"pv {' '.join(m.uci() for m in pv)}"
+    )
+
+
+def test_same_as_python_chess() -> None:
+    rng = random.Random(42)
+    for multipv, move in enumerate(BOARD.legal_moves, start=1):
+        line = make_line(rng, multipv, move)
+        full = chess.engine._parse_uci_info(line, BOARD)
+        lean = parse_lean_info(line, BOARD)
+        assert get_lean_pv(lean) == " ".join(m.uci() for m in full.pop("pv", []))
+        assert "pv" not in lean
+        # Not parsed by python-chess.
+        assert cast(dict, lean).pop("movesleft") == 40
+        assert dict(lean) == dict(full)
+
+
+def test_score_bounds_and_string() -> None:
+    info = parse_lean_info(
+        "depth 3 score mate -2 upperbound string a b c", chess.Board()
+    )
+    assert info.get("score") == chess.engine.PovScore(
+        chess.engine.Mate(-2), chess.WHITE
+    )
+    assert info.get("upperbound")
+    assert info.get("string") == "a b c"
+    assert get_lean_pv(info) is None
+
+
+def test_get_lean_pv_of_other_infos() -> None:
+    assert get_lean_pv({"pv": [chess.Move.from_uci("e2e4")]}) is None
+
+
+async def capture_analysis_command(monkeypatch: pytest.MonkeyPatch) -> Any:
+    captured: list[Any] = []
+
+    async def communicate(
+        self: chess.engine.UciProtocol, factory: Callable[[Any], Any]
+    ) -> Any:
+        captured.append(factory(self))
+        raise chess.engine.EngineError("not running")
+
+    monkeypatch.setattr(chess.engine.Protocol, "communicate", communicate)
+    protocol = LeanUciProtocol()
+    with pytest.raises(chess.engine.EngineError):
+        await protocol.analysis(chess.Board())
+    return captured[0]
+
+
+@pytest.mark.anyio
+async def test_patches_the_python_chess_command(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    command = await capture_analysis_command(monkeypatch)
+    assert type(command).__name__ == "UciAnalysisCommand"
+    assert "_info" in vars(command)
+
+
+def test_unexpected_commands_are_not_patched() -> None:
+    class UciAnalysisCommand:
+        def _info(self, arg: str, board: chess.Board) -> None:
+            pass
+
+    assert not _is_patchable_analysis(UciAnalysisCommand())
+    assert not _is_patchable_analysis(object())
+
+
+# Fails when a python-chess upgrade changes the internals the protocol patches:
+# the infos of a real analysis would then come from the stock parser.
+@pytest.mark.anyio
+async def test_analysis_uses_the_lean_parser() -> None:
+    engine_path = os.path.join(os.path.dirname(__file__), "uci_stub_engine.py")
+    _, engine = await LeanUciProtocol.popen([sys.executable, engine_path])
+    infos: list[chess.engine.InfoDict] = []
+    try:
+        await engine.initialize()
+        # As the analyzer reads them. analysis.multipv copies the infos into
+        # plain dicts.
+        with await engine.analysis(
+            chess.Board(), chess.engine.Limit(nodes=100), multipv=2
+        ) as analysis:
+            async for info in analysis:
+                infos.append(info)
+    finally:
+        await engine.quit()
+    assert [get_lean_pv(info) for info in infos] == ["g1h3", "g1f3"]
+    assert all("pv" not in info for info in infos)
+    assert not LeanUciProtocol._warned_unpatchable
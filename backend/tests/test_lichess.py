@@ -0,0 +1,104 @@
+import time
+from typing import AsyncIterator
+
+import anyio
+import lichess
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from lichess import LichessClient
+
+pytestmark = pytest.mark.anyio
+
+PGN = '[White "A"]\n[Black "B"]\n\n1. e4 e5 *\n'
+
+
+# A local stand-in for the Lichess API, recording the requests it gets.
+class StubLichess:
+    requests: list[web.Request]
+    delay_sec: float
+
+    def __init__(self) -> None:
+        self.requests = []
+        self.delay_sec = 0.0
+
+    async def tournament(self, req: web.Request) -> web.Response:
+        self.requests.append(req)
+        await anyio.sleep(self.delay_sec)
+        etag = '"v1"'
+        last_modified = "Wed, 21 Oct 2026 07:28:00 GMT"
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if req.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.json_response({"id": req.match_info["id"]}, headers=headers)
+
+    async def round_pgns(self, req: web.Request) -> web.Response:
+        self.requests.append(req)
+        return web.Response(text=PGN)
+
+
+@pytest.fixture
+async def stub() -> AsyncIterator[tuple[StubLichess, LichessClient]]:
+    stub = StubLichess()
+    app = web.Application()
+    app.router.add_get("/api/broadcast/{id}", stub.tournament)
+    app.router.add_get("/api/broadcast/round/{id}.pgn", stub.round_pgns)
+    server = TestServer(app)
+    await server.start_server()
+    client = LichessClient(
+        base_url=str(server.make_url("/")), requests_per_sec=20.0, burst=1
+    )
+    yield stub, client
+    await client.close()
+    await server.close()
+
+
+async def test_requests_are_paced(stub: tuple[StubLichess, LichessClient]) -> None:
+    server, client = stub
+    start = time.monotonic()
+    for _ in range(5):
+        games = await client.fetch_round_pgns("r1")
+        assert games[0].headers["White"] == "A"
+    # One request right away, then one every 1/20 s.
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+    assert len(server.requests) == 5
+
+
+async def test_revalidates_after_the_ttl(
+    stub: tuple[StubLichess, LichessClient], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    server, client = stub
+    monkeypatch.setitem(lichess.ENDPOINT_TTLS_SEC, "tournament", 0.1)
+    assert await client.get_tournament("t1") == {"id": "t1"}
+    # Within the TTL: from the cache.
+    assert await client.get_tournament("t1") == {"id": "t1"}
+    assert len(server.requests) == 1
+
+    await anyio.sleep(0.15)
+    # Expired: revalidated, the 304 serves the cached body.
+    assert await client.get_tournament("t1") == {"id": "t1"}
+    assert len(server.requests) == 2
+    headers = server.requests[1].headers
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == "Wed, 21 Oct 2026 07:28:00 GMT"
+    # The 304 restarts the TTL.
+    assert await client.get_tournament("t1") == {"id": "t1"}
+    assert len(server.requests) == 2
+
+
+async def test_concurrent_requests_are_coalesced(
+    stub: tuple[StubLichess, LichessClient],
+) -> None:
+    server, client = stub
+    server.delay_sec = 0.1
+    results: list[dict] = []
+
+    async def get(tournament_id: str) -> None:
+        results.append(await client.get_tournament(tournament_id))
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(5):
+            tg.start_soon(get, "t1")
+        tg.start_soon(get, "t2")
+    assert sorted(r["id"] for r in results) == ["t1"] * 5 + ["t2"]
+    assert sorted(r.match_info["id"] for r in server.requests) == ["t1", "t2"]
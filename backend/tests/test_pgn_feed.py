@@ -0,0 +1,55 @@
+import anyio
+import chess.pgn
+import pytest
+from pgn_feed import PgnFeed, _Subscriber
+
+pytestmark = pytest.mark.anyio
+
+
+def make_block(moves: str, result: str = "*") -> str:
+    return f'[Event "Test"]\n[White "A"]\n[Black "B"]\n[Result "{result}"]\n\n{moves} {result}'
+
+
+async def test_lagging_subscriber_gets_the_latest_games() -> None:
+    send, recv = anyio.create_memory_object_stream[chess.pgn.Game](2)
+    subscriber = _Subscriber(filters=[("White", "A")], queue=send, buffered=recv)
+    feed = PgnFeed("http://localhost/")
+    await feed.add_subscriber(subscriber)
+    for moves in ["1. e4", "1. e4 e5", "1. e4 e5 2. Nf3"]:
+        await feed._process_block(make_block(moves))
+    received = [recv.receive_nowait() for _ in range(2)]
+    assert [len(list(g.mainline_moves())) for g in received] == [2, 3]
+    with pytest.raises(anyio.WouldBlock):
+        recv.receive_nowait()
+
+
+async def test_late_subscriber_gets_the_latest_block() -> None:
+    feed = PgnFeed("http://localhost/")
+    await feed._process_block(make_block("1. d4"))
+    send, recv = anyio.create_memory_object_stream[chess.pgn.Game](2)
+    await feed.add_subscriber(
+        _Subscriber(filters=[("Black", "B")], queue=send, buffered=recv)
+    )
+    game = recv.receive_nowait()
+    assert game.headers["White"] == "A"
+    assert [m.uci() for m in game.mainline_moves()] == ["d2d4"]
+
+
+async def test_finished_game_does_not_wait_for_a_full_subscriber() -> None:
+    feed = PgnFeed("http://localhost/")
+    slow_send, slow_recv = anyio.create_memory_object_stream[chess.pgn.Game](1)
+    fast_send, fast_recv = anyio.create_memory_object_stream[chess.pgn.Game](1)
+    slow = _Subscriber(filters=[("White", "A")], queue=slow_send, buffered=slow_recv)
+    fast = _Subscriber(filters=[("White", "A")], queue=fast_send, buffered=fast_recv)
+    await feed.add_subscriber(slow)
+    await feed.add_subscriber(fast)
+    await feed._process_block(make_block("1. e4"))
+    fast_recv.receive_nowait()
+    with anyio.fail_after(1):
+        await feed._process_block(make_block("1. e4 e5", result="1-0"))
+    for recv in (slow_recv, fast_recv):
+        game = recv.receive_nowait()
+        assert game.headers["Result"] == "1-0"
+        with pytest.raises(anyio.EndOfStream):
+            recv.receive_nowait()
+    assert not feed.has_subscribers()
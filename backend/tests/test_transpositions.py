@@ -0,0 +1,132 @@
+import io
+
+import chess
+import chess.pgn
+import db
+import pytest
+from analyzer import Analyzer
+from eval_store import EvaluationStore
+from transpositions import TranspositionTable, search_options, transposition_key
+
+pytestmark = pytest.mark.anyio
+
+OPTIONS = {"WDLCalibrationElo": "2700", "ContemptMode": "white_side_analysis"}
+
+
+def test_key_depends_on_options() -> None:
+    fen = chess.STARTING_FEN
+    assert transposition_key(fen, {}) == transposition_key(fen, {})
+    assert transposition_key(fen, OPTIONS) == transposition_key(fen, dict(OPTIONS))
+    assert transposition_key(fen, OPTIONS) != transposition_key(fen, {})
+    assert transposition_key(fen, OPTIONS) != transposition_key(
+        fen, {**OPTIONS, "WDLCalibrationElo": "2600"}
+    )
+    assert -(1 << 63) <= transposition_key(fen, OPTIONS) < (1 << 63)
+
+
+async def put(
+    store: EvaluationStore, game: db.Game, ply: int, nodes: int, key: int
+) -> None:
+    pos = await db.GamePosition.create(
+        game=game,
+        ply_number=ply,
+        fen=chess.STARTING_FEN,
+        nodes=nodes,
+        q_score=0,
+        white_score=0,
+        draw_score=1000,
+        black_score=0,
+    )
+    evaluation = db.GamePositionEvaluation(
+        position=pos, nodes=nodes, time=1, depth=1, seldepth=1
+    )
+    move = db.GamePositionEvaluationMove(
+        nodes=nodes,
+        q_score=0,
+        pv_san="e4",
+        pv_uci="e2e4",
+        white_score=0,
+        draw_score=1000,
+        black_score=0,
+    )
+    store.put(pos, evaluation, [move], key)
+
+
+async def test_keeps_the_deepest_evaluation(game: db.Game) -> None:
+    table = TranspositionTable(max_size=10)
+    store = EvaluationStore(60, 10**9, table)
+    key = transposition_key(chess.STARTING_FEN, OPTIONS)
+    other_key = transposition_key(chess.STARTING_FEN, {})
+    await put(store, game, 0, 100, key)
+    await store.flush()
+    await put(store, game, 1, 50, key)
+    await put(store, game, 2, 200, other_key)
+    await store.flush()
+
+    # Also from the DB, without the in-memory entries.
+    for table in [table, TranspositionTable(max_size=10)]:
+        known = await table.lookup([key, other_key])
+        assert known[key].nodes == 100
+        assert known[other_key].nodes == 200
+        assert known[key].moves[0]["pv_uci"] == "e2e4"
+    assert await db.PositionIndex.all().count() == 2
+
+
+async def test_existing_entry_does_not_fail_the_flush(game: db.Game) -> None:
+    key = transposition_key(chess.STARTING_FEN, OPTIONS)
+    store = EvaluationStore(60, 10**9, TranspositionTable(max_size=10))
+    await put(store, game, 0, 100, key)
+    await store.flush()
+    # Another process has recorded a deeper evaluation meanwhile.
+    await db.PositionIndex.filter(zobrist=key).update(nodes=1000)
+    store = EvaluationStore(60, 10**9, TranspositionTable(max_size=10))
+    await put(store, game, 1, 500, key)
+    await store.flush()
+    assert await db.GamePositionEvaluation.all().count() == 2
+    assert (await db.PositionIndex.get(zobrist=key)).nodes == 1000
+
+
+def test_search_options_of_the_command_line() -> None:
+    command = ["lc0", "--weights=t1.pb.gz", "-b", "cuda-fp16", "--threads=3"]
+    assert search_options(command) == {"--weights": "t1.pb.gz", "-b": "cuda-fp16"}
+
+
+async def test_games_with_different_ratings_share_transpositions(
+    game: db.Game, analyzer: Analyzer
+) -> None:
+    store = analyzer._eval_store
+    pgn = chess.pgn.read_game(io.StringIO("1. e4 e5 2. Nf3 *"))
+    assert pgn is not None
+    game.player1_rating, game.player2_rating = 2700, 2500
+    await game.save()
+    await analyzer._load_mainline(game)
+    await analyzer._update_game_db(pgn, game)
+    pos = analyzer._mainline[2]
+    pos.nodes = 5000
+    evaluation = db.GamePositionEvaluation(
+        position=pos, nodes=5000, time=1, depth=1, seldepth=1
+    )
+    store.put(pos, evaluation, [], analyzer._transposition_key(pos))
+    await store.flush()
+
+    other = await db.Game.create(
+        tournament=await game.tournament,
+        game_name="C - D",
+        lichess_round_id="round",
+        lichess_id="other",
+        round_name="Round 1",
+        player1_name="C",
+        player1_rating=2400,
+        player2_name="D",
+        player2_rating=2600,
+        status="*",
+    )
+    # The WDL calibration differs, the search doesn't.
+    assert analyzer.uci_options(game, pos) != analyzer.uci_options(other, pos)
+    await analyzer._load_mainline(other)
+    await analyzer._update_game_db(pgn, other)
+    seeded = store.get_pending(analyzer._mainline[2].id)
+    assert seeded is not None
+    assert seeded.evaluation.nodes == 5000
+    assert analyzer._mainline[2].nodes == 5000
+    assert store.get_pending(analyzer._mainline[1].id) is None
@@ -0,0 +1,27 @@
+import pytest
+from ws_frame import EncodedFrame, send_frame
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebsocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def send(self, data: str) -> None:
+        self.sent.append(data)
+
+
+def test_etag_is_strong_and_stable():
+    frame = EncodedFrame('{"a":1}')
+    assert frame.etag.startswith('"') and frame.etag.endswith('"')
+    assert frame.etag == EncodedFrame('{"a":1}').etag
+    assert frame.etag != EncodedFrame('{"a":2}').etag
+
+
+async def test_send_frame_sends_text():
+    ws = FakeWebsocket()
+    frame = EncodedFrame('{"a":1}')
+    await send_frame(ws, frame)  # type: ignore[arg-type]
+    await send_frame(ws, frame)  # type: ignore[arg-type]
+    assert ws.sent == ['{"a":1}', '{"a":1}']
@@ -0,0 +1,132 @@
+from typing import Any, cast
+
+import anyio
+import pytest
+from ws_frame import EncodedFrame
+from ws_notifier import WebsocketNotifier, WebsocketSubscription
+
+pytestmark = pytest.mark.anyio
+
+
+def make_sub() -> WebsocketSubscription:
+    return WebsocketSubscription(ws=cast(Any, object()))
+
+
+def texts(sub: WebsocketSubscription) -> list[str]:
+    return [f.frame.text for f in sub.queue]
+
+
+async def test_drop_evicts_the_oldest_frame_with_the_same_key() -> None:
+    notifier = WebsocketNotifier(queue_size=3, overflow_policy="drop")
+    sub = make_sub()
+    for text, key in [("a1", "a"), ("b1", "b"), ("a2", "a"), ("a3", "a")]:
+        assert notifier._enqueue(sub, EncodedFrame(text), key)
+    assert texts(sub) == ["b1", "a2", "a3"]
+    # No queued frame of the key: the new one is dropped.
+    assert not notifier._enqueue(sub, EncodedFrame("c1"), "c")
+    assert texts(sub) == ["b1", "a2", "a3"]
+    assert notifier.get_queue_stats().dropped == 2
+
+
+async def test_evicted_delta_base_is_replaced_by_the_full_frame() -> None:
+    notifier = WebsocketNotifier(queue_size=2, overflow_policy="drop")
+    sub = make_sub()
+    notifier._enqueue(sub, EncodedFrame("full1"), "a")
+    sub.eval_revs["a"] = 1
+    notifier._enqueue(sub, EncodedFrame("delta2"), "a", EncodedFrame("full2"))
+    sub.eval_revs["a"] = 2
+    notifier._enqueue(sub, EncodedFrame("delta3"), "a", EncodedFrame("full3"))
+    assert texts(sub) == ["full2", "delta3"]
+
+    # The only queued frame of the key is dropped, the new delta has no base.
+    sub = make_sub()
+    notifier._enqueue(sub, EncodedFrame("x"))
+    notifier._enqueue(sub, EncodedFrame("full1"), "a")
+    sub.eval_revs["a"] = 1
+    notifier._enqueue(sub, EncodedFrame("delta2"), "a", EncodedFrame("full2"))
+    assert texts(sub) == ["x", "full2"]
+
+
+async def test_unkeyed_frames_are_capped() -> None:
+    for policy in ["coalesce", "drop", "disconnect"]:
+        notifier = WebsocketNotifier(
+            queue_size=2, overflow_policy=policy, max_queue_size=4
+        )
+        sub = make_sub()
+        for i in range(4):
+            assert notifier._enqueue(sub, EncodedFrame(str(i)))
+        assert not notifier._enqueue(sub, EncodedFrame("4"))
+        assert sub.should_close and not sub.queue
+        assert notifier.get_queue_stats().disconnected == 1
+
+
+async def test_resync_sends_the_latest_evaluation() -> None:
+    notifier = WebsocketNotifier()
+    sub = make_sub()
+    notifier._subscriptions[sub.ws] = sub
+    evaluation = cast(Any, {"gameId": 1, "ply": 3, "variations": []})
+    _, rev, _ = notifier._add_revision(evaluation, (1, 3))
+    sub.eval_revs[(1, 3)] = rev - 1
+    notifier.resync_evaluation(sub.ws, 1, 3)
+    assert texts(sub) == [
+        f'{{"evaluations":[{{"gameId":1,"ply":3,"variations":[],"rev":{rev}}}]}}'
+    ]
+    assert sub.eval_revs[(1, 3)] == rev
+    # Unknown evaluation: the next update is sent in full anyway.
+    notifier.resync_evaluation(sub.ws, 1, 4)
+    assert len(sub.queue) == 1
+
+
+async def test_truncation_forgets_the_evaluations_of_the_plies() -> None:
+    notifier = WebsocketNotifier()
+    for game_id, ply in [(1, 3), (1, 5), (1, 6), (2, 5)]:
+        evaluation = cast(Any, {"gameId": game_id, "ply": ply, "variations": []})
+        notifier._add_revision(evaluation, (game_id, ply))
+    notifier._broadcast({"truncateFromPly": 5}, game_id=1, ply=None, coalesce_key=None)
+    assert list(notifier._evaluations) == [(1, 3), (2, 5)]
+    assert notifier._evaluation_keys == {1: {3: (1, 3)}, 2: {5: (2, 5)}}
+
+
+async def test_replay_keeps_the_most_recently_updated_games() -> None:
+    notifier = WebsocketNotifier(replay_max_games=2)
+    for game_id in (1, 2, 1, 3):
+        notifier._broadcast(
+            {"positions": []}, game_id=game_id, ply=None, coalesce_key=None
+        )
+    assert list(notifier._replay_rings) == [1, 3]
+
+
+async def test_coalesced_frame_does_not_overtake_later_frames() -> None:
+    notifier = WebsocketNotifier(queue_size=8, overflow_policy="coalesce")
+    sub = make_sub()
+    notifier._enqueue(sub, EncodedFrame("a1"), "a")
+    notifier._enqueue(sub, EncodedFrame("u1"))
+    notifier._enqueue(sub, EncodedFrame("delta2"), "a", EncodedFrame("full2"))
+    # The delta was based on a frame the client never gets.
+    assert texts(sub) == ["u1", "full2"]
+    assert notifier.get_queue_stats().coalesced == 1
+    notifier._enqueue(sub, EncodedFrame("a3"), "a")
+    assert texts(sub) == ["u1", "a3"]
+    assert sub.keyed_frames["a"] is sub.queue[-1]
+
+
+class RecordingWebsocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def send(self, data: str) -> None:
+        self.sent.append(data)
+
+
+async def test_handshake_is_sent_first() -> None:
+    notifier = WebsocketNotifier()
+    ws = RecordingWebsocket()
+    async with anyio.create_task_group() as tg:
+        await tg.start(notifier.run)
+        notifier.register(cast(Any, ws), handshake=EncodedFrame("handshake"))
+        notifier.send_encoded(cast(Any, ws), EncodedFrame("update"))
+        with anyio.fail_after(1):
+            while len(ws.sent) < 2:
+                await anyio.sleep(0.01)
+        tg.cancel_scope.cancel()
+    assert ws.sent == ["handshake", "update"]
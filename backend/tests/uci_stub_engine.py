@@ -0,0 +1,36 @@
+# A minimal UCI engine for the tests: every search prints two multipv lines and
+# stops after the requested number of nodes.
+import sys
+
+import chess
+
+board = chess.Board()
+for line in sys.stdin:
+    command = line.split()
+    if not command:
+        continue
+    if command[0] == "uci":
+        print("id name stub")
+        print("option name MultiPV type spin default 1 min 1 max 500")
+        print("uciok", flush=True)
+    elif command[0] == "isready":
+        print("readyok", flush=True)
+    elif command[0] == "position":
+        moves = command.index("moves") if "moves" in command else len(command)
+        if command[1] == "startpos":
+            board = chess.Board()
+        else:
+            board = chess.Board(" ".join(command[2:moves]))
+        for move in command[moves + 1 :]:
+            board.push_uci(move)
+    elif command[0] == "go":
+        replies = list(board.legal_moves)[:2]
+        for multipv, move in enumerate(replies, start=1):
+            pv = move.uci()
+            print(
+                f"info depth 1 seldepth 2 time 10 nodes {100 // multipv} "
+                f"score cp {20 * multipv} wdl 300 500 200 multipv {multipv} pv {pv}"
+            )
+        print(f"bestmove {replies[0].uci()}", flush=True)
+    elif command[0] == "quit":
+        break
@@ -0,0 +1,192 @@
+import collections
+import dataclasses
+import hashlib
+import json
+from typing import Any, Optional
+
+import chess
+import chess.polyglot
+import db
+from sanic.log import logger
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+POSITION_FIELDS = [
+    "nodes",
+    "q_score",
+    "white_score",
+    "draw_score",
+    "black_score",
+    "moves_left",
+    "time",
+    "depth",
+    "seldepth",
+]
+EVALUATION_FIELDS = ["nodes", "time", "depth", "seldepth", "moves_left"]
+MOVE_FIELDS = [
+    "nodes",
+    "q_score",
+    "pv_san",
+    "pv_uci",
+    "mate_score",
+    "white_score",
+    "draw_score",
+    "black_score",
+    "moves_left",
+]
+
+
+# Engine flags that change the search itself. The per game UCI options (the WDL
+# calibration to the players' ratings and clocks) only change how the results
+# are reported, and are refreshed once the position is analyzed again.
+SEARCH_FLAGS = ("--weights", "-w", "--backend", "-b", "--backend-opts", "-o")
+
+
+# The search flags of the engine command line, e.g. {"--weights": "t1.pb.gz"}.
+def search_options(command: list[str]) -> dict[str, str]:
+    options: dict[str, str] = {}
+    for i, arg in enumerate(command):
+        name, sep, value = arg.partition("=")
+        if name not in SEARCH_FLAGS:
+            continue
+        if not sep and i + 1 < len(command):
+            value = command[i + 1]
+        options[name] = value
+    return options
+
+
+# Positions are only shared between analyses with the same search options.
+# Without options, it's the Zobrist hash.
+def transposition_key(fen: str, options: dict[str, str]) -> int:
+    key = chess.polyglot.zobrist_hash(chess.Board(fen))
+    if options:
+        digest = hashlib.blake2b(
+            json.dumps(options, sort_keys=True).encode(), digest_size=8
+        ).digest()
+        key ^= int.from_bytes(digest, "big")
+    # Polyglot hashes are unsigned, the DB column is a signed 64-bit integer.
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+@dataclasses.dataclass
+class TranspositionEntry:
+    nodes: int
+    position: dict[str, Any]
+    evaluation: dict[str, Any]
+    moves: list[dict[str, Any]]
+
+    def make_evaluation(
+        self, pos: db.GamePosition
+    ) -> tuple[db.GamePositionEvaluation, list[db.GamePositionEvaluationMove]]:
+        evaluation = db.GamePositionEvaluation(position=pos, **self.evaluation)
+        return evaluation, [db.GamePositionEvaluationMove(**m) for m in self.moves]
+
+
+def _fields(obj: Any, names: list[str]) -> dict[str, Any]:
+    return {name: getattr(obj, name) for name in names}
+
+
+# The deepest known evaluation of every position across all games, keyed by
+# transposition_key(). Persisted in PositionIndex, with an LRU of recent entries on top.
+class TranspositionTable:
+    _cache: collections.OrderedDict[int, TranspositionEntry]
+    _max_size: int
+
+    def __init__(self, max_size: int):
+        self._cache = collections.OrderedDict()
+        self._max_size = max_size
+
+    def _put_cache(self, key: int, entry: TranspositionEntry) -> None:
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+    async def lookup(self, keys: list[int]) -> dict[int, TranspositionEntry]:
+        res: dict[int, TranspositionEntry] = {}
+        missing: list[int] = []
+        for key in keys:
+            if (entry := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                res[key] = entry
+            else:
+                missing.append(key)
+        if not missing:
+            return res
+        index = await db.PositionIndex.filter(zobrist__in=missing)
+        if not index:
+            return res
+        positions = {
+            p.id: p
+            for p in await db.GamePosition.filter(id__in=[i.position_id for i in index])
+        }
+        evaluations = {
+            e.id: e
+            for e in await db.GamePositionEvaluation.filter(
+                id__in=[i.evaluation_id for i in index]
+            )
+        }
+        moves: dict[int, list[db.GamePositionEvaluationMove]] = collections.defaultdict(
+            list
+        )
+        for move in await db.GamePositionEvaluationMove.filter(
+            evaluation_id__in=list(evaluations.keys())
+        ).order_by("-nodes"):
+            moves[move.evaluation_id].append(move)
+        for i in index:
+            if i.position_id not in positions or i.evaluation_id not in evaluations:
+                continue
+            entry = TranspositionEntry(
+                nodes=i.nodes,
+                position=_fields(positions[i.position_id], POSITION_FIELDS),
+                evaluation=_fields(evaluations[i.evaluation_id], EVALUATION_FIELDS),
+                moves=[_fields(m, MOVE_FIELDS) for m in moves[i.evaluation_id]],
+            )
+            self._put_cache(i.zobrist, entry)
+            res[i.zobrist] = entry
+        return res
+
+    # Called by the evaluation store for every evaluation it writes.
+    async def record(
+        self,
+        key: int,
+        pos: db.GamePosition,
+        evaluation: db.GamePositionEvaluation,
+        moves: list[db.GamePositionEvaluationMove],
+        conn: BaseDBAsyncClient,
+    ) -> None:
+        cached: Optional[TranspositionEntry] = self._cache.get(key)
+        if cached is not None and cached.nodes >= evaluation.nodes:
+            return
+        updated = (
+            await db.PositionIndex.filter(zobrist=key, nodes__lt=evaluation.nodes)
+            .using_db(conn)
+            .update(
+                position_id=pos.id, evaluation_id=evaluation.id, nodes=evaluation.nodes
+            )
+        )
+        if not updated:
+            if await db.PositionIndex.filter(zobrist=key).using_db(conn).exists():
+                # A deeper evaluation is already known.
+                return
+            # Not get_or_create(), its nested transaction would roll back the
+            # whole flush on a conflict.
+            await db.PositionIndex.create(
+                zobrist=key,
+                position_id=pos.id,
+                evaluation_id=evaluation.id,
+                nodes=evaluation.nodes,
+                using_db=conn,
+            )
+        logger.debug(f"Transposition entry for {pos.fen}: {evaluation.nodes} nodes")
+        self._put_cache(
+            key,
+            TranspositionEntry(
+                nodes=evaluation.nodes,
+                position=_fields(pos, POSITION_FIELDS),
+                evaluation=_fields(evaluation, EVALUATION_FIELDS),
+                moves=[
+                    _fields(m, MOVE_FIELDS)
+                    for m in sorted(moves, key=lambda m: -m.nodes)
+                ],
+            ),
+        )
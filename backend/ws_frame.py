@@ -0,0 +1,24 @@
+import dataclasses
+import hashlib
+from typing import Optional
+
+from sanic import Websocket
+
+
+# A websocket message that is serialized once and shared by every connection
+# (and HTTP response) it's sent to.
+@dataclasses.dataclass(eq=False)
+class EncodedFrame:
+    text: str
+    _etag: Optional[str] = dataclasses.field(default=None, repr=False)
+
+    # Strong entity tag, for the same message served over HTTP.
+    @property
+    def etag(self) -> str:
+        if self._etag is None:
+            self._etag = f'"{hashlib.md5(self.text.encode()).hexdigest()}"'
+        return self._etag
+
+
+async def send_frame(ws: Websocket, frame: EncodedFrame) -> None:
+    await ws.send(frame.text)
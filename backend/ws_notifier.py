@@ -1,13 +1,18 @@
+import collections
 import dataclasses
-from typing import Optional, TypedDict
+import time
+from typing import Hashable, NotRequired, Optional, Required, TypedDict
 
 import anyio
+from anyio.abc import TaskGroup
+from eval_delta import make_evaluation_delta
 import db
 from sanic import Websocket
 from sanic.helpers import json_dumps
 from sanic.log import logger
 from websockets.exceptions import ConnectionClosed
 from sanic.exceptions import WebsocketClosed
+from ws_frame import EncodedFrame, send_frame
 
 # Global data
 
@@ -77,21 +82,76 @@ class WsVariationData(TypedDict, total=False):
 class WsEvaluationData(TypedDict):
     gameId: int
     ply: int
-    evalId: int
+    evalId: Optional[int]  # None until the evaluation is flushed to the DB.
     nodes: int
     time: int
     depth: int
     seldepth: int
     movesLeft: Optional[int]
     variations: list[WsVariationData]
+    # Revision of the broadcast evaluations of the position, for delta frames.
+    rev: NotRequired[int]
+
+
+# Delta frames, sent instead of evaluations to the clients that opted in.
+
+
+class WsVariationDelta(TypedDict, total=False):
+    i: Required[int]  # Index of the variation.
+    # Index of the previous variation it's based on, -1 for a new one. Same as
+    # `i` when missing.
+    j: int
+    nodes: int
+    # PVs are sent as the number of moves kept from the previous PV, and the
+    # moves that follow.
+    pvSanPrefix: int
+    pvSan: str
+    pvUciPrefix: int
+    pvUci: str
+    scoreQ: int
+    scoreW: int
+    scoreD: int
+    scoreB: int
+    mateScore: Optional[int]
+
+
+class WsEvaluationDelta(TypedDict, total=False):
+    gameId: Required[int]
+    ply: Required[int]
+    baseRev: Required[int]
+    rev: Required[int]
+    evalId: Optional[int]
+    nodes: int
+    time: int
+    depth: int
+    seldepth: int
+    movesLeft: Optional[int]
+    numVariations: Required[int]
+    variations: Required[list[WsVariationDelta]]
 
 
 # Websocket frame
 
 
+class WsPositionKey(TypedDict):
+    gameId: int
+    ply: int
+
+
 class WebsocketRequest(TypedDict, total=False):
     gameId: int
     ply: int
+    # The `seq` of the last game update received, to only get the missed ones
+    # after a reconnect.
+    lastSeq: int
+    # Asks for the latest evaluations of a range of plies (or of all of them)
+    # at once, e.g. to move through the game without waiting for the server.
+    fromPly: int
+    toPly: int
+    allPlies: bool
+    # Asks for the full evaluation of a position when a delta could not be
+    # applied, the next deltas are based on it.
+    resyncEvaluation: WsPositionKey
 
 
 class WebsocketResponse(TypedDict, total=False):
@@ -99,6 +159,14 @@ class WebsocketResponse(TypedDict, total=False):
     games: list[WsGameData]
     positions: list[WsPositionData]
     evaluations: list[WsEvaluationData]
+    evaluationDeltas: list[WsEvaluationDelta]
+    # Game updates are numbered, increasing within a game. Also sent alone to
+    # tell the number the client is up to date with.
+    gameId: int
+    seq: int
+    # The positions of the game from this ply on, and their evaluations, are
+    # gone (e.g. after a takeback). Applied before `positions`.
+    truncateFromPly: int
 
 
 def make_game_data(game: db.Game, is_being_analyzed: bool) -> WsGameData:
@@ -195,24 +263,222 @@ def make_positions_update(
     ]
 
 
+def make_game_update(
+    game_id: int,
+    positions: Optional[list[db.GamePosition]] = None,
+    ply: Optional[int] = None,
+    evaluations: Optional[list[db.GamePositionEvaluation]] = None,
+    moves: Optional[list[list[db.GamePositionEvaluationMove]]] = None,
+    truncate_from_ply: Optional[int] = None,
+) -> WebsocketResponse:
+    response = WebsocketResponse()
+    if truncate_from_ply is not None:
+        response.update(truncateFromPly=truncate_from_ply)
+    if positions is not None:
+        response.update(
+            positions=make_positions_update(game_id=game_id, positions=positions)
+        )
+    if evaluations is not None:
+        assert moves is not None
+        assert ply is not None
+        response.update(
+            evaluations=make_evaluations_update(
+                game_id=game_id, ply=ply, evaluations=evaluations, moves=moves
+            )
+        )
+    return response
+
+
+OVERFLOW_POLICIES = ("coalesce", "drop", "disconnect")
+
+
+@dataclasses.dataclass(eq=False)
+class OutboundFrame:
+    frame: EncodedFrame
+    # Frames with the same key carry the latest state of the same thing, so only
+    # the newest one matters. Frames without a key are never dropped.
+    coalesce_key: Optional[Hashable] = None
+    # For a delta, the full update, to send instead if its base is dropped.
+    full_frame: Optional[EncodedFrame] = None
+
+
 @dataclasses.dataclass
 class WebsocketSubscription:
     ws: Websocket
     game_id: Optional[int] = None
     ply: Optional[int] = None
+    queue: collections.deque[OutboundFrame] = dataclasses.field(
+        default_factory=collections.deque
+    )
+    keyed_frames: dict[Hashable, OutboundFrame] = dataclasses.field(
+        default_factory=dict
+    )
+    wakeup: anyio.Event = dataclasses.field(default_factory=anyio.Event)
+    writer_scope: anyio.CancelScope = dataclasses.field(
+        default_factory=anyio.CancelScope
+    )
+    full_since: Optional[float] = None
+    should_close: bool = False
+    # Whether the client accepts evaluation deltas, and the revision of the
+    # evaluation it has (or will have once the queue is sent) per key.
+    use_deltas: bool = False
+    eval_revs: dict[Hashable, int] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class _ReplayRing:
+    frames: collections.deque[tuple[int, Optional[Hashable], EncodedFrame]]
+    # The frames after this sequence number are all in `frames`.
+    start_seq: int
+
+
+@dataclasses.dataclass
+class WebsocketQueueStats:
+    queued: int = 0
+    max_depth: int = 0
+    conflated: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    disconnected: int = 0
 
 
 class WebsocketNotifier:
     _subscriptions: dict[Websocket, WebsocketSubscription]
-
-    def __init__(self):
+    # Subscriptions indexed by the game, and by the (game, ply) they look at.
+    _game_topics: dict[int, dict[Websocket, WebsocketSubscription]]
+    _ply_topics: dict[tuple[int, int], dict[Websocket, WebsocketSubscription]]
+    _queue_size: int
+    _max_queue_size: int
+    _overflow_policy: str
+    _max_lag_sec: float
+    _stats: WebsocketQueueStats
+    _task_group: Optional[TaskGroup]
+    # Conflation of the keyed updates, at most one per key every
+    # `_min_update_interval_sec` seconds.
+    _min_update_interval_sec: Optional[float]
+    _conflated: dict[Hashable, tuple[WebsocketResponse, int]]
+    _last_sent: dict[Hashable, float]
+    _conflated_added: anyio.Event
+    # The latest broadcast evaluation per key, the base of the next delta.
+    _evaluations: collections.OrderedDict[Hashable, WsEvaluationData]
+    # Keys of `_evaluations` by game and ply.
+    _evaluation_keys: dict[int, dict[int, Hashable]]
+    _next_rev: int
+    # The latest updates per game, for the clients that reconnect. Sequence
+    # numbers start at the current time so that they keep increasing across
+    # restarts.
+    _replay_rings: collections.OrderedDict[int, _ReplayRing]
+    _replay_ring_size: int
+    _replay_max_games: int
+    _next_seq: int
+
+    def __init__(
+        self,
+        queue_size: int = 64,
+        overflow_policy: str = "coalesce",
+        max_lag_sec: float = 10.0,
+        max_updates_per_sec: Optional[float] = None,
+        replay_ring_size: int = 256,
+        max_queue_size: int = 1024,
+        replay_max_games: int = 64,
+    ):
+        assert overflow_policy in OVERFLOW_POLICIES, overflow_policy
         self._subscriptions = dict()
-
-    def register(self, ws: Websocket) -> None:
-        self._subscriptions[ws] = WebsocketSubscription(ws=ws)
+        self._game_topics = dict()
+        self._ply_topics = dict()
+        self._queue_size = queue_size
+        self._max_queue_size = max(max_queue_size, queue_size)
+        self._overflow_policy = overflow_policy
+        self._max_lag_sec = max_lag_sec
+        self._stats = WebsocketQueueStats()
+        self._task_group = None
+        self._min_update_interval_sec = (
+            1.0 / max_updates_per_sec if max_updates_per_sec else None
+        )
+        self._conflated = {}
+        self._last_sent = {}
+        self._conflated_added = anyio.Event()
+        self._evaluations = collections.OrderedDict()
+        self._evaluation_keys = {}
+        self._next_rev = 1
+        self._replay_rings = collections.OrderedDict()
+        self._replay_ring_size = replay_ring_size
+        self._replay_max_games = replay_max_games
+        self._next_seq = int(time.time() * 1e6)
+
+    # Runs the writer tasks of the connections and the conflation flushes.
+    async def run(self, *, task_status=anyio.TASK_STATUS_IGNORED) -> None:
+        async with anyio.create_task_group() as tg:
+            self._task_group = tg
+            task_status.started()
+            if self._min_update_interval_sec is not None:
+                await self._run_conflation(self._min_update_interval_sec)
+            else:
+                await anyio.sleep_forever()
+
+    async def _run_conflation(self, interval: float) -> None:
+        while True:
+            await self._conflated_added.wait()
+            self._conflated_added = anyio.Event()
+            while self._conflated:
+                now = time.monotonic()
+                due = {key: self._last_sent[key] + interval for key in self._conflated}
+                for key, due_at in due.items():
+                    if due_at <= now:
+                        self._send_conflated(key)
+                if self._conflated:
+                    await anyio.sleep(min(due.values()) - now)
+            # Keys that were not updated for a while are forgotten.
+            if len(self._last_sent) > 1024:
+                now = time.monotonic()
+                self._last_sent = {
+                    key: sent_at
+                    for key, sent_at in self._last_sent.items()
+                    if now - sent_at < interval
+                }
+
+    # The handshake is the first frame sent, before any update.
+    def register(
+        self,
+        ws: Websocket,
+        use_deltas: bool = False,
+        handshake: Optional[EncodedFrame] = None,
+    ) -> None:
+        assert self._task_group is not None, "WebsocketNotifier is not running"
+        sub = WebsocketSubscription(ws=ws, use_deltas=use_deltas)
+        if handshake is not None:
+            self._enqueue(sub, handshake)
+        self._subscriptions[ws] = sub
+        self._task_group.start_soon(self._run_writer, sub)
+
+    def _remove_from_topics(self, entry: WebsocketSubscription) -> None:
+        if entry.game_id is None:
+            return
+        topic = self._game_topics[entry.game_id]
+        del topic[entry.ws]
+        if not topic:
+            del self._game_topics[entry.game_id]
+        if entry.ply is None:
+            return
+        key = (entry.game_id, entry.ply)
+        topic = self._ply_topics[key]
+        del topic[entry.ws]
+        if not topic:
+            del self._ply_topics[key]
+
+    def _add_to_topics(self, entry: WebsocketSubscription) -> None:
+        if entry.game_id is None:
+            return
+        self._game_topics.setdefault(entry.game_id, {})[entry.ws] = entry
+        if entry.ply is not None:
+            self._ply_topics.setdefault((entry.game_id, entry.ply), {})[
+                entry.ws
+            ] = entry
 
     def unregister(self, ws: Websocket) -> None:
-        self._subscriptions.pop(ws)
+        sub = self._subscriptions.pop(ws)
+        sub.writer_scope.cancel()
+        self._remove_from_topics(sub)
 
     def num_subscribers(self) -> int:
         return len(self._subscriptions)
@@ -222,10 +488,22 @@ class WebsocketNotifier:
     ) -> bool:
         entry = self._subscriptions[ws]
         game_changed = entry.game_id != game_id
+        self._remove_from_topics(entry)
         entry.game_id = game_id
         entry.ply = ply
+        self._add_to_topics(entry)
         return game_changed
 
+    def _get_topic(
+        self, game_id: Optional[int], ply: Optional[int]
+    ) -> list[WebsocketSubscription]:
+        if game_id is None:
+            subs = list(self._subscriptions.values())
+            return subs if ply is None else [s for s in subs if s.ply == ply]
+        if ply is None:
+            return list(self._game_topics.get(game_id, {}).values())
+        return list(self._ply_topics.get((game_id, ply), {}).values())
+
     async def send_game_entry_update(self, game: db.Game, is_being_analyzed: bool):
         response = WebsocketResponse()
         response.update(games=[make_game_data(game, is_being_analyzed)])
@@ -238,48 +516,339 @@ class WebsocketNotifier:
         ply: Optional[int] = None,
         evaluations: Optional[list[db.GamePositionEvaluation]] = None,
         moves: Optional[list[list[db.GamePositionEvaluationMove]]] = None,
+        truncate_from_ply: Optional[int] = None,
     ):
-        response = WebsocketResponse()
-        if positions is not None:
-            response.update(
-                positions=make_positions_update(game_id=game_id, positions=positions)
-            )
-        if evaluations is not None:
-            assert moves is not None
-            assert ply is not None
-            response.update(
-                evaluations=make_evaluations_update(
-                    game_id=game_id, ply=ply, evaluations=evaluations, moves=moves
-                )
-            )
+        response = make_game_update(
+            game_id=game_id,
+            positions=positions,
+            ply=ply,
+            evaluations=evaluations,
+            moves=moves,
+            truncate_from_ply=truncate_from_ply,
+        )
         await self.notify_observers(response, game_id=game_id)
 
-    async def send_text(self, ws: Websocket, response: str):
+    async def send_frame(self, ws: Websocket, frame: EncodedFrame) -> bool:
         try:
-            await ws.send(response)
+            await send_frame(ws, frame)
         except ConnectionClosed as e:
             logger.info(f"Connection closed, {e}")
-            pass
+            return False
         except WebsocketClosed as e:
             logger.info(f"Websocket closed, {e}")
-            pass
+            return False
+        return True
+
+    async def _run_writer(self, sub: WebsocketSubscription) -> None:
+        with sub.writer_scope:
+            while True:
+                await sub.wakeup.wait()
+                sub.wakeup = anyio.Event()
+                while sub.queue:
+                    frame = sub.queue.popleft()
+                    if sub.keyed_frames.get(frame.coalesce_key) is frame:
+                        del sub.keyed_frames[frame.coalesce_key]
+                    if len(sub.queue) < self._queue_size:
+                        sub.full_since = None
+                    if not await self.send_frame(sub.ws, frame.frame):
+                        return
+                if sub.should_close:
+                    await sub.ws.close()
+                    return
+
+    def _disconnect(self, sub: WebsocketSubscription, reason: str) -> None:
+        logger.warning(f"Websocket {reason}, disconnecting.")
+        sub.should_close = True
+        sub.queue.clear()
+        sub.keyed_frames.clear()
+        sub.wakeup.set()
+        self._stats.disconnected += 1
+
+    # Removes a queued keyed frame. The next frame with the same key may be a
+    # delta based on it, so that one is sent in full instead.
+    def _evict(self, sub: WebsocketSubscription, frame: OutboundFrame) -> None:
+        sub.queue.remove(frame)
+        self._stats.dropped += 1
+        if sub.keyed_frames.get(frame.coalesce_key) is frame:
+            del sub.keyed_frames[frame.coalesce_key]
+            sub.eval_revs.pop(frame.coalesce_key, None)
+            return
+        for later in sub.queue:
+            if later.coalesce_key == frame.coalesce_key:
+                if later.full_frame is not None:
+                    later.frame, later.full_frame = later.full_frame, None
+                return
+
+    # Returns whether the new frame should still be queued into the full queue.
+    def _handle_overflow(
+        self, sub: WebsocketSubscription, coalesce_key: Optional[Hashable]
+    ) -> bool:
+        now = time.monotonic()
+        if sub.full_since is None:
+            sub.full_since = now
+        # Frames without a key are never dropped, so the queue may only grow up
+        # to a hard limit.
+        if len(sub.queue) >= self._max_queue_size:
+            self._disconnect(sub, f"has {len(sub.queue)} frames queued")
+            return False
+        if self._overflow_policy == "disconnect":
+            if now - sub.full_since <= self._max_lag_sec:
+                return True
+            self._disconnect(sub, f"is {now - sub.full_since:.1f}s behind")
+            return False
+        if coalesce_key is None:
+            return True
+        if self._overflow_policy == "drop":
+            # The oldest queued frame with the same key makes room for the new
+            # one. Without one, the new frame is dropped.
+            for frame in sub.queue:
+                if frame.coalesce_key == coalesce_key:
+                    self._evict(sub, frame)
+                    return True
+            self._stats.dropped += 1
+            return False
+        # coalesce: the oldest keyed frame makes room for the new one.
+        for frame in sub.queue:
+            if frame.coalesce_key is not None:
+                self._evict(sub, frame)
+                break
+        return True
+
+    def _enqueue(
+        self,
+        sub: WebsocketSubscription,
+        frame: EncodedFrame,
+        coalesce_key: Optional[Hashable] = None,
+        full_frame: Optional[EncodedFrame] = None,
+    ) -> bool:
+        if sub.should_close:
+            return False
+        if coalesce_key is not None and self._overflow_policy == "coalesce":
+            if (queued := sub.keyed_frames.pop(coalesce_key, None)) is not None:
+                # The new frame goes to the tail, not to the slot of the one it
+                # replaces, so that it doesn't overtake the frames queued in
+                # between (game updates must arrive in `seq` order). The
+                # replaced frame may have been the base of the delta.
+                sub.queue.remove(queued)
+                frame, full_frame = full_frame or frame, None
+                self._stats.coalesced += 1
+        if len(sub.queue) >= self._queue_size:
+            if not self._handle_overflow(sub, coalesce_key):
+                return False
+            if full_frame is not None and coalesce_key not in sub.eval_revs:
+                # The frame the delta was based on has just been dropped.
+                frame = full_frame
+        queued = OutboundFrame(
+            frame=frame,
+            coalesce_key=coalesce_key,
+            full_frame=full_frame if full_frame is not frame else None,
+        )
+        sub.queue.append(queued)
+        if coalesce_key is not None:
+            sub.keyed_frames[coalesce_key] = queued
+        sub.wakeup.set()
+        return True
+
+    def get_queue_stats(self) -> WebsocketQueueStats:
+        depths = [len(sub.queue) for sub in self._subscriptions.values()]
+        return dataclasses.replace(
+            self._stats, queued=sum(depths), max_depth=max(depths, default=0)
+        )
 
     async def send_response(self, ws: Websocket, response: WebsocketResponse):
-        await self.send_text(ws, json_dumps(response))
+        self.send_encoded(ws, EncodedFrame(json_dumps(response)))
+
+    def send_encoded(self, ws: Websocket, frame: EncodedFrame) -> None:
+        if (sub := self._subscriptions.get(ws)) is not None:
+            self._enqueue(sub, frame)
+
+    # Assigns a revision to the evaluation of a keyed update. Returns the
+    # evaluation with the revision, the revision, and the previous evaluation
+    # with the same key.
+    def _add_revision(
+        self, evaluation: WsEvaluationData, key: Hashable
+    ) -> tuple[WsEvaluationData, int, Optional[WsEvaluationData]]:
+        rev = self._next_rev
+        self._next_rev += 1
+        evaluation = WsEvaluationData(**evaluation)
+        evaluation["rev"] = rev
+        prev = self._evaluations.get(key)
+        self._evaluations[key] = evaluation
+        self._evaluations.move_to_end(key)
+        plies = self._evaluation_keys.setdefault(evaluation["gameId"], {})
+        plies[evaluation["ply"]] = key
+        if len(self._evaluations) > 1024:
+            self._forget_evaluation(next(iter(self._evaluations)))
+        return evaluation, rev, prev
+
+    def _forget_evaluation(self, key: Hashable) -> None:
+        evaluation = self._evaluations.pop(key)
+        plies = self._evaluation_keys[evaluation["gameId"]]
+        del plies[evaluation["ply"]]
+        if not plies:
+            del self._evaluation_keys[evaluation["gameId"]]
+
+    def _get_replay_ring(self, game_id: int) -> _ReplayRing:
+        ring = self._replay_rings.get(game_id)
+        if ring is None:
+            ring = self._replay_rings[game_id] = _ReplayRing(
+                frames=collections.deque(), start_seq=self._next_seq - 1
+            )
+        self._replay_rings.move_to_end(game_id)
+        if len(self._replay_rings) > self._replay_max_games:
+            self._replay_rings.popitem(last=False)
+        return ring
 
+    def _add_to_replay(
+        self,
+        game_id: int,
+        seq: int,
+        coalesce_key: Optional[Hashable],
+        frame: EncodedFrame,
+    ) -> None:
+        ring = self._get_replay_ring(game_id)
+        ring.frames.append((seq, coalesce_key, frame))
+        if len(ring.frames) > self._replay_ring_size:
+            ring.start_seq = ring.frames.popleft()[0]
+
+    # Sends the latest broadcast evaluation of the position in full.
+    def resync_evaluation(self, ws: Websocket, game_id: int, ply: int) -> None:
+        if (sub := self._subscriptions.get(ws)) is None:
+            return
+        if (key := self._evaluation_keys.get(game_id, {}).get(ply)) is None:
+            return  # The next update is sent in full.
+        sub.eval_revs.pop(key, None)
+        evaluation = self._evaluations[key]
+        frame = EncodedFrame(json_dumps(WebsocketResponse(evaluations=[evaluation])))
+        if self._enqueue(sub, frame, key) and (rev := evaluation.get("rev")):
+            sub.eval_revs[key] = rev
+
+    # Queues the frames of the game broadcast after `last_seq`, when they are
+    # all still known. Of the keyed ones, only the latest per key is queued.
+    def replay_missed(self, ws: Websocket, game_id: int, last_seq: int) -> bool:
+        ring = self._replay_rings.get(game_id)
+        if ring is None or not ring.start_seq <= last_seq < self._next_seq:
+            return False
+        missed = [(k, frame) for seq, k, frame in ring.frames if seq > last_seq]
+        latest = {k: frame for k, frame in missed if k is not None}
+        logger.debug(f"Replaying {len(missed)} frames of game {game_id}")
+        for k, frame in missed:
+            if k is None or latest[k] is frame:
+                self.send_encoded(ws, frame)
+        return True
+
+    # Tells the client the sequence number from which it gets all the frames of
+    # the game it just subscribed to.
+    def send_game_seq(self, ws: Websocket, game_id: int) -> None:
+        # Updates are recorded from now on, so that the client can resume.
+        self._get_replay_ring(game_id)
+        response = WebsocketResponse(gameId=game_id, seq=self._next_seq - 1)
+        self.send_encoded(ws, EncodedFrame(json_dumps(response)))
+
+    def _broadcast(
+        self,
+        response: WebsocketResponse,
+        game_id: Optional[int],
+        ply: Optional[int],
+        coalesce_key: Optional[Hashable],
+    ) -> None:
+        subs = self._get_topic(game_id=game_id, ply=ply)
+        from_ply = response.get("truncateFromPly")
+        if game_id is not None and from_ply is not None:
+            # The next evaluations of these plies are not based on the old ones.
+            plies = self._evaluation_keys.get(game_id, {})
+            for key in [k for p, k in plies.items() if p >= from_ply]:
+                self._forget_evaluation(key)
+        # Game updates are numbered and kept for the clients that reconnect,
+        # whether or not anyone is watching right now.
+        replay_game_id: Optional[int] = None
+        if ply is None and (
+            "positions" in response
+            or "evaluations" in response
+            or "truncateFromPly" in response
+        ):
+            replay_game_id = game_id
+        if not subs and replay_game_id is None:
+            return
+
+        prev: Optional[WsEvaluationData] = None
+        evaluation: Optional[WsEvaluationData] = None
+        rev = 0
+        evaluations = response.get("evaluations", [])
+        if coalesce_key is not None and len(evaluations) == 1:
+            evaluation, rev, prev = self._add_revision(evaluations[0], coalesce_key)
+            response = response.copy()
+            response["evaluations"] = [evaluation]
+        seq: Optional[int] = None
+        if replay_game_id is not None:
+            seq = self._next_seq
+            self._next_seq += 1
+            response = response.copy()
+            response.update(gameId=replay_game_id, seq=seq)
+        raw_response = EncodedFrame(json_dumps(response))
+        if replay_game_id is not None and seq is not None:
+            self._add_to_replay(replay_game_id, seq, coalesce_key, raw_response)
+
+        if evaluation is None:
+            for sub in subs:
+                self._enqueue(sub, raw_response, coalesce_key)
+            return
+
+        raw_delta: Optional[EncodedFrame] = None
+        for sub in subs:
+            frame = raw_response
+            if (
+                sub.use_deltas
+                and prev is not None
+                and sub.eval_revs.get(coalesce_key) == prev.get("rev")
+            ):
+                if raw_delta is None:
+                    delta_response = WebsocketResponse(
+                        evaluationDeltas=[make_evaluation_delta(prev, evaluation)]
+                    )
+                    if "positions" in response:
+                        delta_response.update(positions=response["positions"])
+                    if "gameId" in response:
+                        delta_response.update(gameId=response["gameId"])
+                    if "seq" in response:
+                        delta_response.update(seq=response["seq"])
+                    raw_delta = EncodedFrame(json_dumps(delta_response))
+                frame = raw_delta
+            if self._enqueue(sub, frame, coalesce_key, full_frame=raw_response):
+                sub.eval_revs[coalesce_key] = rev
+            else:
+                sub.eval_revs.pop(coalesce_key, None)
+
+    def _send_conflated(self, key: Hashable) -> None:
+        response, game_id = self._conflated.pop(key)
+        self._last_sent[key] = time.monotonic()
+        self._broadcast(response, game_id=game_id, ply=None, coalesce_key=key)
+
+    # Only queues the response, the writer tasks send it. Keyed game updates
+    # are conflated to the configured rate, other game updates (e.g. new moves)
+    # first flush the pending ones of the game.
     async def notify_observers(
         self,
         response: WebsocketResponse,
         game_id: Optional[int] = None,
         ply: Optional[int] = None,
+        coalesce_key: Optional[Hashable] = None,
     ) -> None:
-        subs = list(self._subscriptions.values())
-
-        raw_response = json_dumps(response)
-        async with anyio.create_task_group() as tg:
-            for sub in subs:
-                if game_id is not None and sub.game_id != game_id:
-                    continue
-                if ply is not None and sub.ply != ply:
-                    continue
-                tg.start_soon(self.send_text, sub.ws, raw_response)
+        interval = self._min_update_interval_sec
+        if interval is None or game_id is None or ply is not None:
+            self._broadcast(response, game_id, ply, coalesce_key)
+            return
+        if coalesce_key is None:
+            for key in [k for k, (_, g) in self._conflated.items() if g == game_id]:
+                self._send_conflated(key)
+            self._broadcast(response, game_id, ply, coalesce_key)
+            return
+        if coalesce_key in self._conflated:
+            self._stats.conflated += 1
+        elif time.monotonic() - self._last_sent.get(coalesce_key, -interval) < interval:
+            self._conflated_added.set()
+        else:
+            self._last_sent[coalesce_key] = time.monotonic()
+            self._broadcast(response, game_id, ply, coalesce_key)
+            return
+        self._conflated[coalesce_key] = (response, game_id)
@@ -81,6 +81,9 @@ export class App implements WebsocketObserver {
     this.moveList.updatePositions(
         position.filter(p => p.gameId == this.curGameId));
   }
+  public onPositionsTruncated(gameId: number, fromPly: number): void {
+    if (gameId == this.curGameId) this.moveList.truncatePositions(fromPly);
+  }
   public onEvaluationReceived(evaluation: WsEvaluationData[]): void {
     let evals = evaluation.filter(
         e => e.gameId == this.curGameId && e.ply == this.curPly);
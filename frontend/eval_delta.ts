@@ -0,0 +1,34 @@
+import {WsEvaluationData, WsEvaluationDelta, WsVariationData} from './ws_feed';
+
+// Reconstruction of the evaluations from the delta frames. Same as
+// apply_evaluation_delta() in backend/eval_delta.py, tests/test_eval_delta.py
+// checks that they agree.
+
+export function applyPvDelta(
+    prev: string, keep: number, suffix: string): string {
+  return [...prev.split(' ').slice(0, keep), ...suffix.split(' ')]
+      .filter(m => m)
+      .join(' ');
+}
+
+export function applyEvaluationDelta(
+    prev: WsEvaluationData, delta: WsEvaluationDelta): WsEvaluationData {
+  const res: WsEvaluationData = {...prev, rev: delta.rev};
+  for (const field of
+           ['evalId', 'nodes', 'time', 'depth', 'seldepth', 'movesLeft']) {
+    if (field in delta) res[field] = delta[field];
+  }
+  res.variations = prev.variations.slice(0, delta.numVariations);
+  for (const vd of delta.variations) {
+    const j = vd.j ?? vd.i;
+    const variation = {...(j === -1 ? {} : prev.variations[j])};
+    for (const [field, value] of Object.entries(vd)) {
+      if (field === 'i' || field === 'j' || field.endsWith('Prefix')) continue;
+      const keep = vd[`${field}Prefix`];
+      variation[field] =
+          keep == null ? value : applyPvDelta(variation[field], keep, value);
+    }
+    res.variations[vd.i] = variation as WsVariationData;
+  }
+  return res;
+}
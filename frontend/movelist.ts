@@ -323,6 +323,22 @@ export class MoveList {
     }
   }
 
+  // Removes the positions from `fromPly` on, e.g. after a takeback.
+  public truncatePositions(fromPly: number): void {
+    if (fromPly >= this.positions.length) return;
+    this.positions.length = Math.max(fromPly, 0);
+    this.element.querySelectorAll('[ply-idx]').forEach(row => {
+      if (Number(row.getAttribute('ply-idx')) >= fromPly) row.remove();
+    });
+    // The last remaining row shows the move that was taken back.
+    const last = this.positions.at(-1);
+    if (last) this.updateSinglePosition(last);
+    if (this.positionIdx >= this.positions.length) {
+      this.positionIdx = -1;
+      this.selectPly(this.positions.length - 1);
+    }
+  }
+
   public clearPositions(): void {
     this.positions = [];
     this.element.innerHTML = `<tr>
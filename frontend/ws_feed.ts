@@ -1,3 +1,5 @@
+import {applyEvaluationDelta} from './eval_delta';
+
 // Global data
 
 export interface WsGlobalData {
@@ -62,13 +64,46 @@ export interface WsVariationData {
 export interface WsEvaluationData {
   gameId: number;
   ply: number;
-  evalId: number;
+  evalId?: number;  // Not set until the evaluation is flushed to the DB.
   nodes: number;
   time: number;
   depth: number;
   seldepth: number;
   movesLeft?: number;
   variations: WsVariationData[];
+  rev?: number;  // Revision of the broadcast evaluations, for delta frames.
+}
+
+// Delta frames, sent instead of evaluations from protocol version 2 on.
+
+export interface WsVariationDelta {
+  i: number;   // Index of the variation.
+  j?: number;  // Index of the previous variation it's based on, -1 if new.
+  nodes?: number;
+  pvSanPrefix?: number;  // Number of moves kept from the previous PV.
+  pvSan?: string;
+  pvUciPrefix?: number;
+  pvUci?: string;
+  scoreQ?: number;
+  scoreW?: number;
+  scoreD?: number;
+  scoreB?: number;
+  mateScore?: number;
+}
+
+export interface WsEvaluationDelta {
+  gameId: number;
+  ply: number;
+  baseRev: number;
+  rev: number;
+  evalId?: number;
+  nodes?: number;
+  time?: number;
+  depth?: number;
+  seldepth?: number;
+  movesLeft?: number;
+  numVariations: number;
+  variations: WsVariationDelta[];
 }
 
 // Websocket frame
@@ -76,6 +111,17 @@ export interface WsEvaluationData {
 export interface WebsocketRequest {
   gameId?: number;
   ply?: number;
+  // The `seq` of the last game update received, to only get the missed ones
+  // after a reconnect.
+  lastSeq?: number;
+  // Asks for the latest evaluations of a range of plies (or of all of them)
+  // at once.
+  fromPly?: number;
+  toPly?: number;
+  allPlies?: boolean;
+  // Asks for the full evaluation of a position when a delta could not be
+  // applied, the next deltas are based on it.
+  resyncEvaluation?: {gameId: number, ply: number};
 }
 
 export interface WebsocketResponse {
@@ -83,9 +129,24 @@ export interface WebsocketResponse {
   games: WsGameData[];
   positions: WsPositionData[];
   evaluations: WsEvaluationData[];
+  evaluationDeltas: WsEvaluationDelta[];
+  // Game updates are numbered, increasing within a game.
+  gameId?: number;
+  seq?: number;
+  // The positions of the game from this ply on, and their evaluations, are
+  // gone (e.g. after a takeback). Applied before `positions`.
+  truncateFromPly?: number;
 }
 // ---
 
+// Version of the websocket protocol. From 2 on evaluations are sent as deltas,
+// from 3 on the snapshots (game list, positions of a game, evaluation of a
+// position) are loaded over HTTP and the websocket only carries the updates.
+const PROTOCOL_VERSION = 3;
+const RECONNECT_DELAY_MS = 3581;  // 3581 is a prime number.
+// When a position without a cached evaluation is selected, the evaluations of
+// this many plies before and after it are fetched along.
+const PREFETCH_PLIES = 16;
 
 export interface WebsocketObserver {
   onConnect(): void;
@@ -93,6 +154,7 @@ export interface WebsocketObserver {
   onStatusReceived(status: WsGlobalData): void;
   onGamesReceived(games: WsGameData[]): void;
   onPositionReceived(position: WsPositionData[]): void;
+  onPositionsTruncated(gameId: number, fromPly: number): void;
   onEvaluationReceived(evaluation: WsEvaluationData[]): void;
 }
 
@@ -103,6 +165,14 @@ export class WebSocketFeed {
   private observers: WebsocketObserver[] = [];
   private gameId?: number;
   private ply?: number;
+  private lastSeq?: number;
+  // Latest evaluation with a revision per position, the base for deltas.
+  private evaluations = new Map<string, WsEvaluationData>();
+  // Latest evaluation per ply of the current game, kept up to date by the
+  // updates, so that moving through the game doesn't wait for the server.
+  private plyEvaluations = new Map<number, WsEvaluationData>();
+  // Positions whose full evaluation was asked for after a delta without base.
+  private resyncing = new Set<string>();
 
   constructor() {
     this.connect();
@@ -126,7 +196,10 @@ export class WebSocketFeed {
     }
     this.gameId = gameId;
     this.ply = undefined;
+    this.lastSeq = undefined;
+    this.plyEvaluations.clear();
     this.sendRequest({gameId});
+    this.loadPositions(gameId);
   }
 
   public setPosition(ply: number): void {
@@ -134,17 +207,88 @@ export class WebSocketFeed {
       return;
     }
     this.ply = ply;
-    this.sendRequest({gameId: this.gameId, ply});
+    const cached = this.plyEvaluations.get(ply);
+    if (cached) {
+      this.sendRequest({gameId: this.gameId, ply});
+      this.notifyObservers(observer => observer.onEvaluationReceived([cached]));
+      return;
+    }
+    this.sendRequest({
+      gameId: this.gameId,
+      ply,
+      fromPly: Math.max(0, ply - PREFETCH_PLIES),
+      toPly: ply + PREFETCH_PLIES,
+    });
+    // The request above is not sent while disconnected.
+    if (this.gameId != null && this.websocket.readyState !== WebSocket.OPEN) {
+      this.loadEvaluation(this.gameId, ply);
+    }
+  }
+
+  private cacheEvaluations(evaluations: WsEvaluationData[]): void {
+    for (const evaluation of evaluations) {
+      if (evaluation.gameId === this.gameId) {
+        this.plyEvaluations.set(evaluation.ply, evaluation);
+      }
+    }
   }
 
   private sendRequest(request: WebsocketRequest): void {
+    // Sent again once connected.
+    if (this.websocket.readyState !== WebSocket.OPEN) return;
     this.websocket.send(JSON.stringify(request));
   }
 
+  private async fetchSnapshot(path: string):
+      Promise<WebsocketResponse|undefined> {
+    try {
+      const response = await fetch(`/api/${path}`);
+      if (!response.ok) return undefined;
+      return await response.json() as WebsocketResponse;
+    } catch (e) {
+      console.warn(`Failed to load ${path}`, e);
+      return undefined;
+    }
+  }
+
+  private async loadGames(): Promise<void> {
+    const response = await this.fetchSnapshot('games');
+    if (response?.games) {
+      this.notifyObservers(
+          observer => observer.onGamesReceived(response.games));
+    }
+  }
+
+  private async loadPositions(gameId: number): Promise<void> {
+    const response = await this.fetchSnapshot(`games/${gameId}/positions`);
+    if (response?.positions && this.gameId === gameId) {
+      this.notifyObservers(
+          observer => observer.onPositionReceived(response.positions));
+    }
+  }
+
+  private async loadEvaluation(gameId: number, ply: number): Promise<void> {
+    const response =
+        await this.fetchSnapshot(`games/${gameId}/positions/${ply}/evaluation`);
+    if (response?.evaluations && this.gameId === gameId && this.ply === ply) {
+      this.cacheEvaluations(response.evaluations);
+      this.notifyObservers(
+          observer => observer.onEvaluationReceived(response.evaluations));
+    }
+  }
+
   private onOpen(): void {
     this.websocket.onmessage = this.onMessage.bind(this);
+    // Subscribes first, so that no update is missed while loading snapshots.
+    // After a reconnect the server sends the missed updates instead.
     if (this.gameId != null || this.ply != null) {
-      this.sendRequest({gameId: this.gameId, ply: this.ply});
+      this.sendRequest(
+          {gameId: this.gameId, ply: this.ply, lastSeq: this.lastSeq});
+    }
+    this.loadGames();
+    if (this.gameId != null && this.lastSeq == null) {
+      this.loadPositions(this.gameId);
+      if (this.ply != null) this.loadEvaluation(this.gameId, this.ply);
     }
     this.notifyObservers(observer => observer.onConnect());
   }
@@ -153,16 +297,21 @@ export class WebSocketFeed {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     if (this.websocket) this.websocket.close();
     this.websocket =
-        new WebSocket(`${protocol}//${window.location.host}/api/ws`);
+        new WebSocket(`${protocol}//${window.location.host}/api/ws?v=${
+            PROTOCOL_VERSION}`);
     this.websocket.onopen = this.onOpen.bind(this);
     this.websocket.onclose = this.onClose.bind(this);
   }
 
   private onClose(): void {
+    this.evaluations.clear();
+    this.resyncing.clear();
     this.notifyObservers(observer => observer.onDisconnect());
+    // Jittered, so that after a server restart the clients don't all come
+    // back at once.
     setTimeout(() => {
       this.connect();
-    }, 3581);  // 3581 is a prime number.
+    }, RECONNECT_DELAY_MS * (0.5 + Math.random()));
   }
 
   private notifyObservers(callback: (WebsocketObserver) => void): void {
@@ -171,6 +320,15 @@ export class WebSocketFeed {
 
   private onMessage(event: MessageEvent): void {
     const response = JSON.parse(event.data) as WebsocketResponse;
+    if (response.seq != null && response.gameId === this.gameId) {
+      this.lastSeq = response.seq;
+      // Sent alone when (re)subscribing without replay, the cached evaluations
+      // may have missed updates.
+      if (!response.positions && !response.evaluations &&
+          !response.evaluationDeltas) {
+        this.plyEvaluations.clear();
+      }
+    }
     if (response.status) {
       this.notifyObservers(
           observer => observer.onStatusReceived(response.status));
@@ -179,13 +337,68 @@ export class WebSocketFeed {
       this.notifyObservers(
           observer => observer.onGamesReceived(response.games));
     }
+    if (response.truncateFromPly != null && response.gameId != null) {
+      const gameId = response.gameId;
+      const fromPly = response.truncateFromPly;
+      for (const [key, evaluation] of this.evaluations) {
+        if (evaluation.gameId === gameId && evaluation.ply >= fromPly) {
+          this.evaluations.delete(key);
+        }
+      }
+      if (gameId === this.gameId) {
+        for (const ply of this.plyEvaluations.keys()) {
+          if (ply >= fromPly) this.plyEvaluations.delete(ply);
+        }
+      }
+      this.notifyObservers(
+          observer => observer.onPositionsTruncated(gameId, fromPly));
+    }
     if (response.positions) {
+      // The evaluations of the changed positions and the ones after them
+      // (e.g. after a takeback) are no longer valid.
+      const firstPly = Math.min(...response.positions
+                                    .filter(p => p.gameId === this.gameId)
+                                    .map(p => p.ply));
+      for (const ply of this.plyEvaluations.keys()) {
+        if (ply >= firstPly) this.plyEvaluations.delete(ply);
+      }
       this.notifyObservers(
           observer => observer.onPositionReceived(response.positions));
     }
     if (response.evaluations) {
+      for (const evaluation of response.evaluations) {
+        if (evaluation.rev != null) {
+          const key = `${evaluation.gameId}:${evaluation.ply}`;
+          this.evaluations.set(key, evaluation);
+          this.resyncing.delete(key);
+        }
+      }
+      this.cacheEvaluations(response.evaluations);
       this.notifyObservers(
           observer => observer.onEvaluationReceived(response.evaluations));
     }
+    if (response.evaluationDeltas) {
+      const evaluations: WsEvaluationData[] = [];
+      for (const delta of response.evaluationDeltas) {
+        const key = `${delta.gameId}:${delta.ply}`;
+        const prev = this.evaluations.get(key);
+        if (prev?.rev !== delta.baseRev) {
+          // Asks for the full evaluation, the deltas until it arrives can't be
+          // applied either.
+          if (!this.resyncing.has(key)) {
+            this.resyncing.add(key);
+            this.sendRequest(
+                {resyncEvaluation: {gameId: delta.gameId, ply: delta.ply}});
+          }
+          continue;
+        }
+        const evaluation = applyEvaluationDelta(prev, delta);
+        this.evaluations.set(key, evaluation);
+        evaluations.push(evaluation);
+      }
+      this.cacheEvaluations(evaluations);
+      this.notifyObservers(
+          observer => observer.onEvaluationReceived(evaluations));
+    }
   }
 }
\ No newline at end of file